@@ -2,10 +2,23 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import folium
-from folium.plugins import HeatMap, MarkerCluster
+from folium.plugins import HeatMap, HeatMapWithTime, MarkerCluster
 from streamlit_folium import folium_static
 import datetime
-from data_processor import DataProcessor
+import os
+import numpy as np
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from data_processor import DataProcessor, get_file_fingerprint
+from heatmap import DEFAULT_ZOOM, MAX_ZOOM, MIN_ZOOM
+from instrument import PROFILE_ENV, TRACER, traced
+
+# 记录本次脚本重跑的开始时间
+rerun_start = time.perf_counter()
+# 设置 TRIP_PROFILE 时记录本次重跑的耗时区间（各面板、DataProcessor 方法都记录在它下面）
+rerun_span = TRACER.start('app.rerun', profile=True)
 
 # 设置页面配置
 st.set_page_config(page_title="纽约出租车流量可视化分析", page_icon="🚕", layout="wide")
@@ -13,8 +26,53 @@ st.set_page_config(page_title="纽约出租车流量可视化分析", page_icon=
 # 页面标题
 st.title("纽约出租车流量时空可视化分析")
 
-# 初始化数据处理器
-data_processor = DataProcessor()
+# 数据文件，可通过环境变量指定多个月份，如 TRIP_DATA_FILES='fhvhv_tripdata_2024-*.parquet'
+DATA_FILES = os.environ.get('TRIP_DATA_FILES', 'data.parquet')
+# 多个服务进程时设置 TRIP_SHARED_DATA=1，各进程通过内存映射文件共享同一份数据
+SHARED_DATA = os.environ.get('TRIP_SHARED_DATA') == '1'
+# 行扫描查询的后端，'pandas'（默认）或 'duckdb'（直接扫描特征库分区，需要安装 duckdb）
+QUERY_BACKEND = os.environ.get('TRIP_QUERY_BACKEND', 'pandas')
+# 并发执行分析的线程数
+ANALYSIS_WORKERS = min(4, os.cpu_count() or 1)
+
+@st.cache_resource(show_spinner="正在加载数据...", max_entries=1)
+def load_data_processor(fingerprint):
+    """
+    按数据文件指纹缓存 DataProcessor，所有会话和重跑共享同一份数据
+    :param fingerprint: 数据文件指纹，文件变化时缓存自动失效
+    """
+    # 从特征库读取全部行程（首次加载时逐批导入），统计指标覆盖全部行程；同时构建近似查询用的样本和草图
+    return DataProcessor(DATA_FILES, shared=SHARED_DATA, approximate=True, backend=QUERY_BACKEND)
+
+
+@st.cache_resource
+def get_analysis_executor():
+    """所有会话共享的分析线程池；NumPy / sklearn 的计算大多释放 GIL，互相独立的分析可以并发执行"""
+    return ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='analysis')
+
+
+def run_concurrently(**calls):
+    """
+    在线程池中并发执行互相独立的分析（只计算数据，不调用 Streamlit 元素）
+    :param calls: 名称 -> 无参数的可调用对象
+    :return: {名称: 结果}
+    """
+    if ANALYSIS_WORKERS <= 1 or len(calls) <= 1:
+        # 单核机器上并发没有收益，直接依次执行
+        return {name: call() for name, call in calls.items()}
+    executor = get_analysis_executor()
+    # 在当前上下文的副本中执行，线程池中的区间仍然记录在当前区间下面
+    futures = {name: executor.submit(contextvars.copy_context().run, call) for name, call in calls.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+# 初始化数据处理器（命中缓存时不会重新读取数据）
+data_processor = load_data_processor(get_file_fingerprint(DATA_FILES))
+
+# 手动刷新数据缓存
+if st.sidebar.button("重新加载数据"):
+    load_data_processor.clear()
+    st.rerun()
 
 # 侧边栏 - 数据过滤选项
 st.sidebar.header("数据过滤选项")
@@ -47,8 +105,11 @@ weather_condition = st.sidebar.selectbox(
     options=["所有", "晴天", "雨天", "雪天"]
 )
 
-# 应用过滤器获取数据
-filtered_data = data_processor.filter_data(
+# 近似查询：由分层样本和草图估计，同时显示误差范围
+approximate = st.sidebar.checkbox("近似查询（显示误差范围）")
+
+# 过滤条件
+filters = dict(
     start_date=selected_date[0] if len(selected_date) > 0 else date_min,
     end_date=selected_date[1] if len(selected_date) > 1 else date_max,
     start_time=time_range[0],
@@ -60,91 +121,156 @@ filtered_data = data_processor.filter_data(
 # 主页面内容
 st.header("数据概览")
 
-# 显示数据统计信息
+# 显示数据统计信息（整小时的过滤条件直接从预聚合 cube 查询，结果按过滤条件缓存）
+with TRACER.span('panel.overview', 'app'):
+    overview = run_concurrently(
+        metrics=partial(data_processor.query_metrics, **filters, approximate=approximate),
+        trip_stats=partial(data_processor.query_trip_stats, **filters, approximate=approximate),
+    )
+metrics, trip_stats = overview['metrics'], overview['trip_stats']
+
+
+def show_metric(label, result, key, template, available=True):
+    """显示一个指标，近似查询时在下方显示 95% 误差范围"""
+    value = result.get(key)
+    if not available or value is None or np.isnan(float(value)):
+        st.metric(label, "数据不可用")
+        return
+    st.metric(label, template.format(value))
+    bounds = result.get('bounds', {}).get(key)
+    if bounds is not None:
+        st.caption(f"95% 范围：{template.format(bounds[0])} ~ {template.format(bounds[1])}")
+
+
 col1, col2, col3, col4 = st.columns(4)
 with col1:
-    st.metric("总行程数", f"{len(filtered_data):,}")
+    show_metric("总行程数", metrics, 'count', "{:,.0f}")
 with col2:
-    st.metric("平均行程时长", f"{data_processor.get_avg_trip_duration(filtered_data):.1f} 分钟")
+    show_metric("平均行程时长", metrics, 'avg_trip_duration', "{:.1f} 分钟")
 with col3:
-    avg_miles = data_processor.get_avg_trip_miles(filtered_data)
-    st.metric("平均行程距离", f"{avg_miles:.2f} 英里" if avg_miles > 0 else "数据不可用")
+    show_metric("平均行程距离", metrics, 'avg_trip_miles', "{:.2f} 英里", metrics['avg_trip_miles'] > 0)
 with col4:
-    avg_fare = data_processor.get_avg_fare(filtered_data)
-    st.metric("平均费用", f"${avg_fare:.2f}" if avg_fare > 0 else "数据不可用")
+    show_metric("平均费用", metrics, 'avg_driver_pay', "${:.2f}", metrics['avg_driver_pay'] > 0)
+
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    show_metric("时长中位数", trip_stats, 'p50_trip_duration', "{:.1f} 分钟")
+with col2:
+    show_metric("时长 P90", trip_stats, 'p90_trip_duration', "{:.1f} 分钟")
+with col3:
+    show_metric("费用 P90", trip_stats, 'p90_driver_pay', "${:.2f}")
+with col4:
+    show_metric("不同路线数", trip_stats, 'distinct_routes', "{:,.0f}")
 
-# 创建标签页
-tab1, tab2, tab3, tab4 = st.tabs(["热力图", "轨迹聚类", "时间分析", "区域分析"])
 
-# 热力图标签页
-with tab1:
+# 各分析视图都是独立的 fragment：只计算当前选中的视图，视图内的控件只重跑该视图
+@st.fragment
+@traced(name='view.heatmap', category='app')
+def heatmap_view(filters):
+    """热力图视图"""
+    view_start = time.perf_counter()
     st.subheader("出租车活动热力图")
     
-    # 热力图时间滑块
-    selected_hour = st.slider("选择小时", 0, 23, 12)
+    # 热力图精度（地图缩放级别越大，网格越细）
+    zoom_level = st.select_slider("热力图精度（缩放级别）", options=list(range(MIN_ZOOM, MAX_ZOOM + 1)), value=DEFAULT_ZOOM)
     
-    # 获取指定小时的热力图数据
-    heatmap_data = data_processor.get_heatmap_data(filtered_data, selected_hour)
+    # 全部 24 个小时的热力图层一次计算并缓存，切换小时只需查表
+    heatmap_layers = data_processor.query_hourly_heatmap_layers(**filters, zoom=zoom_level)
     
     # 创建地图
-    m = folium.Map(location=[40.7128, -74.0060], zoom_start=11)
+    m = folium.Map(location=[40.7128, -74.0060], zoom_start=zoom_level)
     
-    # 添加热力图层
-    if not heatmap_data.empty:
-        HeatMap(data=heatmap_data[['pickup_latitude', 'pickup_longitude', 'weight']].values.tolist(),
-                radius=8, max_zoom=13).add_to(m)
+    if st.checkbox("播放全天动画"):
+        # 按小时播放全天的热力变化
+        if heatmap_layers is not None:
+            HeatMapWithTime(data=heatmap_layers.frames(), index=[f"{hour:02d}:00" for hour in range(24)],
+                            radius=8, auto_play=True, max_opacity=0.8).add_to(m)
+    else:
+        # 热力图时间滑块
+        selected_hour = st.slider("选择小时", 0, 23, 12)
+        
+        # 添加热力图层，权重按最大值归一化
+        heatmap_data = heatmap_layers.layer(selected_hour) if heatmap_layers is not None else None
+        if heatmap_data is not None and not heatmap_data.empty:
+            points = heatmap_data[['pickup_latitude', 'pickup_longitude', 'weight']].values.astype(float)
+            points[:, 2] = points[:, 2] / points[:, 2].max()
+            HeatMap(data=points.tolist(), radius=8, max_zoom=13).add_to(m)
     
     # 显示地图
-    folium_static(m)
+    with TRACER.span('render.folium', 'app'):
+        folium_static(m)
+    st.caption(f"视图耗时: {time.perf_counter() - view_start:.2f} 秒")
 
-# 轨迹聚类标签页
-with tab2:
+
+@st.fragment
+@traced(name='view.route_cluster', category='app')
+def route_cluster_view(filters):
+    """轨迹聚类视图"""
+    view_start = time.perf_counter()
     st.subheader("热门路线聚类分析")
     
     # 获取聚类数据
-    cluster_data = data_processor.get_route_clusters(filtered_data)
+    cluster_data = data_processor.query_route_clusters(**filters)
     
     # 创建地图
     cluster_map = folium.Map(location=[40.7128, -74.0060], zoom_start=11)
     
-    # 添加聚类标记
+    # 全部路线合并为一个 GeoJSON 图层（每条路线一个要素），避免逐条创建 PolyLine 元素
     if cluster_data is not None:
-        for cluster in cluster_data:
-            folium.PolyLine(
-                locations=cluster['coordinates'],
-                color=cluster['color'],
-                weight=cluster['weight'],
-                opacity=0.7,
-                tooltip=f"路线: {cluster['name']} (行程数: {cluster['count']})"
-            ).add_to(cluster_map)
+        features = [{
+            'type': 'Feature',
+            # GeoJSON 使用 [lon, lat] 顺序
+            'geometry': {'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in cluster['coordinates']]},
+            'properties': {
+                'color': cluster['color'],
+                'weight': cluster['weight'],
+                'tooltip': f"路线: {cluster['name']} (行程数: {cluster['count']})",
+            },
+        } for cluster in cluster_data]
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            style_function=lambda feature: {
+                'color': feature['properties']['color'],
+                'weight': feature['properties']['weight'],
+                'opacity': 0.7,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=['tooltip'], labels=False),
+        ).add_to(cluster_map)
     
     # 显示地图
-    folium_static(cluster_map)
+    with TRACER.span('render.folium', 'app'):
+        folium_static(cluster_map)
+    st.caption(f"视图耗时: {time.perf_counter() - view_start:.2f} 秒")
+
 
-# 时间分析标签页
-with tab3:
+@st.fragment
+@traced(name='view.time_analysis', category='app')
+def time_analysis_view(filters):
+    """时间分析视图"""
+    view_start = time.perf_counter()
     st.subheader("时间分布分析")
     
-    # 获取按小时分布的数据
-    hourly_data = data_processor.get_hourly_distribution(filtered_data)
+    # 按小时分布与工作日/周末对比互相独立，并发计算
+    results = run_concurrently(
+        hourly=partial(data_processor.query_hourly_distribution, **filters),
+        comparison=partial(data_processor.query_weekday_weekend_comparison, **filters),
+    )
     
     # 创建小时分布图表
     fig_hourly = px.line(
-        hourly_data, 
+        results['hourly'], 
         x="pickup_hour", 
         y="count", 
         title="24小时行程分布",
         labels={"pickup_hour": "小时", "count": "行程数"},
         markers=True
     )
-    st.plotly_chart(fig_hourly, use_container_width=True)
-    
-    # 获取工作日vs周末的对比数据
-    weekday_vs_weekend = data_processor.get_weekday_weekend_comparison(filtered_data)
+    with TRACER.span('render.plotly', 'app'):
+        st.plotly_chart(fig_hourly, use_container_width=True)
     
     # 创建工作日vs周末对比图
     fig_comparison = px.bar(
-        weekday_vs_weekend, 
+        results['comparison'], 
         x="pickup_hour", 
         y="count", 
         color="day_type",
@@ -152,21 +278,31 @@ with tab3:
         title="工作日 vs 周末行程对比",
         labels={"pickup_hour": "小时", "count": "行程数", "day_type": "日期类型"}
     )
-    st.plotly_chart(fig_comparison, use_container_width=True)
+    with TRACER.span('render.plotly', 'app'):
+        st.plotly_chart(fig_comparison, use_container_width=True)
+    st.caption(f"视图耗时: {time.perf_counter() - view_start:.2f} 秒")
 
-# 区域分析标签页
-with tab4:
+
+@st.fragment
+@traced(name='view.zone_analysis', category='app')
+def zone_analysis_view(filters):
+    """区域分析视图"""
+    view_start = time.perf_counter()
     st.subheader("区域流量分析")
     
-    # 获取区域流量数据
-    zone_data = data_processor.get_zone_traffic(filtered_data)
+    # 区域流量与区域间流量互相独立，并发计算
+    results = run_concurrently(
+        zone_traffic=partial(data_processor.query_zone_traffic, **filters),
+        zone_flow=partial(data_processor.query_zone_flow, **filters),
+    )
     
     # 创建区域流量热力图
     fig_zone = px.choropleth_mapbox(
-        zone_data,
+        results['zone_traffic'],
         geojson=data_processor.get_zone_geojson(),
         locations="zone_id",
         color="count",
+        hover_name="zone_name",
         color_continuous_scale="Viridis",
         mapbox_style="carto-positron",
         zoom=10,
@@ -174,12 +310,11 @@ with tab4:
         opacity=0.7,
         labels={"count": "行程数"}
     )
-    st.plotly_chart(fig_zone, use_container_width=True)
-    
-    # 获取区域间流量数据
-    zone_flow = data_processor.get_zone_flow(filtered_data)
+    with TRACER.span('render.plotly', 'app'):
+        st.plotly_chart(fig_zone, use_container_width=True)
     
     # 创建区域流量图
+    zone_flow = results['zone_flow']
     fig_flow = px.scatter_mapbox(
         zone_flow,
         lat="latitude",
@@ -195,21 +330,70 @@ with tab4:
         labels={"count": "行程数", "type": "类型"}
     )
     
-    # 添加连接线
-    for _, row in zone_flow.iterrows():
-        if row['type'] == 'flow':
-            fig_flow.add_trace(
-                go.Scattermapbox(
-                    lat=[row['start_lat'], row['end_lat']],
-                    lon=[row['start_lon'], row['end_lon']],
-                    mode='lines',
-                    line=dict(width=1, color='rgba(102, 102, 102, 0.5)'),
-                    showlegend=False
-                )
+    # 添加连接线：所有连接合并为一条折线，相邻连接之间用 None 断开
+    flows = zone_flow[zone_flow['type'] == 'flow']
+    if len(flows) > 0:
+        line_lat = np.full((len(flows), 3), None, dtype=object)
+        line_lon = np.full((len(flows), 3), None, dtype=object)
+        line_lat[:, 0], line_lat[:, 1] = flows['start_lat'].values, flows['end_lat'].values
+        line_lon[:, 0], line_lon[:, 1] = flows['start_lon'].values, flows['end_lon'].values
+        fig_flow.add_trace(
+            go.Scattermapbox(
+                lat=line_lat.ravel(),
+                lon=line_lon.ravel(),
+                mode='lines',
+                line=dict(width=1, color='rgba(102, 102, 102, 0.5)'),
+                hoverinfo='skip',
+                showlegend=False
             )
+        )
     
-    st.plotly_chart(fig_flow, use_container_width=True)
+    with TRACER.span('render.plotly', 'app'):
+        st.plotly_chart(fig_flow, use_container_width=True)
+    st.caption(f"视图耗时: {time.perf_counter() - view_start:.2f} 秒")
+
+
+# 分析视图（st.tabs 会在每次重跑时执行全部标签页的内容，因此改为只渲染选中的视图）
+VIEWS = {
+    "热力图": heatmap_view,
+    "轨迹聚类": route_cluster_view,
+    "时间分析": time_analysis_view,
+    "区域分析": zone_analysis_view,
+}
+selected_view = st.radio("分析视图", options=list(VIEWS), horizontal=True, label_visibility="collapsed")
+VIEWS[selected_view](filters)
 
 # 添加页脚
 st.markdown("---")
-st.markdown("© 2024 纽约出租车流量可视化分析项目")
\ No newline at end of file
+st.markdown("© 2024 纽约出租车流量可视化分析项目")
+
+# 显示加载与重跑耗时、分析缓存状态
+cache_stats = data_processor.analysis_cache.stats()
+st.sidebar.caption(
+    f"数据加载耗时: {data_processor.load_seconds:.2f} 秒 | "
+    f"本次重跑耗时: {time.perf_counter() - rerun_start:.2f} 秒"
+)
+st.sidebar.caption(
+    f"分析缓存: 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} / 淘汰 {cache_stats['evictions']} | "
+    f"占用 {cache_stats['bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB"
+)
+
+# 性能记录面板：本次重跑各区间的耗时、行数与内存，可导出 JSON 或 Chrome trace
+rerun_span.finish()
+if TRACER.enabled:
+    spans = TRACER.run_spans(rerun_span)
+    with st.sidebar.expander(f"性能记录（{PROFILE_ENV}={','.join(sorted(TRACER.modes))}）"):
+        st.dataframe(
+            [{key: span[key] for key in ['name', 'seconds', 'rows_in', 'rows_out', 'alloc_mb', 'peak_mb', 'thread_name']}
+             for span in spans],
+            hide_index=True,
+            column_config={'seconds': st.column_config.NumberColumn(format="%.4f")}
+        )
+        st.download_button("导出 JSON", TRACER.to_json(spans), file_name=f"trace-{rerun_span.id}.json",
+                           mime="application/json")
+        st.download_button("导出 Chrome trace", TRACER.to_chrome_trace(spans),
+                           file_name=f"trace-{rerun_span.id}.chrome.json", mime="application/json")
+        st.download_button("导出最近全部记录（Chrome trace）", TRACER.to_chrome_trace(TRACER.recent_spans()),
+                           file_name="trace-recent.chrome.json", mime="application/json")
+        if rerun_span.profile_text:
+            st.code(rerun_span.profile_text)
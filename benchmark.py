@@ -0,0 +1,553 @@
+import argparse
+import datetime
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sklearn.cluster import DBSCAN
+from sklearn.preprocessing import StandardScaler
+from data_processor import DataProcessor, ROUTE_COLUMNS, get_peak_rss_mb
+
+# 纽约热门上下车地点（纬度, 经度, 标准差, 权重）
+HOTSPOTS = [
+    (40.7549, -73.9840, 0.012, 0.30),  # 中城
+    (40.7128, -74.0060, 0.010, 0.15),  # 下城
+    (40.7812, -73.9665, 0.015, 0.12),  # 上东/上西区
+    (40.6782, -73.9442, 0.025, 0.15),  # 布鲁克林
+    (40.7282, -73.7949, 0.030, 0.10),  # 皇后区
+    (40.6413, -73.7781, 0.004, 0.05),  # 肯尼迪机场
+    (40.7769, -73.8740, 0.003, 0.05),  # 拉瓜迪亚机场
+    (40.8448, -73.8648, 0.025, 0.08),  # 布朗克斯
+]
+# 集中的热门路线（上车热门地点, 下车热门地点），路线聚类基准测试中部分行程沿这些路线生成
+ROUTE_HUBS = [(0, 5), (1, 0), (6, 0), (3, 1)]
+# 热门路线起终点的抖动（度，约 30 米）
+ROUTE_JITTER = 0.0003
+# 路线聚类对比时，两种实现的聚类中心（度）与行程数（比例）允许的差异
+ROUTE_CENTER_TOLERANCE = 1e-3
+ROUTE_COUNT_TOLERANCE = 0.01
+# 24 小时的相对出行量（早晚高峰、深夜低谷）
+HOURLY_WEIGHTS = np.array([
+    3.0, 2.0, 1.4, 1.0, 1.0, 1.5, 2.5, 4.0, 5.0, 4.5, 4.2, 4.4,
+    4.6, 4.6, 4.8, 5.0, 5.3, 5.8, 6.0, 5.6, 5.0, 4.8, 4.5, 3.8
+])
+# 周末没有早高峰，深夜出行更多
+WEEKEND_HOURLY_WEIGHTS = np.array([
+    5.5, 4.8, 4.0, 2.8, 1.8, 1.2, 1.2, 1.6, 2.2, 3.0, 3.8, 4.4,
+    4.8, 4.9, 4.9, 4.9, 5.0, 5.2, 5.4, 5.4, 5.3, 5.4, 5.6, 5.8
+])
+# 周一到周日的相对出行量
+WEEKDAY_WEIGHTS = np.array([0.90, 0.95, 1.00, 1.05, 1.15, 1.20, 0.95])
+# 官方出租车区域数；各区域的上下车量近似服从 Zipf 分布（少数区域集中了大部分行程）
+N_TLC_ZONES = 263
+ZONE_ZIPF_EXPONENT = 0.9
+
+# 性能测试套件的数据规模（行数）
+SUITE_SIZES = [10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8]
+# 生成模拟数据时每批的行数（分批写入 parquet，生成时的内存占用与总行数无关）
+GENERATE_CHUNK_ROWS = 1_000_000
+# 模拟数据每天的行程数上限（接近 FHVHV 的实际日均量），行数更多时覆盖更多天
+TRIPS_PER_DAY = 650_000
+# 超过该行数时每个步骤只运行一次
+REPEAT_MAX_ROWS = 10 ** 6
+# 对比基线时允许的相对变慢（或内存增加）幅度，以及忽略的绝对差异
+DEFAULT_TOLERANCE = 0.25
+MIN_SECONDS_DELTA = 0.01
+MIN_MB_DELTA = 1.0
+# 结果文件格式版本
+RESULTS_VERSION = 1
+# 仓库中提交的基线结果（1e5 行），compare 未指定基线时使用
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+# 测试 filter_data 的过滤条件：(开始时间, 结束时间, 日期类型, 天气)
+BENCH_FILTERS = {
+    'all_day': (datetime.time(0, 0), datetime.time(23, 59), '所有', '所有'),
+    'morning_minutes': (datetime.time(7, 15), datetime.time(9, 40), '所有', '所有'),
+    'weekend_rain': (datetime.time(0, 0), datetime.time(23, 59), '周末', '雨天'),
+}
+
+
+def zone_probabilities():
+    """各区域编号（1-263）的出现概率；热门区域的位置固定，与随机种子无关"""
+    weights = 1.0 / np.arange(1, N_TLC_ZONES + 1) ** ZONE_ZIPF_EXPONENT
+    weights = weights[np.random.default_rng(0).permutation(N_TLC_ZONES)]
+    return weights / weights.sum()
+
+
+def make_synthetic_trips(n, seed=42, start='2024-01-01', days=31, decimals=None, route_share=0.0):
+    """
+    生成 FHVHV 格式的模拟行程数据（带经纬度），具有纽约的空间与时间分布特征
+    :param n: 行程数
+    :param seed: 随机种子
+    :param start: 起始日期
+    :param days: 覆盖的天数
+    :param decimals: 经纬度保留的小数位数（模拟脱敏或吸附到区域的坐标），None 表示不取整
+    :param route_share: 沿 ROUTE_HUBS 中热门路线生成的行程比例（起终点在热门地点附近小幅抖动），其余行程的起终点相互独立
+    """
+    rng = np.random.default_rng(seed)
+
+    # 时间：按星期几加权选择日期，工作日和周末使用不同的小时分布
+    weekdays = (np.datetime64(start, 'D') + np.arange(days)).astype('datetime64[D]').astype(np.int64)
+    weekdays = (weekdays + 3) % 7
+    day_weights = WEEKDAY_WEIGHTS[weekdays]
+    day = rng.choice(days, size=n, p=day_weights / day_weights.sum())
+    weekday_hour = rng.choice(24, size=n, p=HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum())
+    weekend_hour = rng.choice(24, size=n, p=WEEKEND_HOURLY_WEIGHTS / WEEKEND_HOURLY_WEIGHTS.sum())
+    hour = np.where(weekdays[day] >= 5, weekend_hour, weekday_hour)
+    seconds = day * 86400 + hour * 3600 + rng.integers(0, 3600, n)
+    pickup = np.datetime64(start, 's') + seconds.astype('timedelta64[s]')
+
+    # 空间：上下车点分别从热门地点的混合分布中抽取
+    probs = np.array([spot[3] for spot in HOTSPOTS])
+    probs = probs / probs.sum()
+    columns = {}
+    for prefix in ['pickup', 'dropoff']:
+        spot = rng.choice(len(HOTSPOTS), size=n, p=probs)
+        centers = np.array([spot_info[:3] for spot_info in HOTSPOTS])[spot]
+        columns[f'{prefix}_latitude'] = centers[:, 0] + rng.normal(0, 1, n) * centers[:, 2]
+        columns[f'{prefix}_longitude'] = centers[:, 1] + rng.normal(0, 1, n) * centers[:, 2]
+        if decimals is not None:
+            columns[f'{prefix}_latitude'] = columns[f'{prefix}_latitude'].round(decimals)
+            columns[f'{prefix}_longitude'] = columns[f'{prefix}_longitude'].round(decimals)
+
+    # 部分行程沿热门路线集中分布
+    if route_share > 0:
+        n_routes = int(n * route_share)
+        route = rng.integers(0, len(ROUTE_HUBS), n_routes)
+        for prefix, end in [('pickup', 0), ('dropoff', 1)]:
+            hubs = np.array([HOTSPOTS[hub[end]][:2] for hub in ROUTE_HUBS])[route]
+            columns[f'{prefix}_latitude'][:n_routes] = hubs[:, 0] + rng.normal(0, ROUTE_JITTER, n_routes)
+            columns[f'{prefix}_longitude'][:n_routes] = hubs[:, 1] + rng.normal(0, ROUTE_JITTER, n_routes)
+
+    # 距离与时长大致与直线距离相关
+    dist = np.hypot(columns['dropoff_latitude'] - columns['pickup_latitude'],
+                    (columns['dropoff_longitude'] - columns['pickup_longitude']) * 0.76) * 69
+    trip_miles = np.round(dist * rng.uniform(1.1, 1.5, n) + 0.3, 2)
+    duration = (trip_miles * rng.uniform(120, 360, n) + rng.integers(120, 600, n)).astype(np.int64)
+
+    return pd.DataFrame({
+        'hvfhs_license_num': 'HV0003',
+        'pickup_datetime': pickup,
+        'dropoff_datetime': pickup + duration.astype('timedelta64[s]'),
+        'PULocationID': rng.choice(N_TLC_ZONES, size=n, p=zone_probabilities()) + 1,
+        'DOLocationID': rng.choice(N_TLC_ZONES, size=n, p=zone_probabilities()) + 1,
+        'trip_miles': trip_miles,
+        'trip_time': duration,
+        'base_passenger_fare': np.round(2.5 + trip_miles * 2.2 + duration / 60 * 0.5, 2),
+        'driver_pay': np.round(trip_miles * 1.6 + duration / 60 * 0.4, 2),
+        **columns
+    })
+
+
+def legacy_route_clusters(data, min_samples=5, eps=0.01):
+    """原实现：对全部行程做 DBSCAN，再逐个聚类做布尔掩码（仅用于对比）"""
+    X = StandardScaler().fit_transform(data[ROUTE_COLUMNS])
+    clusters = DBSCAN(eps=eps, min_samples=min_samples).fit_predict(X)
+    data_with_clusters = data.copy()
+    data_with_clusters['cluster'] = clusters
+    clustered_data = data_with_clusters[data_with_clusters['cluster'] != -1]
+    results = []
+    for cluster_id in sorted(clustered_data['cluster'].unique()):
+        cluster_points = clustered_data[clustered_data['cluster'] == cluster_id]
+        results.append({
+            'count': len(cluster_points),
+            'center': [(cluster_points['pickup_latitude'].mean() + cluster_points['dropoff_latitude'].mean()) / 2,
+                       (cluster_points['pickup_longitude'].mean() + cluster_points['dropoff_longitude'].mean()) / 2],
+        })
+    return results
+
+
+def match_route_clusters(legacy, clusters):
+    """
+    检查两种实现得到的聚类是否一致：聚类数相同，且每个原实现的聚类都能一一对应到中心最近的新聚类，
+    中心与行程数的差异在允许范围内（网格吸附只会改变聚类边界上的少数行程）
+    :return: 不一致的描述列表，空列表表示一致
+    """
+    clusters = clusters or []
+    if len(legacy) != len(clusters):
+        return [f"聚类数不同: {len(legacy)} / {len(clusters)}"]
+    problems = []
+    unmatched = list(range(len(clusters)))
+    for cluster in legacy:
+        if not unmatched:
+            break
+        distances = [np.abs(np.subtract(cluster['center'], clusters[i]['center'])).max() for i in unmatched]
+        best = unmatched.pop(int(np.argmin(distances)))
+        count = clusters[best]['count']
+        if min(distances) > ROUTE_CENTER_TOLERANCE:
+            problems.append(f"中心 {np.round(cluster['center'], 4).tolist()} 没有对应的聚类")
+        elif abs(count - cluster['count']) > max(1, ROUTE_COUNT_TOLERANCE * cluster['count']):
+            problems.append(f"中心 {np.round(cluster['center'], 4).tolist()} 的行程数不同: {cluster['count']} / {count}")
+    return problems
+
+
+def timed(func, *args, **kwargs):
+    """执行函数并返回 (结果, 耗时秒数)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_route_clusters(sizes, legacy_max=300_000, decimals=None, route_share=0.2):
+    """
+    对比原 DBSCAN 实现与网格聚类实现的耗时，并检查两者得到的聚类一致
+    :param route_share: 沿热门路线生成的行程比例（均匀分布的行程找不到聚类，无法对比结果）
+    :return: 聚类不一致的数据规模及描述，空列表表示全部一致
+    """
+    print(f"坐标精度: {decimals if decimals is not None else '不取整'}，热门路线行程比例: {route_share:.0%}")
+    print(f"{'行程数':>10} {'原实现(s)':>10} {'新实现(s)':>10} {'原聚类数':>8} {'新聚类数':>8} {'结果':>6}")
+    mismatches = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            data_file = os.path.join(tmp, f'trips_{n}.parquet')
+            make_synthetic_trips(n, decimals=decimals, route_share=route_share).to_parquet(data_file)
+            processor = DataProcessor(data_file=data_file, sample_size=None)
+            data = processor.data
+
+            legacy, legacy_seconds = (None, None)
+            if n <= legacy_max:
+                legacy, legacy_seconds = timed(legacy_route_clusters, data)
+            clusters, seconds = timed(processor.get_route_clusters, data)
+
+            status = '-'
+            if legacy is not None:
+                problems = match_route_clusters(legacy, clusters)
+                status = '不一致' if problems else '一致'
+                mismatches.extend((n, problem) for problem in problems)
+            legacy_text = f"{legacy_seconds:10.2f}" if legacy_seconds is not None else f"{'跳过':>10}"
+            legacy_count = len(legacy) if legacy is not None else '-'
+            print(f"{len(data):>10,} {legacy_text} {seconds:10.2f} {legacy_count:>8} {len(clusters or []):>8} {status:>6}")
+    print(f"峰值内存: {get_peak_rss_mb()} MB")
+    for n, problem in mismatches:
+        print(f"{n:,} 行: {problem}")
+    return mismatches
+
+
+def suite_days(n):
+    """模拟数据覆盖的天数：至少一个月，行数更多时保持接近实际的日均行程数"""
+    return max(31, -(-n // TRIPS_PER_DAY))
+
+
+def write_synthetic_parquet(file_path, n, seed=42, start='2024-01-01', days=None, chunk_rows=GENERATE_CHUNK_ROWS):
+    """
+    分批生成 n 行模拟行程数据并写入 parquet 文件（每批一个行组），先写临时文件再重命名
+    :param days: 覆盖的天数，None 表示按 suite_days 计算
+    """
+    days = suite_days(n) if days is None else days
+    tmp_path = f'{file_path}.tmp-{os.getpid()}'
+    writer = None
+    try:
+        for i, offset in enumerate(range(0, n, chunk_rows)):
+            frame = make_synthetic_trips(min(chunk_rows, n - offset), seed=seed + i, start=start, days=days)
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, file_path)
+
+
+def synthetic_file(data_dir, n, seed=42):
+    """
+    某个规模的模拟数据文件，不存在时生成；每个规模单独一个目录，特征库等加载产物互不影响
+    :return: 数据文件路径
+    """
+    size_dir = os.path.join(data_dir, f'rows_{n}_seed_{seed}')
+    file_path = os.path.join(size_dir, 'trips.parquet')
+    if not os.path.exists(file_path):
+        os.makedirs(size_dir, exist_ok=True)
+        print(f"生成 {n:,} 行模拟数据: {file_path}")
+        write_synthetic_parquet(file_path, n, seed=seed)
+    return file_path
+
+
+def clear_artifacts(file_path):
+    """删除数据文件之外的加载产物（特征库、cube、草图等），用于测试冷启动"""
+    size_dir = os.path.dirname(file_path)
+    for name in os.listdir(size_dir):
+        if name == os.path.basename(file_path):
+            continue
+        path = os.path.join(size_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+class StepRecorder:
+    """记录各步骤的耗时（多次运行取最小值和中位数）与内存分配峰值"""
+
+    def __init__(self, size, repeat=3, memory=True):
+        """
+        :param repeat: 每个步骤的运行次数
+        :param memory: 是否再用 tracemalloc 运行一次，记录 Python / NumPy 分配的内存峰值
+        """
+        self.size = size
+        self.repeat = repeat
+        self.memory = memory
+        self.results = []
+
+    def add(self, step, seconds, **extra):
+        seconds = list(seconds)
+        entry = {'size': self.size, 'step': step, 'seconds': min(seconds),
+                 'median_seconds': float(np.median(seconds)), 'repeat': len(seconds)}
+        entry.update(extra)
+        self.results.append(entry)
+        memory_text = f"  分配峰值 {entry['alloc_peak_mb']:8.1f} MB" if entry.get('alloc_peak_mb') is not None else ''
+        print(f"{self.size:>12,} {step:40s} {entry['seconds']:9.3f} s{memory_text}", flush=True)
+        return entry
+
+    def run(self, step, func):
+        """计时运行 func；开启内存测量时额外运行一次"""
+        seconds = [timed(func)[1] for _ in range(self.repeat)]
+        alloc_peak_mb = None
+        if self.memory:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                func()
+                alloc_peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            finally:
+                tracemalloc.stop()
+        return self.add(step, seconds, alloc_peak_mb=alloc_peak_mb)
+
+
+def run_app_steps(recorder, file_path):
+    """
+    用 Streamlit AppTest 模拟 app.py 的首次运行、无变化重跑、修改过滤条件和切换视图
+    只有无变化重跑可以重复运行，其他步骤只运行一次（改变了缓存状态），波动较大
+    """
+    from streamlit.testing.v1 import AppTest
+
+    os.environ['TRIP_DATA_FILES'] = file_path
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'), default_timeout=3600)
+
+    def rerun(step, change=None, repeat=1):
+        if change is not None:
+            change()
+        seconds = []
+        for _ in range(repeat):
+            seconds.append(timed(app.run)[1])
+            if app.exception:
+                raise RuntimeError(f"{step} 出错: {[e.value for e in app.exception]}")
+        recorder.add(f'app[{step}]', seconds)
+
+    rerun('first_run')
+    rerun('rerun', repeat=recorder.repeat)
+    rerun('filter_change', lambda: app.sidebar.selectbox[0].set_value('雨天'))
+    for view in app.main.radio[0].options[1:]:
+        rerun(f'view:{view}', lambda: app.main.radio[0].set_value(view))
+
+
+def run_size(file_path, n, repeat=3, memory=True, app=True):
+    """
+    在独立进程中运行一个数据规模的全部测试，峰值内存（ru_maxrss）不受其他规模影响
+    加载使用与 app.py 相同的配置（特征库、近似查询结构）
+    :return: 结果列表
+    """
+    repeat = repeat if n <= REPEAT_MAX_ROWS else 1
+    recorder = StepRecorder(n, repeat, memory)
+
+    # 冷启动（构建特征库）与热启动（读取特征库）；加载的内存以进程峰值 RSS 衡量
+    clear_artifacts(file_path)
+    processor = DataProcessor(file_path, approximate=True)
+    recorder.add('load_data[cold]', [processor.load_seconds], peak_rss_mb=get_peak_rss_mb())
+    del processor
+    gc.collect()
+    processor = DataProcessor(file_path, approximate=True)
+    recorder.add('load_data[warm]', [processor.load_seconds], peak_rss_mb=get_peak_rss_mb(),
+                 rows=len(processor.data), data_mb=processor.memory_report()['bytes'] / 2 ** 20)
+
+    recorder.run('clean_data', processor.clean_data)
+
+    start_date, end_date = processor.get_date_range()
+    for name, (start_time, end_time, day_type, weather) in BENCH_FILTERS.items():
+        recorder.run(f'filter_data[{name}]',
+                     lambda: processor.filter_data(start_date, end_date, start_time, end_time, day_type, weather))
+
+    # 各项分析都在全部日期、全天的数据上运行（应用默认的过滤条件）
+    data = processor.filter_data(start_date, end_date, datetime.time(0, 0), datetime.time(23, 59))
+    analyses = {
+        'get_avg_trip_duration': lambda: processor.get_avg_trip_duration(data),
+        'get_avg_trip_miles': lambda: processor.get_avg_trip_miles(data),
+        'get_avg_fare': lambda: processor.get_avg_fare(data),
+        'get_heatmap_data': lambda: processor.get_heatmap_data(data),
+        'get_hourly_heatmap_layers': lambda: processor.get_hourly_heatmap_layers(data),
+        'get_route_clusters': lambda: processor.get_route_clusters(data),
+        'get_hourly_distribution': lambda: processor.get_hourly_distribution(data),
+        'get_weekday_weekend_comparison': lambda: processor.get_weekday_weekend_comparison(data),
+        'get_zone_traffic': lambda: processor.get_zone_traffic(data),
+        'get_od_matrix': lambda: processor.get_od_matrix(data),
+        'get_zone_flow': lambda: processor.get_zone_flow(data),
+    }
+    for name, func in analyses.items():
+        recorder.run(name, func)
+
+    if app:
+        del data, processor
+        gc.collect()
+        run_app_steps(recorder, file_path)
+    return recorder.results
+
+
+def environment_info():
+    """运行环境信息，对比结果时用于判断两次测试是否可比"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__,
+    }
+
+
+def run_suite(sizes, data_dir, output, repeat=3, memory=True, app=True, seed=42):
+    """
+    对每个数据规模运行测试套件，结果写入 JSON 文件
+    每个规模在单独的进程中运行（spawn），模拟数据在主进程中生成，不计入测试进程的峰值内存
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for n in sizes:
+        file_path = synthetic_file(data_dir, n, seed)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.extend(executor.submit(run_size, file_path, n, repeat, memory, app).result())
+        # 每个规模完成后都写入一次，长时间的测试中断时保留已完成的结果
+        save_results(output, {'version': RESULTS_VERSION, 'environment': environment_info(),
+                              'seed': seed, 'results': results})
+    print(f"结果已保存到: {output}")
+    return results
+
+
+def save_results(file_path, report):
+    """原子写入结果文件"""
+    tmp_path = f'{file_path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, file_path)
+
+
+def load_results(file_path):
+    with open(file_path, encoding='utf-8') as f:
+        report = json.load(f)
+    if report.get('version') != RESULTS_VERSION:
+        raise ValueError(f"结果文件格式版本不匹配: {file_path}")
+    return report
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    按 (规模, 步骤) 对比两次测试的耗时和内存分配峰值
+    超过基线 (1 + tolerance) 倍且绝对差异超过 MIN_SECONDS_DELTA / MIN_MB_DELTA 时视为退化
+    :return: [(规模, 步骤, 指标, 基线值, 当前值, 比值, 是否退化)]，只包含两边都有的步骤
+    """
+    base = {(entry['size'], entry['step']): entry for entry in baseline['results']}
+    rows = []
+    for entry in current['results']:
+        key = (entry['size'], entry['step'])
+        if key not in base:
+            continue
+        for metric, min_delta in [('seconds', MIN_SECONDS_DELTA), ('alloc_peak_mb', MIN_MB_DELTA),
+                                  ('peak_rss_mb', MIN_MB_DELTA)]:
+            old, new = base[key].get(metric), entry.get(metric)
+            if old is None or new is None:
+                continue
+            ratio = new / old if old > 0 else float('inf')
+            regressed = new > old * (1 + tolerance) and new - old > min_delta
+            rows.append((key[0], key[1], metric, old, new, ratio, regressed))
+    return rows
+
+
+def environment_differences(current, baseline):
+    """两次测试运行环境中不同的项（提交、时间除外），不同时耗时对比的意义有限"""
+    ignored = {'created', 'commit'}
+    old, new = baseline.get('environment', {}), current.get('environment', {})
+    return {key: (old.get(key), new.get(key)) for key in sorted(set(old) | set(new))
+            if key not in ignored and old.get(key) != new.get(key)}
+
+
+def compare_reports(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """对比两个结果文件并打印，运行环境不同时先给出提示，返回退化的项数"""
+    for key, (old, new) in environment_differences(current, baseline).items():
+        print(f"注意: 运行环境不同 {key}: 基线 {old}，当前 {new}")
+    return print_comparison(compare_results(current, baseline, tolerance), tolerance)
+
+
+def print_comparison(rows, tolerance=DEFAULT_TOLERANCE):
+    """打印对比结果，返回退化的项数"""
+    print(f"{'行程数':>12} {'步骤':40s} {'指标':14s} {'基线':>10} {'当前':>10} {'比值':>7}")
+    for size, step, metric, old, new, ratio, regressed in rows:
+        flag = '  退化' if regressed else ''
+        print(f"{size:>12,} {step:40s} {metric:14s} {old:10.3f} {new:10.3f} {ratio:7.2f}{flag}")
+    regressions = sum(row[-1] for row in rows)
+    print(f"共对比 {len(rows)} 项，{regressions} 项超过基线 {tolerance:.0%} 以上")
+    return regressions
+
+
+def parse_size(text):
+    """解析行数，支持 1e6 这样的写法"""
+    return int(float(text))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DataProcessor 性能测试")
+    commands = parser.add_subparsers(dest='command')
+
+    suite_parser = commands.add_parser('suite', help="在模拟数据上测试加载、过滤、各项分析和应用重跑的耗时与内存")
+    suite_parser.add_argument('--sizes', type=parse_size, nargs='+', default=SUITE_SIZES[:2],
+                              help="数据规模（行数），完整套件为 1e5 1e6 1e7 1e8")
+    suite_parser.add_argument('--data-dir', default='benchmark_data', help="模拟数据目录（已生成的数据会复用）")
+    suite_parser.add_argument('--output', default='benchmark_results.json', help="结果文件")
+    suite_parser.add_argument('--baseline', default=None, help="基线结果文件，指定时对比并在退化时返回非零状态")
+    suite_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="允许的相对退化幅度")
+    suite_parser.add_argument('--repeat', type=int, default=3, help=f"每个步骤的运行次数（超过 {REPEAT_MAX_ROWS:,} 行时为 1）")
+    suite_parser.add_argument('--seed', type=int, default=42, help="模拟数据的随机种子")
+    suite_parser.add_argument('--no-memory', action='store_true', help="不测量内存分配峰值")
+    suite_parser.add_argument('--no-app', action='store_true', help="不模拟 app.py 重跑")
+
+    compare_parser = commands.add_parser('compare', help="对比两个结果文件")
+    compare_parser.add_argument('current', help="当前结果文件")
+    compare_parser.add_argument('baseline', nargs='?', default=DEFAULT_BASELINE, help="基线结果文件")
+    compare_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="允许的相对退化幅度")
+
+    routes_parser = commands.add_parser('routes', help="对比原 DBSCAN 实现与网格聚类实现的耗时")
+    routes_parser.add_argument('--sizes', type=parse_size, nargs='+', default=[10_000, 100_000, 300_000, 1_000_000])
+    routes_parser.add_argument('--legacy-max', type=int, default=300_000, help="原实现只在不超过该行数时运行")
+    routes_parser.add_argument('--decimals', type=int, default=None, help="经纬度保留的小数位数")
+    routes_parser.add_argument('--route-share', type=float, default=0.2, help="沿热门路线生成的行程比例")
+    args = parser.parse_args()
+
+    if args.command == 'suite':
+        run_suite(args.sizes, args.data_dir, args.output, args.repeat, not args.no_memory, not args.no_app, args.seed)
+        if args.baseline:
+            regressions = compare_reports(load_results(args.output), load_results(args.baseline), args.tolerance)
+            sys.exit(1 if regressions else 0)
+    elif args.command == 'compare':
+        regressions = compare_reports(load_results(args.current), load_results(args.baseline), args.tolerance)
+        sys.exit(1 if regressions else 0)
+    elif args.command == 'routes':
+        mismatches = benchmark_route_clusters(args.sizes, args.legacy_max, args.decimals, args.route_share)
+        sys.exit(1 if mismatches else 0)
+    else:
+        parser.print_help()
@@ -0,0 +1,229 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# cube 文件格式版本，结构变化时递增以便重建
+CUBE_VERSION = 1
+
+# 聚合的度量列，每个度量保存非空计数、和、平方和
+CUBE_MEASURES = ['trip_duration', 'trip_miles', 'driver_pay']
+
+
+def stat_columns():
+    """cube 中每个单元格保存的统计量列名"""
+    columns = ['count']
+    for measure in CUBE_MEASURES:
+        columns.extend([f'{measure}_n', f'{measure}_sum', f'{measure}_sumsq'])
+    return columns
+
+
+class TripCube:
+    """
+    按 (日期, 小时, 上车区域) 预聚合的行程统计
+    工作日/周末和天气都由日期决定，作为日期属性保存，不单独作为维度
+    """
+
+    def __init__(self, cells, weather_by_day, measures):
+        """
+        :param cells: 单元格 DataFrame，列为 day（datetime64[D] 天数）、hour、zone 以及 stat_columns()
+        :param weather_by_day: {天数: 天气编码}
+        :param measures: 源数据中存在的度量列
+        """
+        self.cells = cells
+        self.weather_by_day = weather_by_day
+        self.measures = list(measures)
+
+        # 日期属性
+        self.days = np.array(sorted(weather_by_day), dtype=np.int64)
+        self.dates = self.days.astype('datetime64[D]')
+        # 1970-01-01 是星期四，(天数 + 3) % 7 即 dayofweek（周一为 0）
+        self.is_weekend = (self.days + 3) % 7 >= 5
+        self.weather = np.array([weather_by_day[day] for day in self.days], dtype=np.int8)
+
+        # 单元格所属日期的下标
+        self.cell_day_index = np.searchsorted(self.days, cells['day'].values)
+        self.cell_hours = cells['hour'].values.astype(np.intp)
+        self.cell_zones = cells['zone'].values.astype(np.intp)
+
+        # 按 (日期, 小时) 汇总的稠密数组，用于关键指标和时间分布查询
+        stats = cells[stat_columns()].values.astype(np.float64)
+        self.daily_hourly = np.zeros((len(self.days), 24, stats.shape[1]))
+        np.add.at(self.daily_hourly, (self.cell_day_index, self.cell_hours), stats)
+
+    @classmethod
+    def from_frame(cls, data, weather_codes):
+        """
+        从行程数据构建 cube
+        :param data: 包含 pickup_datetime、pickup_hour 的行程数据（可选 pickup_zone 与度量列）
+        :param weather_codes: 每行的天气编码数组
+        """
+        days = data['pickup_datetime'].values.astype('datetime64[D]').astype(np.int64)
+        hours = data['pickup_hour'].values.astype(np.int64)
+        zones = data['pickup_zone'].values.astype(np.int64) if 'pickup_zone' in data.columns else np.zeros(len(data), dtype=np.int64)
+        measures = [measure for measure in CUBE_MEASURES if measure in data.columns]
+
+        # 组合键：(日期, 小时, 区域) 编码为一个整数后一次性分组
+        day0 = days.min() if len(days) > 0 else 0
+        n_zones = zones.max() + 1 if len(zones) > 0 else 1
+        keys = ((days - day0) * 24 + hours) * n_zones + zones
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+        columns = {
+            'day': (unique_keys // (24 * n_zones) + day0).astype(np.int32),
+            'hour': (unique_keys // n_zones % 24).astype(np.int8),
+            'zone': (unique_keys % n_zones).astype(np.int16),
+            'count': np.bincount(inverse, minlength=len(unique_keys)).astype(np.float64),
+        }
+        for measure in CUBE_MEASURES:
+            values = data[measure].values.astype(np.float64) if measure in measures else np.full(len(data), np.nan)
+            valid = ~np.isnan(values)
+            filled = np.where(valid, values, 0.0)
+            columns[f'{measure}_n'] = np.bincount(inverse, weights=valid, minlength=len(unique_keys))
+            columns[f'{measure}_sum'] = np.bincount(inverse, weights=filled, minlength=len(unique_keys))
+            columns[f'{measure}_sumsq'] = np.bincount(inverse, weights=filled ** 2, minlength=len(unique_keys))
+
+        # 每个日期的天气编码
+        weather_by_day = {}
+        if len(days) > 0:
+            first = np.unique(days, return_index=True)
+            weather_by_day = dict(zip(first[0].tolist(), np.asarray(weather_codes)[first[1]].tolist()))
+
+        return cls(pd.DataFrame(columns), weather_by_day, measures)
+
+    @classmethod
+    def merge(cls, cubes):
+        """
+        合并多个 cube（例如按批次或按文件分别构建的 cube），相同 (日期, 小时, 区域) 单元格的统计量相加
+        各 cube 的日期可以重叠，天气由日期决定，因此直接合并
+        """
+        cubes = list(cubes)
+        if not cubes:
+            empty = {'day': np.array([], dtype=np.int32), 'hour': np.array([], dtype=np.int8),
+                     'zone': np.array([], dtype=np.int16)}
+            empty.update({column: np.array([], dtype=np.float64) for column in stat_columns()})
+            return cls(pd.DataFrame(empty), {}, [])
+        if len(cubes) == 1:
+            return cubes[0]
+
+        cells = pd.concat([cube.cells for cube in cubes], ignore_index=True)
+        cells = cells.groupby(['day', 'hour', 'zone'], as_index=False, sort=True)[stat_columns()].sum()
+        weather_by_day = {}
+        for cube in cubes:
+            weather_by_day.update(cube.weather_by_day)
+        measures = [measure for measure in CUBE_MEASURES if any(measure in cube.measures for cube in cubes)]
+        return cls(cells, weather_by_day, measures)
+
+    def subtract(self, other):
+        """
+        撤回曾经合并进来的 cube（例如删除一个月份）：相同单元格的统计量相减
+        合并是统计量相加，可交换、可结合，因此减去某个 cube 的结果与不合并它的结果一致（浮点舍入误差除外）
+        行程数减为 0 的单元格，以及不再有任何单元格的日期会被删除
+        """
+        negated = other.cells.copy()
+        negated[stat_columns()] = -negated[stat_columns()]
+        cells = pd.concat([self.cells, negated], ignore_index=True)
+        cells = cells.groupby(['day', 'hour', 'zone'], as_index=False, sort=True)[stat_columns()].sum()
+        # 行程数是整数，留 0.5 的余量吸收舍入误差
+        cells = cells[cells['count'] > 0.5].reset_index(drop=True)
+        days = set(np.unique(cells['day'].values).tolist())
+        weather_by_day = {day: code for day, code in self.weather_by_day.items() if day in days}
+        return TripCube(cells, weather_by_day, self.measures)
+
+    def between(self, start_date, end_date):
+        """只保留日期范围内的单元格（例如将按数据源构建的 cube 限制到加载的日期范围）"""
+        start = np.datetime64(start_date, 'D').astype(np.int64)
+        end = np.datetime64(end_date, 'D').astype(np.int64)
+        days = self.cells['day'].values
+        if len(days) == 0 or (days.min() >= start and days.max() <= end):
+            return self
+        cells = self.cells[(days >= start) & (days <= end)].reset_index(drop=True)
+        weather_by_day = {day: code for day, code in self.weather_by_day.items() if start <= day <= end}
+        return TripCube(cells, weather_by_day, self.measures)
+
+    def select(self, start_date, end_date, start_hour, end_hour, weekend=None, weather=None):
+        """
+        选择满足条件的日期与小时范围
+        :param weekend: True 只保留周末，False 只保留工作日，None 不限
+        :param weather: 天气编码，None 不限
+        :return: (日期掩码, 小时切片)
+        """
+        day_mask = (self.dates >= np.datetime64(start_date, 'D')) & (self.dates <= np.datetime64(end_date, 'D'))
+        if weekend is not None:
+            day_mask &= self.is_weekend == weekend
+        if weather is not None:
+            day_mask &= self.weather == weather
+        return day_mask, slice(start_hour, end_hour + 1)
+
+    def totals(self, selection):
+        """选择范围内各统计量的合计"""
+        day_mask, hours = selection
+        return self.daily_hourly[day_mask, hours].sum(axis=(0, 1))
+
+    def metrics(self, selection):
+        """
+        关键指标：行程数以及各度量的均值和标准差
+        度量列不存在时均值为 0，存在但没有数据时为 NaN（与行扫描结果一致）
+        """
+        totals = dict(zip(stat_columns(), self.totals(selection)))
+        result = {'count': int(totals['count'])}
+        for measure in CUBE_MEASURES:
+            n, total, sumsq = totals[f'{measure}_n'], totals[f'{measure}_sum'], totals[f'{measure}_sumsq']
+            if measure not in self.measures:
+                mean, std = 0, 0
+            elif n == 0:
+                mean, std = np.nan, np.nan
+            else:
+                mean = total / n
+                std = np.sqrt(max(sumsq / n - mean ** 2, 0.0))
+            result[f'avg_{measure}'] = mean
+            result[f'std_{measure}'] = std
+        return result
+
+    def hourly_counts(self, selection, weekend=None):
+        """选择范围内每小时的行程数（长度 24 的数组）"""
+        day_mask, hours = selection
+        if weekend is not None:
+            day_mask = day_mask & (self.is_weekend == weekend)
+        counts = np.zeros(24, dtype=np.int64)
+        counts[hours] = self.daily_hourly[day_mask, hours, 0].sum(axis=0).round().astype(np.int64)
+        return counts
+
+    def zone_counts(self, selection, size):
+        """选择范围内每个上车区域的行程数（以区域编号为下标）"""
+        day_mask, hours = selection
+        cell_mask = day_mask[self.cell_day_index] & (self.cell_hours >= hours.start) & (self.cell_hours < hours.stop)
+        counts = np.bincount(self.cell_zones[cell_mask], weights=self.cells['count'].values[cell_mask], minlength=size)
+        return counts.round().astype(np.int64)
+
+    def save(self, file_path, key):
+        """
+        保存 cube 到 parquet 文件
+        :param key: 构建 cube 时的数据指纹与参数，加载时用于校验
+        """
+        table = pa.Table.from_pandas(self.cells, preserve_index=False)
+        metadata = {
+            'version': CUBE_VERSION,
+            'key': key,
+            'measures': self.measures,
+            'weather_by_day': {str(day): code for day, code in self.weather_by_day.items()},
+        }
+        table = table.replace_schema_metadata({'trip_cube': json.dumps(metadata)})
+        pq.write_table(table, file_path)
+
+    @classmethod
+    def load(cls, file_path, key):
+        """从 parquet 文件加载 cube；文件不存在、版本或指纹不匹配时返回 None"""
+        if not os.path.exists(file_path):
+            return None
+        schema_metadata = pq.read_schema(file_path).metadata or {}
+        if b'trip_cube' not in schema_metadata:
+            return None
+        metadata = json.loads(schema_metadata[b'trip_cube'])
+        if metadata.get('version') != CUBE_VERSION or metadata.get('key') != key:
+            return None
+        weather_by_day = {int(day): code for day, code in metadata['weather_by_day'].items()}
+        # 不按目录名推断分区列（cube 可能保存在特征库的 source=... 目录中）
+        return cls(pq.read_table(file_path, partitioning=None).to_pandas(), weather_by_day, metadata['measures'])
@@ -1,27 +1,241 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+from data_processor import (LAT_LON_COLUMNS, LAT_RANGE, LON_RANGE, MAX_TRIP_MILES, MAX_TRIP_MINUTES,
+                            STREAM_BATCH_ROWS, find_time_column, resolve_data_files, resolve_source_columns)
+
+# 同时检查的文件数
+DEFAULT_WORKERS = 4
+
+
+def merge_statistics(values, pick):
+    """合并各行组统计信息中的最小/最大值；任一行组缺少统计信息时返回 None"""
+    if not values or any(value is None for value in values):
+        return None
+    try:
+        return pick(values)
+    except TypeError:
+        return None
+
+
+def profile_parquet(file_path):
+    """
+    只读取 parquet 文件尾部的元数据，统计行数、各列的最小/最大值与空值数、压缩率和行组布局
+    :param file_path: parquet 文件的路径
+    :return: 统计信息字典（columns 与 row_groups 为 DataFrame）
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    metadata = parquet_file.metadata
+    schema = parquet_file.schema_arrow
+    pickup_col = find_time_column(schema.names, 'pickup', fallback=True)
+
+    columns = {}
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        layout = {'row_group': i, 'rows': row_group.num_rows, 'compressed_mb': 0.0,
+                  'uncompressed_mb': row_group.total_byte_size / 2 ** 20}
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            stats = chunk.statistics
+            has_min_max = stats is not None and stats.has_min_max
+            column = columns.setdefault(chunk.path_in_schema, {
+                'column': chunk.path_in_schema,
+                'physical_type': chunk.physical_type,
+                'compression': chunk.compression,
+                'encodings': set(),
+                'mins': [], 'maxs': [], 'null_counts': [],
+                'compressed_bytes': 0, 'uncompressed_bytes': 0,
+            })
+            column['encodings'].update(chunk.encodings)
+            column['mins'].append(stats.min if has_min_max else None)
+            column['maxs'].append(stats.max if has_min_max else None)
+            column['null_counts'].append(stats.null_count if stats is not None and stats.has_null_count else None)
+            column['compressed_bytes'] += chunk.total_compressed_size
+            column['uncompressed_bytes'] += chunk.total_uncompressed_size
+            layout['compressed_mb'] += chunk.total_compressed_size / 2 ** 20
+            if chunk.path_in_schema == pickup_col:
+                layout['pickup_min'] = stats.min if has_min_max else None
+                layout['pickup_max'] = stats.max if has_min_max else None
+        row_groups.append(layout)
+
+    column_rows = []
+    for name, column in columns.items():
+        null_counts = column['null_counts']
+        column_rows.append({
+            'column': name,
+            'type': str(schema.field(name).type) if name in schema.names else column['physical_type'],
+            'min': merge_statistics(column['mins'], min),
+            'max': merge_statistics(column['maxs'], max),
+            'null_count': sum(null_counts) if null_counts and None not in null_counts else None,
+            'compressed_mb': column['compressed_bytes'] / 2 ** 20,
+            'ratio': column['uncompressed_bytes'] / column['compressed_bytes'] if column['compressed_bytes'] else None,
+            'compression': column['compression'],
+            'encodings': ','.join(sorted(column['encodings'])),
+        })
+
+    # 行组按上车时间有序且互不重叠时，按日期过滤可以用统计信息跳过大部分行组
+    bounds = [(layout.get('pickup_min'), layout.get('pickup_max')) for layout in row_groups]
+    sorted_by_pickup = None
+    if pickup_col is not None and bounds and all(low is not None and high is not None for low, high in bounds):
+        sorted_by_pickup = all(previous[1] <= current[0] for previous, current in zip(bounds, bounds[1:]))
+
+    compressed = sum(column['compressed_bytes'] for column in columns.values())
+    uncompressed = sum(column['uncompressed_bytes'] for column in columns.values())
+    return {
+        'file': file_path,
+        'size_mb': os.path.getsize(file_path) / 2 ** 20,
+        'rows': metadata.num_rows,
+        'num_columns': len(schema.names),
+        'num_row_groups': metadata.num_row_groups,
+        'created_by': metadata.created_by,
+        'ratio': uncompressed / compressed if compressed else None,
+        'pickup_column': pickup_col,
+        'sorted_by_pickup': sorted_by_pickup,
+        'columns': pd.DataFrame(column_rows),
+        'row_groups': pd.DataFrame(row_groups),
+    }
+
+
+def print_profile(profile):
+    """打印 profile_parquet 的结果"""
+    print(f"===== {profile['file']} =====")
+    print(f"文件大小: {profile['size_mb']:.2f} MB")
+    print(f"行数: {profile['rows']:,}")
+    print(f"列数: {profile['num_columns']}")
+    print(f"行组数: {profile['num_row_groups']}")
+    if profile['ratio'] is not None:
+        print(f"压缩率（未压缩 / 压缩）: {profile['ratio']:.2f}")
+    print(f"写入程序: {profile['created_by']}")
+    if profile['sorted_by_pickup'] is not None:
+        state = "有序，按日期过滤时可以跳过行组" if profile['sorted_by_pickup'] else "无序或有重叠，按日期过滤时需要扫描更多行组"
+        print(f"行组的上车时间（{profile['pickup_column']}）: {state}")
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print("\n===== 字段信息 =====")
+        print(profile['columns'].to_string(index=False))
+        print("\n===== 行组布局 =====")
+        print(profile['row_groups'].to_string(index=False))
+
+
+def check_rules(schema_names):
+    """
+    与 DataProcessor 清洗规则（build_source_filter、clean_frame）一致的检查项
+    :return: (需要读取的列, [(检查项名称, 计算异常掩码的函数)])；空值、NaN 都算异常（清洗时同样被移除）
+    """
+    pickup_col = find_time_column(schema_names, 'pickup', fallback=True)
+    dropoff_col = find_time_column(schema_names, 'drop')
+    rules = []
+    if pickup_col is not None:
+        rules.append(('上车时间缺失', lambda batch: np.isnat(batch[pickup_col])))
+    if 'trip_miles' in schema_names:
+        rules.append((f'行程距离不在 [0, {MAX_TRIP_MILES})',
+                      lambda batch: ~((batch['trip_miles'] >= 0) & (batch['trip_miles'] < MAX_TRIP_MILES))))
+    if pickup_col is not None and dropoff_col is not None:
+        def duration(batch):
+            return (batch[dropoff_col] - batch[pickup_col]) / np.timedelta64(1, 'm')
+        rules.append(('下车时间缺失', lambda batch: np.isnat(batch[dropoff_col])))
+        rules.append(('行程时长为负', lambda batch: duration(batch) < 0))
+        rules.append((f'行程时长不小于 {MAX_TRIP_MINUTES} 分钟', lambda batch: duration(batch) >= MAX_TRIP_MINUTES))
+    for target_col, possible_cols in LAT_LON_COLUMNS.items():
+        source_col = next((col for col in possible_cols if col in schema_names), None)
+        if source_col is None:
+            continue
+        low, high = LAT_RANGE if 'latitude' in target_col else LON_RANGE
+        rules.append((f'{source_col} 不在 [{low}, {high}]',
+                      lambda batch, col=source_col, low=low, high=high: ~((batch[col] >= low) & (batch[col] <= high))))
+    return resolve_source_columns(schema_names), rules
+
+
+def batch_arrays(record_batch):
+    """批次转换为 NumPy 数组（空值转换为 NaN / NaT）"""
+    return {name: column.to_numpy(zero_copy_only=False)
+            for name, column in zip(record_batch.schema.names, record_batch.columns)}
+
+
+def check_parquet(file_path, batch_size=STREAM_BATCH_ROWS):
+    """
+    流式检查 parquet 文件中不满足清洗规则的行：逐批读取需要的列，向量化计算，不会同时持有整个表
+    :param batch_size: 每批的最大行数
+    :return: 检查结果字典：行数、各检查项的异常行数（一行可能违反多项）、清洗后保留的行数、上车时间范围
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    columns, rules = check_rules(parquet_file.schema_arrow.names)
+    pickup_col = find_time_column(parquet_file.schema_arrow.names, 'pickup', fallback=True)
+    counts = {name: 0 for name, _ in rules}
+    rows = kept = 0
+    pickup_min = pickup_max = None
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        batch = batch_arrays(record_batch)
+        invalid = np.zeros(record_batch.num_rows, dtype=bool)
+        for name, rule in rules:
+            mask = rule(batch)
+            counts[name] += int(np.count_nonzero(mask))
+            invalid |= mask
+        rows += record_batch.num_rows
+        kept += int(record_batch.num_rows - np.count_nonzero(invalid))
+        if pickup_col is not None:
+            times = batch[pickup_col][~np.isnat(batch[pickup_col])]
+            if len(times) > 0:
+                pickup_min = times.min() if pickup_min is None else min(pickup_min, times.min())
+                pickup_max = times.max() if pickup_max is None else max(pickup_max, times.max())
+    return {
+        'file': file_path,
+        'rows': rows,
+        'violations': counts,
+        'kept': kept,
+        'dropped': rows - kept,
+        'pickup_min': pickup_min,
+        'pickup_max': pickup_max,
+    }
+
+
+def check_files(data_file, workers=DEFAULT_WORKERS, batch_size=STREAM_BATCH_ROWS):
+    """
+    并发检查多个文件（每个线程同时只持有一批数据）
+    :param data_file: 文件路径、通配符模式或它们的列表（见 resolve_data_files）
+    :return: 按文件顺序排列的检查结果 DataFrame，每个检查项一列
+    """
+    files = resolve_data_files(data_file)
+    if not files:
+        raise FileNotFoundError(f"找不到数据文件: {data_file}")
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='check') as executor:
+        results = list(executor.map(lambda file_path: check_parquet(file_path, batch_size), files))
+    return pd.DataFrame([{**{key: value for key, value in result.items() if key != 'violations'},
+                          **result['violations']} for result in results])
+
 
 def read_and_display_parquet(file_path):
     """
-    读取 parquet 文件并展示其总体信息
+    读取 parquet 文件的元数据并展示其总体信息，只读取第一批中的前 5 行作为示例
     :param file_path: parquet 文件的路径
     """
     try:
-        # 读取 parquet 文件
-        df = pd.read_parquet(file_path)
-        
-        # 展示总体信息
-        print("===== 数据总体信息 =====")
-        print(f"行数: {len(df)}")
-        print(f"列数: {len(df.columns)}")
-        print("\n===== 字段信息 =====")
-        print(df.info())
+        print_profile(profile_parquet(file_path))
         print("\n===== 前 5 行数据 =====")
-        print(df.head())
+        first_batch = next(pq.ParquetFile(file_path).iter_batches(batch_size=5), None)
+        print(first_batch.to_pandas() if first_batch is not None else "（没有数据）")
     except Exception as e:
         print(f"读取或解析 parquet 文件时出错: {e}")
 
+
 if __name__ == "__main__":
-    # parquet 文件路径
-    file_path = "data.parquet"
-    # 读取并展示信息
-    read_and_display_parquet(file_path)
+    parser = argparse.ArgumentParser(description="从 parquet 元数据概览数据文件，并可流式检查不满足清洗规则的行")
+    parser.add_argument('files', nargs='*', default=['data.parquet'], help="数据文件或通配符模式")
+    parser.add_argument('--check', action='store_true', help="流式检查各文件中不满足清洗规则的行")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="同时检查的文件数")
+    args = parser.parse_args()
+
+    file_paths = resolve_data_files(args.files)
+    if not file_paths:
+        parser.error(f"找不到数据文件: {args.files}")
+    for path in file_paths:
+        read_and_display_parquet(path)
+        print()
+    if args.check:
+        report = check_files(file_paths, args.workers)
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print("===== 清洗规则检查 =====")
+            print(report.T.to_string(header=False))
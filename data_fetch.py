@@ -1,30 +1,202 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pyarrow.parquet as pq
 import requests
 
-def download_file(url, save_path):
+# TLC 行程数据的下载地址与数据集类型
+TLC_BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+DATASETS = ['yellow', 'green', 'fhvhv']
+# 默认下载的文件（应用默认读取的 data.parquet）
+DEFAULT_URL = f"{TLC_BASE_URL}/fhvhv_tripdata_2024-01.parquet"
+
+# 每次读取和写入的块大小
+CHUNK_SIZE = 1024 * 1024
+# 失败后的重试次数，重试时从已下载的位置继续
+MAX_RETRIES = 5
+# 同时下载的文件数
+DEFAULT_WORKERS = 4
+# 连接和读取超时（秒）
+TIMEOUT = (10, 60)
+# parquet 文件首尾的魔数
+PARQUET_MAGIC = b'PAR1'
+
+
+def tlc_file_name(dataset, month):
+    """TLC 数据文件名，如 fhvhv_tripdata_2024-01.parquet"""
+    return f"{dataset}_tripdata_{month}.parquet"
+
+
+def month_range(start_month, end_month):
+    """
+    闭区间内的月份列表
+    :param start_month: 起始月份，'YYYY-MM'
+    :param end_month: 结束月份，'YYYY-MM'
+    """
+    year, month = map(int, start_month.split('-'))
+    end_year, end_month = map(int, end_month.split('-'))
+    months = []
+    while (year, month) <= (end_year, end_month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def verify_file(file_path, expected_size=None, parquet=True):
+    """
+    检查下载的文件是否完整：大小与服务器声明的一致，parquet 首尾魔数和文件尾元数据可以解析
+    :param parquet: 是否按 parquet 文件检查
+    :raises IOError: 文件不完整或损坏
+    """
+    size = os.path.getsize(file_path)
+    if expected_size is not None and size != expected_size:
+        raise IOError(f"文件大小不一致: {file_path}（{size:,} / {expected_size:,} 字节）")
+    if not parquet:
+        return
+    with open(file_path, 'rb') as f:
+        head = f.read(4)
+        f.seek(max(size - 4, 0))
+        tail = f.read(4)
+    if head != PARQUET_MAGIC or tail != PARQUET_MAGIC:
+        raise IOError(f"不是完整的 parquet 文件: {file_path}")
+    try:
+        pq.read_metadata(file_path)
+    except Exception as e:
+        raise IOError(f"parquet 文件尾损坏: {file_path}（{e}）")
+
+
+def content_size(response, offset):
+    """从响应头得到完整文件的大小，未知时返回 None"""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    if response.status_code == 200 and 'Content-Length' in response.headers:
+        return int(response.headers['Content-Length'])
+    if response.status_code == 206 and 'Content-Length' in response.headers:
+        return offset + int(response.headers['Content-Length'])
+    return None
+
+
+def is_retryable(error):
+    """网络错误、超时、服务器错误和校验失败可以重试；文件不存在等客户端错误直接失败"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return not (400 <= status < 500) or status in (408, 429)
+    return True
+
+
+def download_file(url, save_path, retries=MAX_RETRIES, chunk_size=CHUNK_SIZE, session=None):
     """
     下载文件并保存到指定路径
+    先写入 save_path.part，中断后再次调用（或自动重试）时用 HTTP Range 请求从已下载的位置继续；
+    下载完成后校验大小和 parquet 文件尾，通过后才原子重命名为 save_path，因此 save_path 要么不存在，要么是完整的文件
     :param url: 文件的下载链接
     :param save_path: 本地保存路径
+    :param retries: 网络错误或校验失败后的重试次数
+    :param session: requests.Session，None 时新建
+    :raises requests.exceptions.RequestException: 重试后仍然下载失败
+    :raises IOError: 重试后文件仍然不完整
     """
-    try:
-        # 发送 HTTP GET 请求
-        response = requests.get(url, stream=True)
-        response.raise_for_status()  # 检查请求是否成功
-
-        # 写入文件
-        with open(save_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        print(f"文件已成功下载并保存到: {save_path}")
-    except requests.exceptions.RequestException as e:
-        print(f"下载文件时出错: {e}")
+    session = session or requests.Session()
+    part_path = f"{save_path}.part"
+    for attempt in range(retries + 1):
+        try:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+            with session.get(url, stream=True, headers=headers, timeout=TIMEOUT) as response:
+                if response.status_code == 416:
+                    # 已下载的部分不小于文件大小：可能已经下载完成，交给校验判断
+                    expected_size = content_size(response, offset)
+                else:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        # 服务器不支持 Range 请求，从头下载
+                        offset = 0
+                    expected_size = content_size(response, offset)
+                    with open(part_path, 'ab' if offset > 0 else 'wb') as file:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            file.write(chunk)
+
+            try:
+                verify_file(part_path, expected_size, parquet=save_path.endswith('.parquet'))
+            except IOError:
+                # 已下载的内容有误（例如服务器上的文件已更换），删除后从头下载
+                os.remove(part_path)
+                raise
+            os.replace(part_path, save_path)
+            print(f"文件已成功下载并保存到: {save_path}")
+            return save_path
+        except (requests.exceptions.RequestException, IOError) as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            wait = min(2 ** attempt, 30)
+            print(f"下载 {url} 时出错（{e}），{wait} 秒后重试...")
+            time.sleep(wait)
+
+
+def fetch_months(dataset, start_month, end_month, dest_dir='.', workers=DEFAULT_WORKERS,
+                 base_url=TLC_BASE_URL, overwrite=False):
+    """
+    并发下载一段月份的 TLC 行程数据
+    已存在且校验通过的文件直接跳过；单个文件失败不影响其他文件，全部结束后统一报告
+    :param dataset: 数据集类型，yellow / green / fhvhv
+    :param start_month: 起始月份，'YYYY-MM'
+    :param end_month: 结束月份，'YYYY-MM'（包含）
+    :param dest_dir: 保存目录
+    :param workers: 同时下载的文件数
+    :param overwrite: 是否重新下载已存在的文件
+    :return: 下载或已存在的文件路径列表（按月份排序）
+    :raises RuntimeError: 有文件下载失败
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"未知的数据集类型: {dataset}，可选 {DATASETS}")
+    os.makedirs(dest_dir, exist_ok=True)
+
+    jobs = {}
+    for month in month_range(start_month, end_month):
+        file_name = tlc_file_name(dataset, month)
+        save_path = os.path.join(dest_dir, file_name)
+        if not overwrite and os.path.exists(save_path):
+            try:
+                verify_file(save_path)
+                print(f"已存在，跳过: {save_path}")
+                continue
+            except IOError:
+                pass
+        jobs[save_path] = f"{base_url}/{file_name}"
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='fetch') as executor:
+        futures = {executor.submit(download_file, url, save_path): save_path for save_path, url in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failures[futures[future]] = e
+    if failures:
+        details = '; '.join(f"{os.path.basename(path)}: {error}" for path, error in sorted(failures.items()))
+        raise RuntimeError(f"{len(failures)} 个文件下载失败: {details}")
+
+    return [os.path.join(dest_dir, tlc_file_name(dataset, month)) for month in month_range(start_month, end_month)]
+
 
 if __name__ == "__main__":
-    # 下载链接
-    url = "https://d37ci6vzurychx.cloudfront.net/trip-data/fhvhv_tripdata_2024-01.parquet"
-    
-    # 本地保存路径
-    save_path = "data.parquet"
-    
-    # 下载文件
-    download_file(url, save_path)
+    parser = argparse.ArgumentParser(description="下载 NYC TLC 行程数据；不带参数时下载 2024 年 1 月的 fhvhv 数据到 data.parquet")
+    parser.add_argument('dataset', nargs='?', choices=DATASETS, help="数据集类型")
+    parser.add_argument('start_month', nargs='?', help="起始月份，如 2024-01")
+    parser.add_argument('end_month', nargs='?', help="结束月份（包含），默认与起始月份相同")
+    parser.add_argument('--dest', default='.', help="保存目录")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="同时下载的文件数")
+    parser.add_argument('--overwrite', action='store_true', help="重新下载已存在的文件")
+    args = parser.parse_args()
+
+    if args.dataset is None:
+        # 下载应用默认使用的数据文件
+        download_file(DEFAULT_URL, "data.parquet")
+    else:
+        if args.start_month is None:
+            parser.error("需要指定起始月份")
+        paths = fetch_months(args.dataset, args.start_month, args.end_month or args.start_month, args.dest,
+                             args.workers, overwrite=args.overwrite)
+        print(f"共 {len(paths)} 个文件: {', '.join(paths)}")
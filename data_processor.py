@@ -1,167 +1,874 @@
 import pandas as pd
 import numpy as np
 import datetime
+import glob
+import hashlib
+import itertools
+import math
 import os
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import StandardScaler
 import matplotlib.colors as mcolors
-import random
+from cube import TripCube
 from data_fetch import download_file
+from feature_store import FeatureStore
+from instrument import traced_methods
+from heatmap import DEFAULT_MAX_CELLS, DEFAULT_ZOOM, MAX_ZOOM, MIN_ZOOM, HourlyHeatmap, build_grids
+from memo import AnalysisCache, DEFAULT_CACHE_BYTES, memoized
+from od_matrix import ODMatrix
+from query_backend import create_backend
+from shared_data import SharedDataset
+from sketches import TripSketches
+from zones import load_taxi_zones
 
+try:
+    import resource
+except ImportError:  # Windows 下没有 resource 模块
+    resource = None
+
+# 目标经纬度列及其可能的原始列名
+LAT_LON_COLUMNS = {
+    'pickup_latitude': ['pickup_latitude', 'pickup_lat', 'start_lat'],
+    'pickup_longitude': ['pickup_longitude', 'pickup_lon', 'start_lon'],
+    'dropoff_latitude': ['dropoff_latitude', 'dropoff_lat', 'end_lat'],
+    'dropoff_longitude': ['dropoff_longitude', 'dropoff_lon', 'end_lon']
+}
+# 分析中用到的其他列
+MEASURE_COLUMNS = ['trip_miles', 'driver_pay']
+# 区域编号列及其对应的 TLC LocationID 列
+LOCATION_ID_COLUMNS = {'pickup_zone': 'PULocationID', 'dropoff_zone': 'DOLocationID'}
+
+# 模拟天气的取值及各天气出现概率
+WEATHER_CONDITIONS = ['晴天', '雨天', '雪天']
+WEATHER_PROBS = [0.7, 0.2, 0.1]
+
+# 清洗规则：纽约市经纬度范围与行程距离上限
+LAT_RANGE = (40.5, 41.0)
+LON_RANGE = (-74.3, -73.7)
+MAX_TRIP_MILES = 100
+MAX_TRIP_MINUTES = 300
+
+# 路线聚类时参与 DBSCAN 的网格单元数上限（去掉必定是噪声的稀疏单元后仍然超过时逐步加粗网格）
+ROUTE_MAX_CELLS = 200_000
+# 路线聚类的四个坐标列
+ROUTE_COLUMNS = ['pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude']
+
+# 行组采样时预留的余量（抵消清洗时被过滤掉的行）
+SAMPLE_OVERSAMPLING = 1.5
+# 行组采样时至少保留的行组数，保证覆盖整个时间跨度
+MIN_SAMPLED_ROW_GROUPS = 8
+# 流式读取时每批的最大行数（大行组再拆分成多批）
+STREAM_BATCH_ROWS = 250_000
+# 流式读取时每累积多少个批次的 cube 就合并一次，控制内存占用
+CUBE_MERGE_BATCHES = 16
+# 特征库目录名（保存在数据文件所在目录，同一目录下的各个数据文件作为不同数据源共用一个特征库，
+# 每种清洗规则一个 key=<哈希> 子目录）
+FEATURE_STORE_DIR = 'trips.features'
+# 特征库中每个数据源的聚合结果文件
+SOURCE_CUBE_FILE = '_cube.parquet'
+SOURCE_SKETCH_FILE = '_sketches.npz'
+
+
+def resolve_data_files(data_file):
+    """
+    将数据文件参数展开为文件列表
+    :param data_file: 文件路径、通配符模式（如 fhvhv_tripdata_2024-*.parquet）或它们的列表
+    :return: 已存在的文件路径列表（通配符匹配结果按文件名排序）
+    """
+    patterns = [data_file] if isinstance(data_file, (str, os.PathLike)) else list(data_file)
+    files = []
+    for pattern in map(os.fspath, patterns):
+        if any(ch in pattern for ch in '*?['):
+            files.extend(sorted(glob.glob(pattern)))
+        elif os.path.exists(pattern):
+            files.append(pattern)
+    # 去重并保持顺序
+    return list(dict.fromkeys(files))
+
+
+def get_file_fingerprint(file_path):
+    """
+    计算数据文件指纹（路径、大小、修改时间、schema），用于判断缓存是否失效
+    :param file_path: parquet 文件路径、通配符模式或路径列表（见 resolve_data_files）
+    :return: 指纹字符串；没有匹配的文件时返回 None
+    """
+    files = resolve_data_files(file_path)
+    if not files:
+        return None
+    keys = []
+    for path in files:
+        stat = os.stat(path)
+        # 只读取 parquet 文件尾部的元数据，开销很小
+        schema = pq.read_schema(path)
+        keys.append(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{schema}")
+    return hashlib.sha1('\n'.join(keys).encode('utf-8')).hexdigest()
+
+
+def source_name(file_path):
+    """数据源名：去掉目录和扩展名的文件名（例如 fhvhv_tripdata_2024-01），特征库按它区分数据源"""
+    return os.path.splitext(os.path.basename(os.fspath(file_path)))[0]
+
+
+def get_peak_rss_mb():
+    """获取当前进程的峰值内存占用（MB），不支持的平台返回 None"""
+    if resource is None:
+        return None
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_date(value):
+    """将 'YYYY-MM-DD' 字符串转换为 datetime.date，其他类型原样返回"""
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def simulate_weather(date):
+    """模拟某一天的天气；以日期为随机种子，保证每次加载、各进程之间结果一致"""
+    rng = np.random.default_rng(date.toordinal())
+    return WEATHER_CONDITIONS[rng.choice(len(WEATHER_CONDITIONS), p=WEATHER_PROBS)]
+
+
+def weather_codes(data):
+    """每行的天气编码（WEATHER_CONDITIONS 中的下标）"""
+    return pd.Categorical(data['weather'], categories=WEATHER_CONDITIONS).codes
+
+
+def find_time_column(names, keyword, fallback=False):
+    """
+    在列名中查找上车/下车时间列
+    :param names: 列名列表
+    :param keyword: 'pickup' 或 'drop'
+    :param fallback: 找不到时是否退回到第一个时间列
+    """
+    standard = 'pickup_datetime' if keyword == 'pickup' else 'dropoff_datetime'
+    if standard in names:
+        return standard
+    cols = [col for col in names if 'time' in col.lower() and keyword in col.lower()]
+    if not cols and fallback:
+        cols = [col for col in names if 'time' in col.lower()]
+    return cols[0] if cols else None
+
+
+def resolve_source_columns(names):
+    """
+    根据 parquet schema 确定分析需要读取的列（兼容不同数据源的列名）
+    :param names: 源文件的列名列表
+    :return: 需要读取的列名列表
+    """
+    columns = [find_time_column(names, 'pickup', fallback=True), find_time_column(names, 'drop')]
+    for possible_cols in LAT_LON_COLUMNS.values():
+        columns.extend(col for col in possible_cols if col in names)
+    columns.extend(col for col in MEASURE_COLUMNS if col in names)
+    columns.extend(col for col in LOCATION_ID_COLUMNS.values() if col in names)
+    # 去重并保持顺序
+    return list(dict.fromkeys(col for col in columns if col is not None))
+
+
+@traced_methods
 class DataProcessor:
-    def __init__(self):
-        # 数据文件路径
-        self.data_file = 'data.parquet'
+    def __init__(self, data_file='data.parquet', date_range=None, sample_size=None, zone_file=None,
+                 cache_bytes=DEFAULT_CACHE_BYTES, compact=True, streaming=False, feature_store=True, shared=False,
+                 approximate=False, backend='pandas'):
+        # 数据文件路径，可以是通配符模式（如 fhvhv_tripdata_2024-*.parquet）或路径列表
+        self.data_file = data_file
+        # 是否流式读取：逐个行组处理，聚合结果始终覆盖全部行程；只在 feature_store=False 时生效（特征库导入本身就是逐批的）
+        self.streaming = streaming
+        # 是否使用按日期分区的特征库：首次加载时保存清洗后的数据，之后直接读取所需日期的分区
+        self.feature_store = feature_store
+        # 是否通过内存映射文件在多个进程之间零拷贝共享处理好的数据（只读）
+        self.shared = shared
+        # 是否在导入时维护近似查询结构（分层样本、分位数草图、HyperLogLog），支持带误差范围的近似查询
+        self.approximate = approximate
+        self.sketches = None
+        # 数据源名 -> 编号（行数据的 source_id 列），特征库模式下用于增量撤回某个数据源的行
+        self.source_ids = {}
+        # 是否使用紧凑的列类型（int8 时间特征、分类天气、float32 度量）
+        self.compact = compact
+        # 按过滤条件缓存分析结果（LRU，超出内存预算时淘汰）
+        self.analysis_cache = AnalysisCache(cache_bytes)
+        # 各缩放级别的热力图网格
+        self.heatmap_grids = build_grids(LAT_RANGE, LON_RANGE)
+        # 出租车区域文件（GeoJSON 或 shapefile），None 表示自动查找
+        self.zone_file = zone_file
+        # 只加载该日期范围内的数据 (start_date, end_date)，None 表示全部
+        self.date_range = date_range
+        # 采样行数，None 表示不采样（采样需要显式指定）
+        self.sample_size = sample_size
+        # 不能由 cube 回答的查询（分钟精度的时间段、热力图、路线聚类、OD 矩阵）使用的查询后端：
+        # 'pandas' 在内存中的行数据上计算，'duckdb' 直接扫描特征库的分区文件（需要 feature_store=True）
+        self.backend = create_backend(backend, self)
         self.data_url = "https://d37ci6vzurychx.cloudfront.net/trip-data/fhvhv_tripdata_2024-01.parquet"
+        start = time.perf_counter()
+        # 初始化区域地理信息（加载数据时需要用来分配区域）
+        self.init_zone_geojson()
         # 加载数据
         self.load_data()
-        # 初始化区域地理信息
-        self.init_zone_geojson()
+        self.load_seconds = time.perf_counter() - start
+        # 记录加载时的数据文件指纹
+        self.fingerprint = get_file_fingerprint(self.data_files)
+        print(f"数据加载完成，共 {len(self.data):,} 条记录，耗时 {self.load_seconds:.2f} 秒，"
+              f"每百万行占用 {self.memory_report()['mb_per_million_rows']:.0f} MB")
         
     def load_data(self):
         """加载并预处理数据"""
+        self.data_files = resolve_data_files(self.data_file)
         # 检查数据文件是否存在
-        if not os.path.exists(self.data_file):
+        if not self.data_files:
+            if not isinstance(self.data_file, str) or any(ch in self.data_file for ch in '*?['):
+                raise FileNotFoundError(f"没有找到数据文件: {self.data_file}")
             print("数据文件不存在，正在下载...")
             # 下载数据
             download_file(self.data_url,self.data_file)
             print("数据文件下载完成。")
+            self.data_files = [self.data_file]
+        
+        if self.feature_store:
+            names = self.source_names()
+            if len(set(names)) < len(names):
+                raise ValueError(f"特征库按文件名区分数据源，数据文件不能重名: {self.data_files}")
+            # 编号按文件顺序分配，相同文件列表的各个进程编号一致（共享数据时需要）
+            self.source_ids = {name: i for i, name in enumerate(names)}
+            # 每种清洗规则（feature_store_key）使用单独的子目录，紧凑模式或区域划分不同的进程不会互相删除对方的特征库
+            self.feature_store_path = os.path.join(os.path.dirname(os.path.abspath(self.data_files[0])),
+                                                   FEATURE_STORE_DIR, f'key={self.feature_store_key()[:16]}')
+        
+        if self.shared:
+            # 其他进程已发布相同参数的数据时直接挂载，不再读取和处理
+            self.shared_dataset = SharedDataset(self.artifact_path('.shared'))
+            data = self.shared_dataset.attach(self.shared_key())
+            cube, sketches = self.load_aggregates() if data is not None else (None, None)
+            if cube is not None and (sketches is not None or not self.approximate):
+                self.data = data
+                self.cube = cube
+                self.sketches = sketches
+                self.build_filter_index()
+                self.load_stats = {'source': 'shared', 'rows_kept': len(self.data)}
+                print(f"已挂载共享数据: {self.shared_dataset.current()['file']}")
+                return
+        
+        self.prepare_data()
+        
+        if self.shared:
+            # 发布后重新挂载，本进程也改用共享的内存映射数据，释放自己的副本
+            self.shared_dataset.publish(self.data, self.shared_key())
+            self.data = self.shared_dataset.attach(self.shared_key())
+            self.build_filter_index()
+    
+    def prepare_data(self):
+        """读取、清洗并处理数据，建立日期索引和 cube"""
+        if self.feature_store:
+            # 只导入新增或变化的数据源，cube 和近似查询结构由各数据源的结果合并，再按日期分区读取行数据
+            start = time.perf_counter()
+            store = self.sync_feature_store()
+            self.cube, self.sketches = self.store_aggregates(store)
+            names = self.source_names()
+            self.data, _, _ = self.fold_batches(self.store_frames(store, names), store.num_rows(self.date_range, names),
+                                                build_cube=False)
+            self.load_stats = {
+                'files': len(self.data_files),
+                'source': 'feature_store',
+                'rows_aggregated': self.rows_aggregated,
+                'rows_kept': len(self.data),
+                'read_seconds': time.perf_counter() - start,
+                'peak_rss_mb': get_peak_rss_mb(),
+            }
+            print(f"读取统计: {self.load_stats}")
+            self.build_filter_index()
+            return
+        
+        if self.streaming:
+            # 逐个行组读取并折叠进 cube，cube 文件有效时跳过构建
+            start = time.perf_counter()
+            total_rows, batches = self.source_batches()
+            cube = self.load_cube()
+            sketches = self.load_sketches() if self.approximate else None
+            self.data, built_cube, built_sketches = self.fold_batches(
+                batches, total_rows, build_cube=cube is None, build_sketches=self.approximate and sketches is None)
+            self.load_stats = {
+                'files': len(self.data_files),
+                'source': 'stream',
+                'rows_aggregated': self.rows_aggregated,
+                'rows_kept': len(self.data),
+                'read_seconds': time.perf_counter() - start,
+                'peak_rss_mb': get_peak_rss_mb(),
+            }
+            print(f"读取统计: {self.load_stats}")
             
-        # 读取parquet文件
-        self.data = pd.read_parquet(self.data_file)
+            self.build_filter_index()
+            if cube is None:
+                self.init_cube(built_cube)
+            else:
+                self.cube = cube
+            if self.approximate:
+                self.init_sketches(sketches if sketches is not None else built_sketches)
+            return
         
+        # 读取parquet文件（列裁剪 + 谓词下推 + 行组采样）
+        self.data = self.enrich_frame(self.read_source())
+        
+        # 数据清洗：移除异常值（日期索引在添加区域编号列后建立）
+        self.data = self.clean_and_sample(self.data)
+        
+        # 预先计算上下车区域编号，过滤后的数据会直接带上这两列
+        self.data = self.finish_zone_columns(self.data)
+        
+        # 按上车时间排序并建立日期索引，加速 filter_data
+        self.build_filter_index()
+        
+        # 加载或构建预聚合 cube
+        self.init_cube()
+        
+        # 加载或构建近似查询结构
+        if self.approximate:
+            self.init_sketches()
+    
+    def enrich_frame(self, data):
+        """统一时间与经纬度列名，并添加时间特征、行程时长和模拟天气"""
         # 确保日期时间列是datetime类型
-        if 'pickup_datetime' in self.data.columns:
-            self.data['pickup_datetime'] = pd.to_datetime(self.data['pickup_datetime'])
-        else:
-            # 如果列名不同，尝试找到类似的列
-            datetime_cols = [col for col in self.data.columns if 'time' in col.lower() and 'pickup' in col.lower()]
-            if datetime_cols:
-                self.data['pickup_datetime'] = pd.to_datetime(self.data[datetime_cols[0]])
-            else:
-                # 如果找不到，使用第一个时间列
-                datetime_cols = [col for col in self.data.columns if 'time' in col.lower()]
-                if datetime_cols:
-                    self.data['pickup_datetime'] = pd.to_datetime(self.data[datetime_cols[0]])
-                else:
-                    raise ValueError("无法找到日期时间列")
+        pickup_col = find_time_column(data.columns, 'pickup', fallback=True)
+        if pickup_col is None:
+            raise ValueError("无法找到日期时间列")
+        data['pickup_datetime'] = pd.to_datetime(data[pickup_col])
         
         # 同样处理下车时间
-        if 'dropoff_datetime' in self.data.columns:
-            self.data['dropoff_datetime'] = pd.to_datetime(self.data['dropoff_datetime'])
-        else:
-            datetime_cols = [col for col in self.data.columns if 'time' in col.lower() and 'drop' in col.lower()]
-            if datetime_cols:
-                self.data['dropoff_datetime'] = pd.to_datetime(self.data[datetime_cols[0]])
+        dropoff_col = find_time_column(data.columns, 'drop')
+        if dropoff_col is not None:
+            data['dropoff_datetime'] = pd.to_datetime(data[dropoff_col])
         
         # 确保经纬度列存在
-        lat_lon_cols = {
-            'pickup_latitude': ['pickup_latitude', 'pickup_lat', 'start_lat'],
-            'pickup_longitude': ['pickup_longitude', 'pickup_lon', 'start_lon'],
-            'dropoff_latitude': ['dropoff_latitude', 'dropoff_lat', 'end_lat'],
-            'dropoff_longitude': ['dropoff_longitude', 'dropoff_lon', 'end_lon']
-        }
-        
-        for target_col, possible_cols in lat_lon_cols.items():
-            if target_col not in self.data.columns:
+        for target_col, possible_cols in LAT_LON_COLUMNS.items():
+            if target_col not in data.columns:
                 for col in possible_cols:
-                    if col in self.data.columns:
-                        self.data[target_col] = self.data[col]
+                    if col in data.columns:
+                        data[target_col] = data[col]
                         break
         
+        # 添加时间特征、行程时长和模拟天气
+        return self.add_features(data)
+    
+    def finish_zone_columns(self, data):
+        """添加上下车区域编号列；紧凑模式下随后删除不再需要的原始 LocationID 列"""
+        self.add_zone_columns(data)
+        if self.compact:
+            data = data.drop(columns=[col for col in LOCATION_ID_COLUMNS.values() if col in data.columns])
+        return data
+    
+    def add_features(self, data):
+        """添加时间特征、行程时长（分钟）和模拟天气，全部向量化计算"""
+        pickup = data['pickup_datetime']
+        days = pickup.values.astype('datetime64[D]')
+        hours = pickup.dt.hour
+        day_of_week = pickup.dt.dayofweek
+        
         # 添加额外的时间特征
-        self.data['pickup_date'] = self.data['pickup_datetime'].dt.date
-        self.data['pickup_hour'] = self.data['pickup_datetime'].dt.hour
-        self.data['pickup_day_of_week'] = self.data['pickup_datetime'].dt.dayofweek
-        self.data['is_weekend'] = self.data['pickup_day_of_week'].apply(lambda x: 1 if x >= 5 else 0)
+        if self.compact:
+            data['pickup_date'] = days.astype('datetime64[s]')
+            data['pickup_hour'] = hours.astype(np.int8)
+            data['pickup_day_of_week'] = day_of_week.astype(np.int8)
+            data['is_weekend'] = day_of_week.values >= 5
+        else:
+            data['pickup_date'] = pickup.dt.date
+            data['pickup_hour'] = hours
+            data['pickup_day_of_week'] = day_of_week
+            data['is_weekend'] = (day_of_week >= 5).astype(np.int64)
         
         # 计算行程时长（分钟）
-        if 'dropoff_datetime' in self.data.columns:
-            self.data['trip_duration'] = (self.data['dropoff_datetime'] - self.data['pickup_datetime']).dt.total_seconds() / 60
+        if 'dropoff_datetime' in data.columns:
+            duration = (data['dropoff_datetime'] - pickup).dt.total_seconds() / 60
+            data['trip_duration'] = duration.astype(np.float32) if self.compact else duration
+        
+        if self.compact:
+            for col in MEASURE_COLUMNS:
+                if col in data.columns:
+                    data[col] = data[col].astype(np.float32)
+        
+        # 模拟天气数据（实际项目中应该使用真实天气API数据）：每个日期计算一次，再按日期偏移整体映射
+        codes = np.zeros(len(data), dtype=np.int8)
+        if len(data) > 0:
+            day_numbers = days.astype(np.int64)
+            first_day = day_numbers.min()
+            span = np.arange(first_day, day_numbers.max() + 1).astype('datetime64[D]')
+            codes_by_day = np.array([WEATHER_CONDITIONS.index(simulate_weather(day.item())) for day in span], dtype=np.int8)
+            codes = codes_by_day[day_numbers - first_day]
+        if self.compact:
+            data['weather'] = pd.Categorical.from_codes(codes, categories=WEATHER_CONDITIONS)
+        else:
+            data['weather'] = np.array(WEATHER_CONDITIONS, dtype=object)[codes]
+        return data
+    
+    def memory_report(self):
+        """当前数据的内存占用：总字节数与每百万行的 MB 数"""
+        total = int(self.data.memory_usage(deep=True).sum())
+        per_million = total / max(len(self.data), 1) * 1e6 / 1024 / 1024
+        return {'rows': len(self.data), 'bytes': total, 'mb_per_million_rows': per_million}
+    
+    def build_source_filter(self, schema, use_date_range=True):
+        """
+        构造可下推到 parquet 行组统计信息的过滤表达式（与 clean_data 的规则一致）
+        :param schema: 源文件的 pyarrow schema
+        :param use_date_range: 是否包含 date_range 条件
+        :return: pyarrow 过滤表达式，无可下推条件时返回 None
+        """
+        conditions = []
+        
+        # 日期范围
+        pickup_col = find_time_column(schema.names, 'pickup', fallback=True)
+        if use_date_range and self.date_range is not None and pickup_col is not None:
+            field_type = schema.field(pickup_col).type
+            if pa.types.is_timestamp(field_type) and field_type.tz is None:
+                start_date, end_date = self.date_range
+                start = datetime.datetime.combine(start_date, datetime.time.min)
+                end = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)
+                conditions.append(pc.field(pickup_col) >= pa.scalar(start, type=field_type))
+                conditions.append(pc.field(pickup_col) < pa.scalar(end, type=field_type))
         
-        # 模拟天气数据（实际项目中应该使用真实天气API数据）
-        weather_conditions = ['晴天', '雨天', '雪天']
-        weather_probs = [0.7, 0.2, 0.1]  # 各天气出现概率
-        unique_dates = self.data['pickup_date'].unique()
-        weather_dict = {}
+        # 行程距离
+        if 'trip_miles' in schema.names:
+            conditions.append((pc.field('trip_miles') >= 0) & (pc.field('trip_miles') < MAX_TRIP_MILES))
         
-        for date in unique_dates:
-            weather_dict[date] = np.random.choice(weather_conditions, p=weather_probs)
+        # 经纬度范围
+        for target_col, possible_cols in LAT_LON_COLUMNS.items():
+            source_col = next((col for col in possible_cols if col in schema.names), None)
+            if source_col is None:
+                continue
+            low, high = LAT_RANGE if 'latitude' in target_col else LON_RANGE
+            conditions.append((pc.field(source_col) >= low) & (pc.field(source_col) <= high))
         
-        self.data['weather'] = self.data['pickup_date'].map(weather_dict)
+        if not conditions:
+            return None
+        expression = conditions[0]
+        for condition in conditions[1:]:
+            expression = expression & condition
+        return expression
+    
+    def sample_row_groups(self, fragments):
+        """
+        行组级采样：在物化之前按文件顺序等间隔抽取部分行组，保留整个时间跨度
+        :param fragments: 行组级别的 parquet 片段列表
+        :return: (保留的片段列表, 组内行采样比例)
+        """
+        if self.sample_size is None:
+            return fragments, 1.0
         
-        # 数据清洗：移除异常值
-        self.clean_data()
+        total_rows = sum(fragment.row_groups[0].num_rows for fragment in fragments)
+        target_rows = int(self.sample_size * SAMPLE_OVERSAMPLING)
+        if total_rows <= target_rows:
+            return fragments, 1.0
         
-    def clean_data(self):
-        """清洗数据，移除异常值"""
+        n_groups = max(MIN_SAMPLED_ROW_GROUPS, math.ceil(len(fragments) * target_rows / total_rows))
+        if n_groups < len(fragments):
+            indices = np.unique(np.linspace(0, len(fragments) - 1, n_groups).round().astype(int))
+            fragments = [fragments[i] for i in indices]
+        
+        selected_rows = sum(fragment.row_groups[0].num_rows for fragment in fragments)
+        return fragments, min(1.0, target_rows / selected_rows)
+    
+    def source_fragments(self, use_date_range=True, files=None):
+        """
+        打开源文件，确定读取的列和下推的过滤条件，并拆分为行组级片段
+        :param use_date_range: 是否下推 date_range 条件
+        :param files: 只读取这些源文件，None 表示全部
+        :return: (dataset, 读取的列, 过滤表达式, 行组片段列表)
+        """
+        dataset = ds.dataset(self.data_files if files is None else files, format='parquet')
+        columns = resolve_source_columns(dataset.schema.names)
+        filter_expr = self.build_source_filter(dataset.schema, use_date_range)
+        
+        # 利用行组统计信息跳过不满足条件的行组
+        fragments = [
+            row_group
+            for fragment in dataset.get_fragments(filter=filter_expr)
+            for row_group in fragment.split_by_row_group(filter_expr)
+        ]
+        return dataset, columns, filter_expr, fragments
+    
+    def read_source(self):
+        """只读取分析用到的列，并将过滤条件下推到行组统计信息"""
+        start = time.perf_counter()
+        dataset, columns, filter_expr, fragments = self.source_fragments()
+        n_row_groups = len(fragments)
+        fragments, fraction = self.sample_row_groups(fragments)
+        
+        # 逐个行组物化，组内再按比例随机抽样，峰值内存只取决于单个行组
+        rng = np.random.default_rng(42)
+        tables = []
+        for fragment in fragments:
+            table = fragment.to_table(columns=columns, filter=filter_expr)
+            if fraction < 1.0 and table.num_rows > 0:
+                table = table.filter(pa.array(rng.random(table.num_rows) < fraction))
+            tables.append(table)
+        
+        if tables:
+            table = pa.concat_tables(tables)
+        else:
+            table = dataset.schema.empty_table().select(columns)
+        
+        self.load_stats = {
+            'files': len(self.data_files),
+            'columns': f"{len(columns)}/{len(dataset.schema.names)}",
+            'row_groups': f"{len(fragments)}/{n_row_groups}",
+            'rows_read': table.num_rows,
+            'read_seconds': time.perf_counter() - start,
+            'peak_rss_mb': get_peak_rss_mb(),
+        }
+        print(f"读取统计: {self.load_stats}")
+        return table.to_pandas()
+    
+    def source_batches(self, use_date_range=True, files=None):
+        """
+        按批读取源文件的行组，每批统一列名、添加特征、清洗并分配区域
+        :param use_date_range: 是否只读取 date_range 内的数据
+        :param files: 只读取这些源文件，None 表示全部
+        :return: (源数据行数（来自元数据）, 处理后 DataFrame 的生成器)；没有数据时生成一个空 DataFrame
+        """
+        dataset, columns, filter_expr, fragments = self.source_fragments(use_date_range, files)
+        total_rows = sum(fragment.row_groups[0].num_rows for fragment in fragments)
+        
+        def generate():
+            produced = False
+            for fragment in fragments:
+                for record_batch in fragment.to_batches(columns=columns, filter=filter_expr, batch_size=STREAM_BATCH_ROWS):
+                    produced = True
+                    yield self.prepare_batch(record_batch.to_pandas())
+            if not produced:
+                yield self.prepare_batch(dataset.schema.empty_table().select(columns).to_pandas())
+        
+        return total_rows, generate()
+    
+    def prepare_batch(self, data):
+        """对一批原始数据统一列名、添加特征、清洗并分配区域"""
+        return self.finish_zone_columns(self.clean_frame(self.enrich_frame(data)))
+    
+    def fold_batches(self, batches, total_rows, build_cube=True, build_sketches=False):
+        """
+        将逐批处理好的数据折叠进 cube（及近似查询结构），并保留行用于行级分析，峰值内存只取决于单批数据和保留的行
+        cube 始终覆盖全部批次；指定 sample_size 时只按比例保留部分行（热力图、聚类、区域间流量使用）
+        :param batches: 处理后 DataFrame 的可迭代对象
+        :param total_rows: 预计的总行数，用于确定保留比例
+        :param build_cube: 是否构建 cube（cube 文件有效时不需要）
+        :param build_sketches: 是否构建近似查询结构
+        :return: (保留的行, 合并后的 cube, 合并后的近似查询结构)；不构建的部分为 None
+        """
+        fraction = 1.0
+        if self.sample_size is not None and total_rows > 0:
+            fraction = min(1.0, self.sample_size * SAMPLE_OVERSAMPLING / total_rows)
+        
+        rng = np.random.default_rng(42)
+        folded = {}
+        kept = []
+        self.rows_aggregated = 0
+        for batch in self.aggregate_batches(batches, folded, build_cube, build_sketches):
+            self.rows_aggregated += len(batch)
+            if fraction < 1.0:
+                batch = batch[rng.random(len(batch)) < fraction]
+            kept.append(batch)
+        
+        data = pd.concat(kept, ignore_index=True)
+        if self.sample_size is not None and len(data) > self.sample_size:
+            data = data.sample(n=self.sample_size, random_state=42)
+        return data, folded['cube'], folded['sketches']
+    
+    def aggregate_batches(self, batches, folded, build_cube=True, build_sketches=False):
+        """
+        原样生成每批数据，同时将其折叠进 cube 和近似查询结构
+        生成器耗尽后合并结果写入 folded['cube'] 和 folded['sketches']（不构建的部分为 None）
+        """
+        sketch_rng = np.random.default_rng(7)
+        cubes, sketches = [], []
+        for batch in batches:
+            if build_cube and len(batch) > 0:
+                cubes.append(TripCube.from_frame(batch, weather_codes(batch)))
+                if len(cubes) >= CUBE_MERGE_BATCHES:
+                    cubes = [TripCube.merge(cubes)]
+            if build_sketches:
+                sketches.append(TripSketches.from_frame(batch, sketch_rng, len(self.zones.names)))
+                if len(sketches) >= CUBE_MERGE_BATCHES:
+                    sketches = [TripSketches.merge(sketches, sketch_rng)]
+            yield batch
+        folded['cube'] = TripCube.merge(cubes) if build_cube else None
+        folded['sketches'] = TripSketches.merge(sketches, sketch_rng) if build_sketches else None
+    
+    def feature_store_key(self):
+        """特征库取决于清洗规则、模拟天气、区域划分和列类型，与日期范围和采样无关（各数据源的指纹单独记录）"""
+        return hashlib.sha1(repr((
+            LAT_RANGE, LON_RANGE, MAX_TRIP_MILES, MAX_TRIP_MINUTES,
+            WEATHER_CONDITIONS, WEATHER_PROBS, self.zones.official, self.zones.fingerprint, self.compact
+        )).encode('utf-8')).hexdigest()
+    
+    def source_names(self):
+        """当前数据文件对应的数据源名（按文件顺序）"""
+        return [source_name(file_path) for file_path in self.data_files]
+    
+    def sync_feature_store(self):
+        """
+        打开特征库，只导入尚未导入或源文件已变化的数据源；特征库版本变化时整个重建
+        （清洗规则等变化时 feature_store_key 不同，使用另一个子目录，不影响其他规则的特征库）
+        :return: FeatureStore
+        """
+        store = FeatureStore(self.feature_store_path)
+        key = self.feature_store_key()
+        if not store.is_valid(key):
+            print("特征库不存在或已过期，正在重建...")
+            store = FeatureStore.create(self.feature_store_path, key)
+        for file_path in self.data_files:
+            if not store.has_source(source_name(file_path), get_file_fingerprint(file_path)):
+                self.ingest_source(store, file_path)
+        return store
+    
+    def ingest_source(self, store, file_path):
+        """
+        从一个源文件构建数据源：逐批处理后写入特征库，同时构建该数据源的 cube 和近似查询结构
+        开销只取决于这个源文件的大小
+        :return: (cube, 近似查询结构)；不需要近似查询时后者为 None
+        """
+        name = source_name(file_path)
+        print(f"正在导入数据源 {name}...")
+        start = time.perf_counter()
+        _, batches = self.source_batches(use_date_range=False, files=[file_path])
+        folded = {}
+        store.write_source(name, get_file_fingerprint(file_path),
+                           self.aggregate_batches(batches, folded, build_sketches=self.approximate))
+        self.save_source_aggregates(store, name, folded['cube'], folded['sketches'])
+        print(f"数据源 {name} 导入完成，共 {store.num_rows(sources=[name]):,} 行，耗时 {time.perf_counter() - start:.2f} 秒")
+        return folded['cube'], folded['sketches']
+    
+    def save_source_aggregates(self, store, source, cube, sketches):
+        """将数据源的聚合结果保存在特征库的数据源目录中，以源文件指纹校验"""
+        path = store.source_path(source)
+        key = store.manifest['sources'][source]['fingerprint']
+        try:
+            if cube is not None:
+                cube.save(os.path.join(path, SOURCE_CUBE_FILE), key)
+            if sketches is not None:
+                sketches.save(os.path.join(path, SOURCE_SKETCH_FILE), key)
+        except OSError as e:
+            print(f"保存数据源 {source} 的聚合结果时出错: {e}")
+    
+    def source_aggregates(self, store, source, build=True):
+        """
+        加载数据源的 cube 和近似查询结构（不需要近似查询时后者为 None）
+        缺失时（例如导入时没有开启近似查询）从特征库读取该数据源重新构建；build 为 False 时返回 None
+        """
+        path = store.source_path(source)
+        key = store.manifest['sources'][source]['fingerprint']
+        cube = TripCube.load(os.path.join(path, SOURCE_CUBE_FILE), key)
+        sketches = TripSketches.load(os.path.join(path, SOURCE_SKETCH_FILE), key) if self.approximate else None
+        if cube is not None and (sketches is not None or not self.approximate):
+            return cube, sketches
+        if not build:
+            return None
+        
+        folded = {}
+        frames = (frame for _, frame in store.frames(sources=[source]))
+        for _ in self.aggregate_batches(frames, folded, build_cube=cube is None,
+                                        build_sketches=self.approximate and sketches is None):
+            pass
+        self.save_source_aggregates(store, source, folded['cube'], folded['sketches'])
+        return (cube if cube is not None else folded['cube'],
+                sketches if sketches is not None else folded['sketches'])
+    
+    def restrict_cube(self, cube):
+        """将数据源的 cube 限制到加载的日期范围"""
+        return cube if self.date_range is None else cube.between(*self.date_range)
+    
+    def store_aggregates(self, store, build=True):
+        """
+        合并当前各数据源的 cube（限制到 date_range）和近似查询结构
+        :param build: 数据源的聚合结果缺失时是否构建；为 False 时缺失则返回 (None, None)
+        """
+        parts = [self.source_aggregates(store, name, build) for name in self.source_names()]
+        if any(part is None for part in parts):
+            return None, None
+        cube = TripCube.merge([self.restrict_cube(cube) for cube, _ in parts])
+        sketches = TripSketches.merge([sketches for _, sketches in parts]) if self.approximate else None
+        return cube, sketches
+    
+    def store_frames(self, store, sources):
+        """从特征库逐个分区读取 date_range 内的数据，并添加 source_id 列记录每行所属的数据源"""
+        for source, frame in store.frames(self.date_range, sources):
+            frame['source_id'] = np.int16(self.source_ids.get(source, -1))
+            yield frame
+    
+    def load_aggregates(self):
+        """
+        加载已构建的 cube 和近似查询结构（不需要近似查询时后者为 None），不读取行数据
+        :return: (cube, 近似查询结构)；缺失或已过期时为 (None, None)
+        """
+        if self.feature_store:
+            store = FeatureStore(self.feature_store_path)
+            if not store.is_valid(self.feature_store_key()) or not all(
+                    store.has_source(source_name(file_path), get_file_fingerprint(file_path))
+                    for file_path in self.data_files):
+                return None, None
+            return self.store_aggregates(store, build=False)
+        cube = self.load_cube()
+        sketches = self.load_sketches() if cube is not None and self.approximate else None
+        return cube, sketches
+    
+    def add_source(self, file_path):
+        """
+        增量导入一个数据文件（例如新发布的月份）：只读取和处理这个文件，写入特征库，
+        再将它的行追加到行数据，cube 与近似查询结构和现有结果合并；开销取决于新文件，而不是全部历史数据
+        同名数据源已导入时（例如重新发布的月份）先撤回旧数据，即替换
+        :param file_path: parquet 文件路径
+        """
+        if not self.feature_store:
+            raise ValueError("增量导入需要启用特征库（feature_store=True）")
+        file_path = os.fspath(file_path)
+        name = source_name(file_path)
+        if name in self.source_names():
+            self.retract_source(name)
+        
+        start = time.perf_counter()
+        store = FeatureStore(self.feature_store_path)
+        if store.has_source(name, get_file_fingerprint(file_path)):
+            cube, sketches = self.source_aggregates(store, name)
+        else:
+            cube, sketches = self.ingest_source(store, file_path)
+        self.data_files.append(file_path)
+        self.source_ids.setdefault(name, max(self.source_ids.values(), default=-1) + 1)
+        
+        names = self.source_names()
+        rows, _, _ = self.fold_batches(self.store_frames(store, [name]), store.num_rows(self.date_range, names),
+                                       build_cube=False)
+        if len(rows) > 0:
+            data = pd.concat([self.data, rows], ignore_index=True)
+            if self.sample_size is not None and len(data) > self.sample_size:
+                data = data.sample(n=self.sample_size, random_state=42)
+            self.data = data
+        self.cube = TripCube.merge([self.cube, self.restrict_cube(cube)])
+        if self.approximate:
+            self.sketches = TripSketches.merge([self.sketches, sketches])
+        self.refresh_sources()
+        print(f"已增量导入数据源 {name}，新增 {len(rows):,} 行，耗时 {time.perf_counter() - start:.2f} 秒")
+    
+    def remove_source(self, source):
+        """
+        撤回一个已导入的数据源（例如有问题的月份）：从特征库删除，并从行数据、cube 和近似查询结构中去掉它的贡献
+        :param source: 数据文件路径或数据源名
+        """
+        if not self.feature_store:
+            raise ValueError("增量撤回需要启用特征库（feature_store=True）")
+        name = source_name(source)
+        if name not in self.source_names():
+            raise ValueError(f"数据源没有导入: {name}")
+        if len(self.data_files) == 1:
+            raise ValueError("不能撤回唯一的数据源")
+        self.retract_source(name)
+        FeatureStore(self.feature_store_path).remove_source(name)
+        self.refresh_sources()
+    
+    def retract_source(self, name):
+        """
+        删除数据源的行，并从 cube 中减去它的 cube（合并是相加，减去即撤回）
+        近似查询结构（样本、分位数草图、HyperLogLog）不能相减，由其余数据源各自的结构重新合并
+        """
+        store = FeatureStore(self.feature_store_path)
+        cube, _ = self.source_aggregates(store, name)
+        self.data_files = [file_path for file_path in self.data_files if source_name(file_path) != name]
+        self.data = self.data[self.data['source_id'].values != self.source_ids[name]]
+        self.cube = self.cube.subtract(self.restrict_cube(cube))
+        if self.approximate:
+            remaining = [self.source_aggregates(store, other)[1] for other in self.source_names()]
+            self.sketches = TripSketches.merge(remaining)
+    
+    def refresh_sources(self):
+        """数据源变化后重建日期索引并清空分析缓存（热力图、区域间流量等按过滤条件由行数据重新计算）"""
+        self.build_filter_index()
+        self.analysis_cache.clear()
+        self.fingerprint = get_file_fingerprint(self.data_files)
+        if self.shared:
+            # 发布新的数据版本，其他进程重新加载时挂载
+            self.shared_dataset.publish(self.data, self.shared_key())
+            self.data = self.shared_dataset.attach(self.shared_key())
+            self.build_filter_index()
+    
+    def clean_frame(self, data):
+        """按清洗规则移除异常值，返回过滤后的数据"""
         # 移除行程距离异常值
-        if 'trip_miles' in self.data.columns:
-            self.data = self.data[(self.data['trip_miles'] >= 0) & (self.data['trip_miles'] < 100)]
+        if 'trip_miles' in data.columns:
+            data = data[(data['trip_miles'] >= 0) & (data['trip_miles'] < MAX_TRIP_MILES)]
         
         # 移除行程时长异常值
-        if 'trip_duration' in self.data.columns:
-            self.data = self.data[(self.data['trip_duration'] >= 0) & (self.data['trip_duration'] < 300)]
+        if 'trip_duration' in data.columns:
+            data = data[(data['trip_duration'] >= 0) & (data['trip_duration'] < MAX_TRIP_MINUTES)]
         
         # 移除经纬度异常值
         lat_cols = ['pickup_latitude', 'dropoff_latitude']
         lon_cols = ['pickup_longitude', 'dropoff_longitude']
         
         for col in lat_cols:
-            if col in self.data.columns:
-                self.data = self.data[(self.data[col] >= 40.5) & (self.data[col] <= 41.0)]
+            if col in data.columns:
+                data = data[(data[col] >= LAT_RANGE[0]) & (data[col] <= LAT_RANGE[1])]
         
         for col in lon_cols:
-            if col in self.data.columns:
-                self.data = self.data[(self.data[col] >= -74.3) & (self.data[col] <= -73.7)]
-        
-        # 如果数据量太大，可以采样减少数据量
-        if len(self.data) > 100000:
-            self.data = self.data.sample(n=100000, random_state=42)
+            if col in data.columns:
+                data = data[(data[col] >= LON_RANGE[0]) & (data[col] <= LON_RANGE[1])]
+        return data
+    
+    def clean_data(self):
+        """清洗数据，移除异常值；行数据变化后重建日期索引并清空分析缓存"""
+        self.data = self.clean_and_sample(self.data)
+        self.build_filter_index()
+        self.analysis_cache.clear()
+    
+    def clean_and_sample(self, data):
+        """移除异常值，显式指定 sample_size 时采样减少数据量"""
+        data = self.clean_frame(data)
+        if self.sample_size is not None and len(data) > self.sample_size:
+            data = data.sample(n=self.sample_size, random_state=42)
+        return data
     
     def init_zone_geojson(self):
         """初始化区域地理信息"""
-        # 这里使用简化的区域数据，实际项目中应该使用真实的纽约区域GeoJSON数据
-        # 创建一个简单的区域划分（曼哈顿、布鲁克林、皇后区、布朗克斯、斯塔顿岛）
-        self.zones = {
-            1: {"name": "曼哈顿", "center": [40.7831, -73.9712]},
-            2: {"name": "布鲁克林", "center": [40.6782, -73.9442]},
-            3: {"name": "皇后区", "center": [40.7282, -73.7949]},
-            4: {"name": "布朗克斯", "center": [40.8448, -73.8648]},
-            5: {"name": "斯塔顿岛", "center": [40.5795, -74.1502]}
-        }
-        
-        # 创建简化的GeoJSON
-        self.zone_geojson = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-        
-        # 为每个区域创建一个简单的多边形
-        for zone_id, zone_info in self.zones.items():
-            center = zone_info["center"]
-            # 创建一个以中心点为基础的简单矩形
-            coords = [
-                [center[1] - 0.05, center[0] - 0.05],
-                [center[1] + 0.05, center[0] - 0.05],
-                [center[1] + 0.05, center[0] + 0.05],
-                [center[1] - 0.05, center[0] + 0.05],
-                [center[1] - 0.05, center[0] - 0.05]
-            ]
-            
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "zone_id": zone_id,
-                    "name": zone_info["name"]
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [coords]
-                }
-            }
-            
-            self.zone_geojson["features"].append(feature)
+        # 优先加载官方出租车区域文件（taxi_zones.geojson 等），不存在时使用简化的五大区划分
+        self.zones = load_taxi_zones(self.zone_file)
+        self.zone_geojson = self.zones.geojson
+    
+    def assign_zones(self, lat, lon):
+        """
+        向量化地将经纬度分配到区域
+        :param lat: 纬度数组
+        :param lon: 经度数组
+        :return: 区域编号数组（int16）
+        """
+        return self.zones.assign(lat, lon)
+    
+    def has_zone_source(self, data, prefix):
+        """判断数据能否得到上车/下车区域编号"""
+        if f'{prefix}_zone' in data.columns:
+            return True
+        if self.zones.official and LOCATION_ID_COLUMNS[f'{prefix}_zone'] in data.columns:
+            return True
+        return f'{prefix}_latitude' in data.columns and f'{prefix}_longitude' in data.columns
+    
+    def add_zone_columns(self, data):
+        """为数据添加上下车区域编号列（pickup_zone / dropoff_zone），已存在时不重复计算"""
+        for prefix in ['pickup', 'dropoff']:
+            zone_col = f'{prefix}_zone'
+            id_col = LOCATION_ID_COLUMNS[zone_col]
+            lat_col, lon_col = f'{prefix}_latitude', f'{prefix}_longitude'
+            if zone_col in data.columns:
+                continue
+            if self.zones.official and id_col in data.columns:
+                # 官方区域直接使用 LocationID，无需几何计算
+                data[zone_col] = self.zones.normalize_ids(data[id_col].values)
+            elif lat_col in data.columns and lon_col in data.columns:
+                data[zone_col] = self.assign_zones(data[lat_col].values, data[lon_col].values)
+        return data
+    
+    def get_zone_columns(self, data, columns):
+        """获取数据的区域编号列；缺失时在副本上计算，不修改传入的数据"""
+        if all(col in data.columns for col in columns):
+            return data[columns]
+        return self.add_zone_columns(data.copy())[columns]
     
     def get_date_range(self):
         """获取数据集的日期范围"""
@@ -169,35 +876,321 @@ class DataProcessor:
         max_date = self.data['pickup_datetime'].max().date()
         return min_date, max_date
     
-    def filter_data(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
-        """根据条件过滤数据"""
-        # 转换日期为datetime.date类型
-        if isinstance(start_date, str):
-            start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
-        if isinstance(end_date, str):
-            end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
+    def build_filter_index(self):
+        """按上车时间排序，并预计算每个日期的工作日/周末与天气编码"""
+        # 已排序时（例如挂载的共享数据）不复制数据
+        if not self.data['pickup_datetime'].is_monotonic_increasing:
+            self.data = self.data.sort_values('pickup_datetime', kind='stable')
+        self.data.index = pd.RangeIndex(len(self.data))
+        self.pickup_times = self.data['pickup_datetime'].values
         
-        # 日期过滤
-        filtered = self.data[(self.data['pickup_date'] >= start_date) & (self.data['pickup_date'] <= end_date)]
-        
-        # 时间过滤
-        start_minutes = start_time.hour * 60 + start_time.minute
-        end_minutes = end_time.hour * 60 + end_time.minute
+        # 每个日期第一条记录的位置
+        days = self.pickup_times.astype('datetime64[D]')
+        first_rows = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) > 0 else np.array([], dtype=int)
+        self.index_dates = days[first_rows]
+        # 1970-01-01 是星期四，(天数 + 3) % 7 即 dayofweek（周一为 0）
+        self.index_is_weekend = (self.index_dates.astype(np.int64) + 3) % 7 >= 5
+        self.index_weather = weather_codes(self.data)[first_rows].astype(np.int8)
+    
+    def sample_scale(self):
+        """
+        行扫描结果换算到全部行程的倍数（cube 的行程数 / 行数据的行数）
+        逐批读取时 cube 覆盖全部行程，行数据按 sample_size 采样后该值大于 1；未采样时为 1
+        """
+        if self.sample_size is None or self.cube is None or len(self.data) == 0:
+            return 1.0
+        return max(float(self.cube.daily_hourly[..., 0].sum()) / len(self.data), 1.0)
+    
+    def artifact_path(self, suffix):
+        """数据文件派生文件（cube、特征库）的路径：单个数据文件时保存在其旁边，多个文件时按文件列表命名"""
+        if len(self.data_files) == 1:
+            return os.path.splitext(self.data_files[0])[0] + suffix
+        digest = hashlib.sha1('\n'.join(map(os.path.abspath, self.data_files)).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(os.path.dirname(self.data_files[0]), f'trips-{digest}{suffix}')
+    
+    def cube_key(self):
+        """
+        cube 取决于源数据和加载参数（日期范围、采样、清洗规则、列类型）
+        逐批折叠（流式读取或特征库）得到的 cube 覆盖全部行程，不受采样影响
+        """
+        folded = self.streaming or self.feature_store
+        return hashlib.sha1(repr((
+            get_file_fingerprint(self.data_files), self.date_range, None if folded else self.sample_size,
+            LAT_RANGE, LON_RANGE, MAX_TRIP_MILES, MAX_TRIP_MINUTES, self.zones.official, self.zones.fingerprint, self.compact
+        )).encode('utf-8')).hexdigest()
+    
+    def shared_key(self):
+        """共享数据取决于 cube 的全部参数，以及采样和读取方式（决定保留哪些行）"""
+        return hashlib.sha1(repr((
+            self.cube_key(), self.sample_size, self.streaming, self.feature_store
+        )).encode('utf-8')).hexdigest()
+    
+    def load_cube(self):
+        """加载数据文件对应的 cube 文件；不存在或已过期时返回 None"""
+        self.cube_file = self.artifact_path('.cube.parquet')
+        return TripCube.load(self.cube_file, self.cube_key())
+    
+    def init_cube(self, cube=None):
+        """
+        加载或构建按 (日期, 小时, 上车区域) 预聚合的 cube，保存在数据文件旁
+        :param cube: 流式读取时由各批次合并得到的 cube；None 时从 self.data 构建
+        """
+        if cube is None:
+            self.cube = self.load_cube()
+            if self.cube is not None:
+                return
+            cube = TripCube.from_frame(self.data, weather_codes(self.data))
+        self.cube = cube
+        try:
+            self.cube.save(self.cube_file, self.cube_key())
+        except OSError as e:
+            print(f"保存 cube 文件时出错: {e}")
+    
+    def load_sketches(self):
+        """加载数据文件对应的近似查询结构；不存在或已过期时返回 None（与 cube 使用相同的构建参数）"""
+        self.sketch_file = self.artifact_path('.sketches.npz')
+        return TripSketches.load(self.sketch_file, self.cube_key())
+    
+    def init_sketches(self, sketches=None):
+        """
+        加载或构建近似查询结构，保存在数据文件旁
+        :param sketches: 逐批读取时合并得到的结构；None 时先尝试加载，再从 self.data 构建
+        """
+        if sketches is None:
+            self.sketches = self.load_sketches()
+            if self.sketches is not None:
+                return
+            sketches = TripSketches.from_frame(self.data, np.random.default_rng(7), len(self.zones.names))
+        self.sketches = sketches
+        try:
+            self.sketches.save(self.sketch_file, self.cube_key())
+        except OSError as e:
+            print(f"保存近似查询结构时出错: {e}")
+    
+    def sketch_selection(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
+        """
+        将过滤条件转换为近似查询的 (日期, 小时) 分层
+        :return: (分层编号数组, 各分层的准确行数, (起始分钟, 结束分钟), 完整落在时间段内的分层掩码)
+        """
+        if self.sketches is None:
+            raise ValueError("近似查询需要以 approximate=True 创建 DataProcessor")
+        weekend = {'工作日': False, '周末': True}.get(day_type)
+        weather_code = None
+        if weather != '所有':
+            weather_code = WEATHER_CONDITIONS.index(weather) if weather in WEATHER_CONDITIONS else -1
+        day_mask, hours = self.cube.select(parse_date(start_date), parse_date(end_date),
+                                           start_time.hour, end_time.hour, weekend, weather_code)
+        hour_range = np.arange(hours.start, hours.stop)
+        strata = (self.cube.days[day_mask][:, None] * 24 + hour_range[None, :]).ravel()
+        counts = self.cube.daily_hourly[day_mask][:, hours, 0].ravel()
+        minutes = (start_time.hour * 60 + start_time.minute, end_time.hour * 60 + end_time.minute)
+        hour_whole = np.ones(len(hour_range), dtype=bool)
+        if len(hour_range) > 0:
+            hour_whole[0] &= start_time.minute == 0
+            hour_whole[-1] &= end_time.minute == 59
+        whole = np.broadcast_to(hour_whole, (int(day_mask.sum()), len(hour_range))).ravel()
+        return strata, counts, minutes, whole
+    
+    def cube_selection(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
+        """
+        将过滤条件转换为 cube 的查询范围
+        :return: 查询范围；时间段不是整小时（需要分钟精度）时返回 None
+        """
+        if start_time.minute != 0 or end_time.minute != 59:
+            return None
+        weekend = {'工作日': False, '周末': True}.get(day_type)
+        weather_code = None
+        if weather != '所有':
+            weather_code = WEATHER_CONDITIONS.index(weather) if weather in WEATHER_CONDITIONS else -1
+        return self.cube.select(parse_date(start_date), parse_date(end_date),
+                                start_time.hour, end_time.hour, weekend, weather_code)
+    
+    @memoized
+    def query_metrics(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有',
+                      approximate=False):
+        """
+        按过滤条件获取关键指标（行程数、平均行程时长/距离/费用）
+        整小时的时间段直接查询 cube，否则回退到行扫描
+        :param approximate: 由分层样本估计，结果中的 bounds 为各指标的 95% 置信区间
+        """
+        if approximate:
+            strata, counts, minutes, _ = self.sketch_selection(start_date, end_date, start_time, end_time, day_type, weather)
+            result, bounds = self.sketches.metrics(strata, counts, minutes)
+            result['bounds'] = bounds
+            return result
+        selection = self.cube_selection(start_date, end_date, start_time, end_time, day_type, weather)
+        if selection is not None:
+            return self.cube.metrics(selection)
+        return self.backend.metrics(start_date, end_date, start_time, end_time, day_type, weather)
+    
+    @memoized
+    def query_trip_stats(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有',
+                         approximate=False):
+        """
+        按过滤条件获取行程时长和费用的分位数（中位数、P90）以及不同路线（上车区域, 下车区域）数
+        :param approximate: 由分位数草图和 HyperLogLog 估计，结果中的 bounds 为各指标的误差范围；
+                            草图按整小时分层，分钟精度的时间段按所在小时整体计算
+        """
+        qs = [0.5, 0.9]
+        result = {}
+        if approximate:
+            strata, _, _, whole = self.sketch_selection(start_date, end_date, start_time, end_time, day_type, weather)
+            bounds = {}
+            for measure in ['trip_duration', 'driver_pay']:
+                estimate, low, high = self.sketches.quantiles_for(measure, qs, strata)
+                for q, value, lower, upper in zip(qs, estimate, low, high):
+                    key = f'p{int(q * 100)}_{measure}'
+                    result[key] = value
+                    bounds[key] = (lower, upper)
+            distinct = self.sketches.distinct_routes(strata, whole)
+            result['distinct_routes'] = distinct[0] if distinct is not None else None
+            if distinct is not None:
+                bounds['distinct_routes'] = distinct[1:]
+            result['bounds'] = bounds
+            return result
         
-        pickup_minutes = filtered['pickup_datetime'].dt.hour * 60 + filtered['pickup_datetime'].dt.minute
-        filtered = filtered[(pickup_minutes >= start_minutes) & (pickup_minutes <= end_minutes)]
+        for measure in ['trip_duration', 'driver_pay']:
+            estimate = self.backend.quantiles(measure, qs, start_date, end_date, start_time, end_time, day_type, weather)
+            for q, value in zip(qs, estimate):
+                result[f'p{int(q * 100)}_{measure}'] = value
+        od = self.query_od_matrix(start_date, end_date, start_time, end_time, day_type, weather)
+        result['distinct_routes'] = int(np.count_nonzero(od.totals())) if od is not None else None
+        return result
+    
+    @memoized
+    def query_hourly_distribution(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
+        """按过滤条件获取按小时分布的数据，整小时的时间段直接查询 cube"""
+        selection = self.cube_selection(start_date, end_date, start_time, end_time, day_type, weather)
+        if selection is None:
+            return self.backend.hourly_distribution(start_date, end_date, start_time, end_time, day_type, weather)
+        counts = self.cube.hourly_counts(selection)
+        hours = np.flatnonzero(counts)
+        return pd.DataFrame({'pickup_hour': hours, 'count': counts[hours]})
+    
+    @memoized
+    def query_weekday_weekend_comparison(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
+        """按过滤条件获取工作日vs周末的对比数据，整小时的时间段直接查询 cube"""
+        selection = self.cube_selection(start_date, end_date, start_time, end_time, day_type, weather)
+        if selection is None:
+            return self.backend.weekday_weekend_comparison(start_date, end_date, start_time, end_time, day_type, weather)
+        # 行顺序与 groupby(['pickup_hour', 'is_weekend']) 一致
+        counts = np.column_stack([self.cube.hourly_counts(selection, weekend=False),
+                                  self.cube.hourly_counts(selection, weekend=True)])
+        hours, is_weekend = np.nonzero(counts)
+        grouped = pd.DataFrame({'pickup_hour': hours, 'is_weekend': is_weekend, 'count': counts[hours, is_weekend]})
+        return self.weekday_weekend_frame(grouped)
+    
+    @memoized
+    def query_zone_traffic(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
+        """按过滤条件获取区域流量数据，整小时的时间段直接查询 cube"""
+        selection = self.cube_selection(start_date, end_date, start_time, end_time, day_type, weather)
+        if selection is None:
+            return self.backend.zone_traffic(start_date, end_date, start_time, end_time, day_type, weather)
+        return self.zone_traffic_frame(self.cube.zone_counts(selection, len(self.zones.names)))
+    
+    @memoized
+    def query_heatmap_data(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有', hour=None,
+                           zoom=DEFAULT_ZOOM, max_cells=DEFAULT_MAX_CELLS):
+        """按过滤条件获取热力图数据"""
+        data = self.filter_data(start_date, end_date, start_time, end_time, day_type, weather)
+        return self.get_heatmap_data(data, hour, zoom, max_cells)
+    
+    @memoized
+    def query_hourly_heatmap_layers(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有',
+                                    zoom=DEFAULT_ZOOM):
+        """按过滤条件获取全部 24 个小时的热力图层"""
+        data = self.filter_data(start_date, end_date, start_time, end_time, day_type, weather)
+        return self.get_hourly_heatmap_layers(data, zoom)
+    
+    @memoized
+    def query_route_clusters(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有',
+                             min_samples=5, eps=0.01):
+        """按过滤条件获取路线聚类数据"""
+        data = self.filter_data(start_date, end_date, start_time, end_time, day_type, weather)
+        return self.get_route_clusters(data, min_samples=min_samples, eps=eps)
+    
+    @memoized
+    def query_zone_flow(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有',
+                        quantile=0.8, top_k=None):
+        """按过滤条件获取区域间流量数据"""
+        od = self.query_od_matrix(start_date, end_date, start_time, end_time, day_type, weather)
+        return self.zone_flow_frame(od, quantile, top_k)
+    
+    @memoized
+    def query_od_matrix(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有', by_hour=False):
+        """按过滤条件获取区域间起讫点（OD）矩阵"""
+        return self.backend.od_matrix(by_hour, start_date, end_date, start_time, end_time, day_type, weather)
+    
+    def filter_index(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
+        """
+        计算满足过滤条件的行位置
+        数据按上车时间排序，工作日/周末和天气都是按日期确定的，
+        因此先在日期索引上筛选出日期，再对每个日期用二分查找定位时间段对应的行范围
+        :return: 单个连续范围时返回 slice，否则返回行位置数组
+        """
+        # 转换日期为datetime.date类型
+        start_date, end_date = parse_date(start_date), parse_date(end_date)
         
-        # 工作日/周末过滤
+        # 日期、工作日/周末、天气过滤合并为一个日期掩码
+        dates = self.index_dates
+        date_mask = (dates >= np.datetime64(start_date, 'D')) & (dates <= np.datetime64(end_date, 'D'))
         if day_type == '工作日':
-            filtered = filtered[filtered['is_weekend'] == 0]
+            date_mask &= ~self.index_is_weekend
         elif day_type == '周末':
-            filtered = filtered[filtered['is_weekend'] == 1]
-        
-        # 天气过滤
+            date_mask &= self.index_is_weekend
         if weather != '所有':
-            filtered = filtered[filtered['weather'] == weather]
+            code = WEATHER_CONDITIONS.index(weather) if weather in WEATHER_CONDITIONS else -1
+            date_mask &= self.index_weather == code
+        dates = dates[date_mask]
+        
+        # 时间过滤（按分钟比较，结束分钟包含在内）
+        start_minutes = start_time.hour * 60 + start_time.minute
+        end_minutes = end_time.hour * 60 + end_time.minute
+        lower = dates + np.timedelta64(start_minutes, 'm')
+        upper = dates + np.timedelta64(end_minutes + 1, 'm')
+        starts = np.searchsorted(self.pickup_times, lower, side='left')
+        ends = np.maximum(np.searchsorted(self.pickup_times, upper, side='left'), starts)
+        
+        # 合并首尾相接的范围
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+        if len(starts) == 0:
+            return slice(0, 0)
+        breaks = np.flatnonzero(starts[1:] != ends[:-1])
+        starts = starts[np.r_[0, breaks + 1]]
+        ends = ends[np.r_[breaks, len(ends) - 1]]
+        if len(starts) == 1:
+            return slice(int(starts[0]), int(ends[0]))
         
-        return filtered
+        # 将多个范围展开为行位置数组
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+        return offsets + np.arange(lengths.sum())
+    
+    def filter_data(self, start_date, end_date, start_time, end_time, day_type='所有', weather='所有'):
+        """根据条件过滤数据（由查询后端完成）"""
+        return self.backend.filter_data(start_date, end_date, start_time, end_time, day_type, weather)
+    
+    def partition_files(self, start_date, end_date, day_type='所有', weather='所有'):
+        """
+        特征库中满足日期级过滤条件的分区文件（供列式查询后端直接扫描）
+        工作日/周末和天气都由日期决定，只需要读取清单，不读取数据
+        """
+        start_date, end_date = parse_date(start_date), parse_date(end_date)
+        if self.date_range is not None:
+            start_date = max(start_date, parse_date(self.date_range[0]))
+            end_date = min(end_date, parse_date(self.date_range[1]))
+        store = FeatureStore(self.feature_store_path)
+        files = []
+        for source in store.sources(self.source_names()):
+            for day in store.dates((start_date, end_date), [source]):
+                date = datetime.date.fromisoformat(day)
+                if day_type != '所有' and (date.weekday() >= 5) != (day_type == '周末'):
+                    continue
+                if weather != '所有' and simulate_weather(date) != weather:
+                    continue
+                files.append(store.partition_file(source, day))
+        return files
     
     def get_avg_trip_duration(self, data):
         """获取平均行程时长（分钟）"""
@@ -217,87 +1210,186 @@ class DataProcessor:
             return data["driver_pay"].mean()
         return 0
     
-    def get_heatmap_data(self, data, hour=None):
-        """获取热力图数据"""
+    def get_heatmap_data(self, data, hour=None, zoom=DEFAULT_ZOOM, max_cells=DEFAULT_MAX_CELLS):
+        """
+        获取热力图数据：将上车点按缩放级别对应的网格分箱，只返回非空单元及其行程数
+        :param zoom: 地图缩放级别，决定网格精度
+        :param max_cells: 返回的单元数上限，超过时保留行程数最多的单元
+        """
         if hour is not None:
             data = data[data['pickup_hour'] == hour]
         
-        # 确保有经纬度数据
+        # 没有经纬度时，使用区域中心点按行程数加权
         if 'pickup_latitude' not in data.columns or 'pickup_longitude' not in data.columns:
-            return pd.DataFrame()
+            if not self.zones.official or not self.has_zone_source(data, 'pickup'):
+                return pd.DataFrame()
+            zones = self.get_zone_columns(data, ['pickup_zone'])['pickup_zone'].values
+            counts = np.bincount(zones, minlength=len(self.zones.names))
+            zone_ids = self.zones.location_ids[counts[self.zones.location_ids] > 0]
+            return pd.DataFrame({
+                'pickup_latitude': self.zones.centroid_lat[zone_ids],
+                'pickup_longitude': self.zones.centroid_lon[zone_ids],
+                'weight': counts[zone_ids]
+            })
+        
+        # 按网格分箱，数据量只取决于非空单元数
+        grid = self.heatmap_grids[min(max(zoom, MIN_ZOOM), MAX_ZOOM)]
+        counts = grid.bin(data['pickup_latitude'].values, data['pickup_longitude'].values)
+        return grid.to_frame(counts, max_cells)
+    
+    def get_hourly_heatmap_layers(self, data, zoom=DEFAULT_ZOOM):
+        """
+        一次分组计算全部 24 个小时的热力图层，切换小时只需查表
+        :return: HourlyHeatmap；没有位置数据时返回 None
+        """
+        hours = data['pickup_hour'].values
+        if 'pickup_latitude' in data.columns and 'pickup_longitude' in data.columns:
+            grid = self.heatmap_grids[min(max(zoom, MIN_ZOOM), MAX_ZOOM)]
+            return grid.bin_hourly(data['pickup_latitude'].values, data['pickup_longitude'].values, hours)
         
-        # 创建热力图数据
-        heatmap_data = data[['pickup_latitude', 'pickup_longitude']].copy()
-        # 添加权重列
-        heatmap_data['weight'] = 1
+        # 没有经纬度时，以区域中心点作为单元
+        if not self.zones.official or not self.has_zone_source(data, 'pickup'):
+            return None
+        zones = self.get_zone_columns(data, ['pickup_zone'])['pickup_zone'].values.astype(np.int64)
+        size = len(self.zones.names)
+        counts = np.bincount(hours.astype(np.int64) * size + zones, minlength=24 * size).reshape(24, size)
+        zone_ids = self.zones.location_ids[counts[:, self.zones.location_ids].sum(axis=0) > 0]
+        return HourlyHeatmap(self.zones.centroid_lat[zone_ids], self.zones.centroid_lon[zone_ids], counts[:, zone_ids])
+    
+    def snap_routes(self, X, cell_size, max_cells):
+        """
+        将标准化后的起终点坐标吸附到四维网格
+        :return: (每个点所在单元的编号, 单元数, 实际使用的单元边长)
+        """
+        while True:
+            grid = np.floor(X / cell_size).astype(np.int64)
+            grid -= grid.min(axis=0)
+            sizes = grid.max(axis=0) + 1
+            # 组合键溢出或单元过多时加粗网格
+            if np.prod(sizes.astype(np.float64)) < 2 ** 62:
+                keys = np.ravel_multi_index(grid.T, sizes)
+                unique_keys, inverse = np.unique(keys, return_inverse=True)
+                if len(unique_keys) <= max_cells:
+                    return inverse, len(unique_keys), cell_size
+            cell_size *= 2
+    
+    def route_cells(self, X, inverse, n_cells):
+        """每个网格单元的行程数与单元内点的平均坐标"""
+        weights = np.bincount(inverse, minlength=n_cells)
+        centers = np.column_stack([
+            np.bincount(inverse, weights=X[:, i], minlength=n_cells) / weights for i in range(X.shape[1])
+        ])
+        return weights, centers
+    
+    def dense_route_cells(self, centers, weights, eps, min_samples):
+        """
+        找出可能属于某个聚类的网格单元，其余单元在 DBSCAN 中必定是噪声，可以在聚类前去掉
+        按边长 2*eps 的粗网格汇总行程数：点 p 的 eps 邻域内任意点 q 的 eps 邻域都落在 p 所在粗单元及其相邻粗单元（共 3^4 个）中，
+        这些粗单元的总行程数小于 min_samples 时，p 及其邻域内都没有核心点，p 是噪声；因此去掉这些单元不改变聚类结果
+        :param centers: 标准化后的单元中心（n_cells × 4）
+        :param weights: 每个单元的行程数
+        :return: 布尔掩码，True 表示保留
+        """
+        grid = np.floor(centers / (2 * eps)).astype(np.int64)
+        grid -= grid.min(axis=0)
+        sizes = grid.max(axis=0) + 3
+        if np.prod(sizes.astype(np.float64)) >= 2 ** 62:
+            return np.ones(len(centers), dtype=bool)
+        # 坐标整体加 1，相邻单元的坐标不会越界
+        grid += 1
+        keys, coarse = np.unique(np.ravel_multi_index(grid.T, sizes), return_inverse=True)
+        coarse_weights = np.bincount(coarse, weights=weights)
+        coarse_grid = np.column_stack(np.unravel_index(keys, sizes))
         
-        return heatmap_data
+        # 每个粗单元与相邻粗单元的总行程数
+        block_weights = np.zeros(len(keys))
+        for offset in itertools.product([-1, 0, 1], repeat=centers.shape[1]):
+            neighbor_keys = np.ravel_multi_index((coarse_grid + offset).T, sizes)
+            positions = np.minimum(np.searchsorted(keys, neighbor_keys), len(keys) - 1)
+            found = keys[positions] == neighbor_keys
+            block_weights[found] += coarse_weights[positions[found]]
+        return block_weights[coarse] >= min_samples
     
-    def get_route_clusters(self, data, min_samples=5, eps=0.01):
-        """获取路线聚类数据"""
+    def get_route_clusters(self, data, min_samples=5, eps=0.01, max_cells=ROUTE_MAX_CELLS):
+        """
+        获取路线聚类数据
+        先把起终点对吸附到网格，再对带权重（行程数）的网格单元做 DBSCAN，
+        参与聚类的单元数不超过 max_cells，内存不随行程数增长
+        """
         if len(data) < min_samples:
             return None
         
         # 确保有起点和终点的经纬度数据
-        required_cols = ['pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude']
-        if not all(col in data.columns for col in required_cols):
+        if not all(col in data.columns for col in ROUTE_COLUMNS):
             return None
         
-        # 准备聚类数据
-        X = data[required_cols].copy()
-        
         # 标准化数据
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        X = data[ROUTE_COLUMNS].values.astype(np.float64)
+        X_scaled = StandardScaler().fit_transform(X)
         
-        # 使用DBSCAN进行聚类
-        dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-        clusters = dbscan.fit_predict(X_scaled)
+        # 网格单元边长取 eps / 2，同一单元内的点距离不超过 eps
+        inverse, n_cells, _ = self.snap_routes(X_scaled, eps / 2, len(X_scaled))
+        weights, cell_centers = self.route_cells(X_scaled, inverse, n_cells)
         
-        # 添加聚类标签到数据中
-        data_with_clusters = data.copy()
-        data_with_clusters['cluster'] = clusters
+        # 先去掉必定是噪声的稀疏单元（不改变聚类结果）；剩余单元仍然超过上限时才加粗网格（近似）
+        dense = self.dense_route_cells(cell_centers, weights, eps, min_samples)
+        if np.count_nonzero(dense) > max_cells:
+            inverse, n_cells, _ = self.snap_routes(X_scaled, eps / 2, max_cells)
+            weights, cell_centers = self.route_cells(X_scaled, inverse, n_cells)
+            dense = np.ones(n_cells, dtype=bool)
         
-        # 过滤掉噪声点（标签为-1）
-        clustered_data = data_with_clusters[data_with_clusters['cluster'] != -1]
+        # 对网格单元加权聚类（去掉的单元标记为噪声）
+        cell_labels = np.full(n_cells, -1, dtype=np.int64)
+        if np.any(dense):
+            dbscan = DBSCAN(eps=eps, min_samples=min_samples)
+            cell_labels[dense] = dbscan.fit_predict(cell_centers[dense], sample_weight=weights[dense])
+        
+        # 汇总每个单元的行程数和平均起终点坐标，过滤掉噪声点（标签为-1）
+        cells = pd.DataFrame({
+            col: np.bincount(inverse, weights=X[:, i], minlength=n_cells) / weights
+            for i, col in enumerate(ROUTE_COLUMNS)
+        })
+        cells['count'] = weights
+        cells['cluster'] = cell_labels
+        cells = cells[cells['cluster'] != -1]
         
         # 如果没有有效聚类，返回None
-        if len(clustered_data) == 0:
+        if len(cells) == 0:
             return None
         
-        # 获取聚类结果
+        # 一次 groupby 得到每个聚类的行程数和中心点
+        for col in ROUTE_COLUMNS:
+            cells[f'{col}_sum'] = cells[col] * cells['count']
+        stats = cells.groupby('cluster')[['count'] + [f'{col}_sum' for col in ROUTE_COLUMNS]].sum()
+        
+        # 每个聚类中行程数最多的 5 个单元作为代表路线
+        top_cells = cells.sort_values(['cluster', 'count'], ascending=[True, False], kind='stable').groupby('cluster').head(5)
+        labels = top_cells['cluster'].values
+        bounds = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1], True])
+        # 每条路线为 [起点, 终点]，folium使用[lat, lon]格式
+        routes = np.stack([top_cells[['pickup_latitude', 'pickup_longitude']].values,
+                           top_cells[['dropoff_latitude', 'dropoff_longitude']].values], axis=1)
+        
+        cluster_ids = labels[bounds[:-1]]
+        counts = stats.loc[cluster_ids, 'count'].values.astype(int)
+        center_lats = (stats.loc[cluster_ids, 'pickup_latitude_sum'].values
+                       + stats.loc[cluster_ids, 'dropoff_latitude_sum'].values) / (2 * counts)
+        center_lons = (stats.loc[cluster_ids, 'pickup_longitude_sum'].values
+                       + stats.loc[cluster_ids, 'dropoff_longitude_sum'].values) / (2 * counts)
+        
         cluster_results = []
         colors = list(mcolors.TABLEAU_COLORS.values())
         
-        for cluster_id in sorted(clustered_data['cluster'].unique()):
-            cluster_points = clustered_data[clustered_data['cluster'] == cluster_id]
-            
-            # 计算聚类中心点
-            center_lat = cluster_points[['pickup_latitude', 'dropoff_latitude']].values.mean()
-            center_lon = cluster_points[['pickup_longitude', 'dropoff_longitude']].values.mean()
-            
-            # 获取聚类中最常见的路线
-            pickup_points = cluster_points[['pickup_latitude', 'pickup_longitude']].values
-            dropoff_points = cluster_points[['dropoff_latitude', 'dropoff_longitude']].values
-            
-            # 创建路线坐标
-            coordinates = []
-            for i in range(min(5, len(pickup_points))):
-                coordinates.append([pickup_points[i][1], pickup_points[i][0]])  # 注意：folium使用[lon, lat]格式
-                coordinates.append([dropoff_points[i][1], dropoff_points[i][0]])
-            
-            # 随机选择颜色
-            color = random.choice(colors)
-            
-            # 计算路线权重（基于该聚类中的行程数量）
-            weight = min(5, 1 + len(cluster_points) / 50)
-            
+        for i, cluster_id in enumerate(cluster_ids):
             cluster_results.append({
                 'name': f'路线 {cluster_id + 1}',
-                'coordinates': coordinates,
-                'color': color,
-                'weight': weight,
-                'count': len(cluster_points)
+                'coordinates': routes[bounds[i]:bounds[i + 1]].reshape(-1, 2).tolist(),
+                # 按聚类顺序分配颜色，结果可复现
+                'color': colors[i % len(colors)],
+                # 计算路线权重（基于该聚类中的行程数量）
+                'weight': min(5, 1 + counts[i] / 50),
+                'count': int(counts[i]),
+                'center': [center_lats[i], center_lons[i]]
             })
         
         return cluster_results
@@ -312,124 +1404,104 @@ class DataProcessor:
         # 按小时和日期类型分组
         grouped = data.groupby(['pickup_hour', 'is_weekend']).size().reset_index(name='count')
         
-        # 添加日期类型标签
-        grouped['day_type'] = grouped['is_weekend'].apply(lambda x: '周末' if x == 1 else '工作日')
-        
+        return self.weekday_weekend_frame(grouped)
+    
+    def weekday_weekend_frame(self, grouped):
+        """为按 (pickup_hour, is_weekend) 分组的行程数添加日期类型标签"""
+        grouped['is_weekend'] = grouped['is_weekend'].astype(int)
+        grouped['day_type'] = np.where(grouped['is_weekend'] == 1, '周末', '工作日')
         return grouped
     
     def get_zone_traffic(self, data):
         """获取区域流量数据"""
-        # 为每个上车点分配区域ID
-        def assign_zone(lat, lon):
-            min_dist = float('inf')
-            assigned_zone = 1  # 默认区域
-            
-            for zone_id, zone_info in self.zones.items():
-                center = zone_info["center"]
-                dist = ((lat - center[0]) ** 2 + (lon - center[1]) ** 2) ** 0.5
-                if dist < min_dist:
-                    min_dist = dist
-                    assigned_zone = zone_id
-            
-            return assigned_zone
-        
-        # 确保有经纬度数据
-        if 'pickup_latitude' not in data.columns or 'pickup_longitude' not in data.columns:
-            # 创建一个空的DataFrame，包含必要的列
-            return pd.DataFrame({'zone_id': list(self.zones.keys()), 'count': [0] * len(self.zones)})
-        
-        # 分配区域ID
-        data_with_zones = data.copy()
-        data_with_zones['zone_id'] = data_with_zones.apply(
-            lambda row: assign_zone(row['pickup_latitude'], row['pickup_longitude']), axis=1
-        )
-        
-        # 计算每个区域的行程数
-        zone_counts = data_with_zones.groupby('zone_id').size().reset_index(name='count')
+        counts = np.zeros(len(self.zones.names), dtype=np.int64)
         
-        # 确保所有区域都在结果中
-        for zone_id in self.zones.keys():
-            if zone_id not in zone_counts['zone_id'].values:
-                zone_counts = pd.concat([zone_counts, pd.DataFrame({'zone_id': [zone_id], 'count': [0]})], ignore_index=True)
+        # 按区域编号计数（区域编号在加载时已预先计算）
+        if self.has_zone_source(data, 'pickup'):
+            zones = self.get_zone_columns(data, ['pickup_zone'])['pickup_zone'].values
+            counts = np.bincount(zones, minlength=len(self.zones.names))
         
-        return zone_counts
+        return self.zone_traffic_frame(counts)
+    
+    def zone_traffic_frame(self, counts):
+        """将以区域编号为下标的行程数转换为区域流量表（包含所有区域）"""
+        zone_ids = self.zones.location_ids
+        return pd.DataFrame({
+            'zone_id': zone_ids.astype(int),
+            'zone_name': self.zones.names[zone_ids],
+            'count': counts[zone_ids]
+        })
     
     def get_zone_geojson(self):
         """获取区域GeoJSON数据"""
         return self.zone_geojson
     
-    def get_zone_flow(self, data):
-        """获取区域间流量数据"""
-        # 确保有经纬度数据
-        required_cols = ['pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude']
-        if not all(col in data.columns for col in required_cols):
-            # 返回一个包含必要列的空DataFrame
+    def get_od_matrix(self, data, by_hour=False):
+        """
+        获取区域间起讫点（OD）矩阵，一次 bincount 完成统计
+        :param by_hour: 是否按上车小时分别统计
+        :return: ODMatrix；无法得到起点和终点区域时返回 None
+        """
+        if not (self.has_zone_source(data, 'pickup') and self.has_zone_source(data, 'dropoff')):
+            return None
+        # 区域编号在加载时已预先计算
+        data_with_zones = self.get_zone_columns(data, ['pickup_zone', 'dropoff_zone'])
+        hours = data['pickup_hour'].values if by_hour else None
+        return ODMatrix.from_zones(data_with_zones['pickup_zone'].values, data_with_zones['dropoff_zone'].values,
+                                   len(self.zones.names), hours)
+    
+    def get_zone_flow(self, data, quantile=0.8, top_k=None):
+        """
+        获取区域间流量数据
+        :param quantile: 只保留行程数不低于该分位数的区域间连接
+        :param top_k: 指定时改为保留流量最大的 top_k 个连接
+        """
+        return self.zone_flow_frame(self.get_od_matrix(data), quantile, top_k)
+    
+    def zone_flow_frame(self, od, quantile=0.8, top_k=None):
+        """
+        由 OD 矩阵生成区域中心点与区域间连接，排除未知区域（编号 0）和同一区域内的流量
+        :return: 区域中心点（type 为 center）与连接（type 为 flow）按列合并的 DataFrame
+        """
+        zones = self.zones
+        zone_ids = zones.location_ids
+        
+        # 区域中心点
+        centers = pd.DataFrame({
+            'zone_id': zone_ids.astype(int),
+            'zone_name': zones.names[zone_ids],
+            'latitude': zones.centroid_lat[zone_ids],
+            'longitude': zones.centroid_lon[zone_ids],
+            'count': 0,
+            'type': 'center'
+        })
+        
+        # 无法得到起点和终点区域时返回一个包含必要列的空DataFrame
+        if od is None:
             return pd.DataFrame({
                 'zone_id': [], 'zone_name': [], 'latitude': [], 'longitude': [],
                 'count': [], 'type': [], 'start_lat': [], 'start_lon': [], 'end_lat': [], 'end_lon': []
             })
         
-        # 创建区域流量数据
-        flow_data = []
-        
-        # 添加区域中心点
-        for zone_id, zone_info in self.zones.items():
-            flow_data.append({
-                'zone_id': zone_id,
-                'zone_name': zone_info['name'],
-                'latitude': zone_info['center'][0],
-                'longitude': zone_info['center'][1],
-                'count': 0,
-                'type': 'center'
-            })
+        # 在矩阵上选择流量较大的区域间连接
+        if top_k is not None:
+            start, end, counts = od.top_k(top_k)
+        else:
+            start, end, counts = od.threshold(quantile=quantile)
         
-        # 计算区域间流量
-        def assign_zone(lat, lon):
-            min_dist = float('inf')
-            assigned_zone = 1  # 默认区域
-            
-            for zone_id, zone_info in self.zones.items():
-                center = zone_info["center"]
-                dist = ((lat - center[0]) ** 2 + (lon - center[1]) ** 2) ** 0.5
-                if dist < min_dist:
-                    min_dist = dist
-                    assigned_zone = zone_id
-            
-            return assigned_zone
-        
-        # 分配起点和终点区域
-        data_with_zones = data.copy()
-        data_with_zones['pickup_zone'] = data_with_zones.apply(
-            lambda row: assign_zone(row['pickup_latitude'], row['pickup_longitude']), axis=1
-        )
-        data_with_zones['dropoff_zone'] = data_with_zones.apply(
-            lambda row: assign_zone(row['dropoff_latitude'], row['dropoff_longitude']), axis=1
-        )
-        
-        # 计算区域间流量
-        zone_flows = data_with_zones.groupby(['pickup_zone', 'dropoff_zone']).size().reset_index(name='count')
-        
-        # 只保留流量较大的区域间连接
-        threshold = zone_flows['count'].quantile(0.8) if len(zone_flows) > 0 else 0
-        significant_flows = zone_flows[zone_flows['count'] >= threshold]
-        
-        # 添加区域间流量数据
-        for _, flow in significant_flows.iterrows():
-            if flow['pickup_zone'] != flow['dropoff_zone']:  # 排除同一区域内的流量
-                start_zone = self.zones[flow['pickup_zone']]
-                end_zone = self.zones[flow['dropoff_zone']]
-                
-                flow_data.append({
-                    'zone_id': f"{flow['pickup_zone']}-{flow['dropoff_zone']}",
-                    'zone_name': f"{start_zone['name']} → {end_zone['name']}",
-                    'latitude': (start_zone['center'][0] + end_zone['center'][0]) / 2,
-                    'longitude': (start_zone['center'][1] + end_zone['center'][1]) / 2,
-                    'start_lat': start_zone['center'][0],
-                    'start_lon': start_zone['center'][1],
-                    'end_lat': end_zone['center'][0],
-                    'end_lon': end_zone['center'][1],
-                    'count': flow['count'],
-                    'type': 'flow'
-                })
-        
-        return pd.DataFrame(flow_data)
\ No newline at end of file
+        # 按区域编号直接取中心点坐标和名称
+        id_text = np.arange(od.size).astype(str).astype(object)
+        flows = pd.DataFrame({
+            'zone_id': id_text[start] + '-' + id_text[end],
+            'zone_name': zones.names[start] + ' → ' + zones.names[end],
+            'latitude': (zones.centroid_lat[start] + zones.centroid_lat[end]) / 2,
+            'longitude': (zones.centroid_lon[start] + zones.centroid_lon[end]) / 2,
+            'count': counts.astype(np.int64),
+            'type': 'flow',
+            'start_lat': zones.centroid_lat[start],
+            'start_lon': zones.centroid_lon[start],
+            'end_lat': zones.centroid_lat[end],
+            'end_lon': zones.centroid_lon[end]
+        })
+        
+        return pd.concat([centers, flows], ignore_index=True)
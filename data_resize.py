@@ -1,38 +1,247 @@
-import pandas as pd
+import argparse
 import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data_processor import STREAM_BATCH_ROWS, find_time_column, resolve_source_columns
 
-def reduce_parquet_size(input_file, output_file, max_size_mb=100, compression="snappy"):
+# 默认的目标文件大小（MB）
+DEFAULT_MAX_SIZE_MB = 100
+# 输出文件每个行组的行数：与流式读取的批大小一致，按日期过滤时可以用行组统计信息跳过大部分行组
+DEFAULT_ROW_GROUP_ROWS = STREAM_BATCH_ROWS
+# 每次从输入文件读取的最大行数，峰值内存只取决于它和行组大小
+READ_BATCH_ROWS = 100_000
+# 输出文件大小在 [目标 × (1 - 容差), 目标] 之间即停止迭代
+SIZE_TOLERANCE = 0.05
+# 最多写入的轮数
+MAX_PASSES = 6
+# 可选的压缩算法
+COMPRESSIONS = ['snappy', 'gzip', 'brotli', 'zstd', 'lz4', 'none']
+
+
+def stratum_codes(column):
+    """
+    每行所在的 (日期, 小时) 分层编号（自 1970-01-01 起的小时数）
+    时间为空的行单独成一层；不是时间类型的列不分层（全部为 0）
+    """
+    if not pa.types.is_timestamp(column.type):
+        return np.zeros(len(column), dtype=np.int64)
+    hours = column.to_numpy(zero_copy_only=False).astype('datetime64[h]')
+    return hours.astype(np.int64)
+
+
+class StratifiedSampler:
+    """
+    按 (日期, 小时) 分层的流式抽样器，逐批调用，只保存每层的计数
+    每层累计保留 floor(已读行数 × 比例 + u) 行（u 为该层固定的随机偏移），
+    因此无论一层的行分散在多少批中，各层保留的行数都与该层的行数成比例（误差小于一行），层内随机选择保留的行
+    """
+
+    def __init__(self, fraction, seed=42):
+        self.fraction = fraction
+        self.rng = np.random.default_rng(seed)
+        self.seen = {}
+        self.kept = {}
+        self.offsets = {}
+
+    def sample(self, codes):
+        """
+        :param codes: 本批每行的分层编号（见 stratum_codes）
+        :return: 保留的行的布尔掩码（保持原有行顺序）
+        """
+        strata, inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+        quotas = np.empty(len(strata), dtype=np.int64)
+        for i, (stratum, count) in enumerate(zip(strata.tolist(), counts.tolist())):
+            offset = self.offsets.setdefault(stratum, self.rng.random())
+            seen = self.seen.get(stratum, 0) + count
+            kept = int(seen * self.fraction + offset)
+            quotas[i] = kept - self.kept.get(stratum, 0)
+            self.seen[stratum] = seen
+            self.kept[stratum] = kept
+
+        # 层内按随机键排序，每层取前 quota 行
+        order = np.lexsort((self.rng.random(len(codes)), inverse))
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        ranks = np.arange(len(codes)) - starts
+        mask = np.zeros(len(codes), dtype=bool)
+        mask[order[ranks < np.repeat(quotas, counts)]] = True
+        return mask
+
+
+def estimate_compressed_size(parquet_file, columns=None):
+    """由输入文件元数据中各列块的压缩大小估计选定列占用的字节数"""
+    metadata = parquet_file.metadata
+    total = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            if columns is None or chunk.path_in_schema in columns:
+                total += chunk.total_compressed_size
+    return total
+
+
+def writer_options(compression='snappy', compression_level=None, column_encoding=None):
+    """
+    ParquetWriter 的压缩与编码参数
+    :param column_encoding: {列名: 编码}，如 {'pickup_datetime': 'DELTA_BINARY_PACKED'}；
+                            指定编码的列不使用字典编码，其余列仍使用字典编码
+    """
+    options = {
+        'compression': None if compression == 'none' else compression,
+        'compression_level': compression_level,
+        'write_statistics': True,
+    }
+    if column_encoding:
+        options['column_encoding'] = column_encoding
+    return options
+
+
+def write_sample(input_file, output_file, fraction, columns=None, row_group_size=DEFAULT_ROW_GROUP_ROWS,
+                 options=None, seed=42):
+    """
+    逐批读取输入文件，按 (日期, 小时) 分层抽样后写入输出文件
+    抽样后的行先累积到 row_group_size 行再写成一个行组，峰值内存只取决于读取批大小和行组大小
+    :param fraction: 抽样比例，1 表示保留全部行
+    :param columns: 保留的列，None 表示全部
+    :return: 写入的行数
+    """
+    parquet_file = pq.ParquetFile(input_file)
+    schema = parquet_file.schema_arrow
+    columns = schema.names if columns is None else list(columns)
+    time_col = find_time_column(schema.names, 'pickup', fallback=True)
+    read_columns = columns + [time_col] if time_col is not None and time_col not in columns else columns
+    output_schema = pa.schema([schema.field(col) for col in columns])
+    # 列的编码参数只对输出文件中存在的列有效
+    options = dict(options or {})
+    if options.get('column_encoding'):
+        options['column_encoding'] = {col: encoding for col, encoding in options['column_encoding'].items()
+                                      if col in columns}
+        encoded = set(options['column_encoding'])
+        options['use_dictionary'] = [col for col in columns if col not in encoded]
+
+    sampler = StratifiedSampler(fraction, seed)
+    pending = []
+    pending_rows = 0
+    rows = 0
+    with pq.ParquetWriter(output_file, output_schema, **options) as writer:
+        for batch in parquet_file.iter_batches(batch_size=READ_BATCH_ROWS, columns=read_columns):
+            table = pa.Table.from_batches([batch])
+            if fraction < 1.0 and time_col is not None:
+                table = table.filter(pa.array(sampler.sample(stratum_codes(table.column(time_col)))))
+            elif fraction < 1.0:
+                table = table.filter(pa.array(sampler.sample(np.zeros(table.num_rows, dtype=np.int64))))
+            pending.append(table.select(columns))
+            pending_rows += table.num_rows
+
+            # 凑满一个行组就写出
+            while pending_rows >= row_group_size:
+                buffered = pa.concat_tables(pending)
+                writer.write_table(buffered.slice(0, row_group_size), row_group_size=row_group_size)
+                rest = buffered.slice(row_group_size)
+                pending, pending_rows = [rest], rest.num_rows
+                rows += row_group_size
+        if pending_rows > 0:
+            writer.write_table(pa.concat_tables(pending), row_group_size=row_group_size)
+            rows += pending_rows
+    return rows
+
+
+def reduce_parquet_size(input_file, output_file, max_size_mb=DEFAULT_MAX_SIZE_MB, compression="snappy",
+                        compression_level=None, row_group_size=DEFAULT_ROW_GROUP_ROWS, columns=None,
+                        column_encoding=None, tolerance=SIZE_TOLERANCE, max_passes=MAX_PASSES, seed=42):
     """
     减少 Parquet 文件的数据量，确保文件不超过指定大小
+    按 (日期, 小时) 分层抽样，保留各时段行程数的比例（早晚高峰、工作日/周末等时间模式不变）；
+    每一轮流式写出完整的输出文件并测量实际大小，按测量结果调整抽样比例，直到大小落在 [目标 × (1 - 容差), 目标] 之间
+    输入文件逐批读取，内存占用与文件大小无关
     :param input_file: 输入 Parquet 文件路径
     :param output_file: 输出 Parquet 文件路径
     :param max_size_mb: 最大文件大小（MB），默认 100MB
-    :param compression: 压缩算法（默认 "snappy"），可选 "gzip", "brotli", "zstd"
-    """
-    # 读取 Parquet 文件
-    df = pd.read_parquet(input_file)
-    
-    # 计算当前文件大小
-    current_size_mb = df.memory_usage(deep=True).sum() / (1024 * 1024)
-    
-    # 如果文件大小超过限制，则进行采样
-    if current_size_mb > max_size_mb:
-        # 计算采样比例
-        sample_ratio = max_size_mb / current_size_mb
-        # 随机采样数据
-        df = df.sample(frac=sample_ratio, random_state=42)
-    
-    # 保存为新的 Parquet 文件，并启用压缩
-    df.to_parquet(output_file, compression=compression)
-    
+    :param compression: 压缩算法（默认 "snappy"），可选 "gzip", "brotli", "zstd", "lz4", "none"
+    :param compression_level: 压缩级别，None 表示算法的默认级别
+    :param row_group_size: 每个行组的行数；行组越小，按日期过滤和行组采样越精细，压缩率略低
+    :param columns: 保留的列，None 表示全部（'analysis' 表示只保留仪表盘读取的列）
+    :param column_encoding: {列名: 编码}，见 writer_options
+    :param tolerance: 允许比目标小的比例
+    :param max_passes: 最多写入的轮数，达到后保留不超过目标的最大结果
+    :param seed: 抽样的随机种子
+    :return: 统计信息字典
+    :raises ValueError: 目标大小小于空文件的大小
+    :raises RuntimeError: 达到最大轮数仍未得到不超过目标的文件
+    """
+    parquet_file = pq.ParquetFile(input_file)
+    if columns == 'analysis':
+        columns = resolve_source_columns(parquet_file.schema_arrow.names)
+    input_rows = parquet_file.metadata.num_rows
+    target = max_size_mb * 1024 * 1024
+    options = writer_options(compression, compression_level, column_encoding)
+
+    # 第一轮的抽样比例由输入文件中选定列的压缩大小估计，之后按实际写出的大小修正
+    estimate = estimate_compressed_size(parquet_file, columns)
+    fraction = min(1.0, target * (1 - tolerance / 2) / estimate) if estimate > 0 else 1.0
+
+    tmp_file = f'{output_file}.tmp-{os.getpid()}'
+    best_file = f'{output_file}.best-{os.getpid()}'
+    best = None
+    try:
+        for n_pass in range(1, max_passes + 1):
+            rows = write_sample(input_file, tmp_file, fraction, columns, row_group_size, options, seed)
+            size = os.path.getsize(tmp_file)
+            print(f"第 {n_pass} 轮: 抽样比例 {fraction:.4f}，{rows:,} 行，{size / (1024 * 1024):.2f} MB")
+            if size <= target and (best is None or size > best['size']):
+                os.replace(tmp_file, best_file)
+                best = {'rows': rows, 'size': size, 'fraction': fraction, 'passes': n_pass}
+            if size <= target and (size >= target * (1 - tolerance) or fraction >= 1.0):
+                break
+            if rows == 0:
+                raise ValueError(f"目标大小 {max_size_mb} MB 小于空文件的大小")
+            # 文件大小与行数近似成正比，按实际大小修正抽样比例，目标取容差区间的中点
+            fraction = min(1.0, fraction * target * (1 - tolerance / 2) / size)
+        if best is None:
+            raise RuntimeError(f"经过 {max_passes} 轮仍未能将文件缩小到 {max_size_mb} MB 以内")
+        os.replace(best_file, output_file)
+    finally:
+        for file_path in [tmp_file, best_file]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
     # 打印文件大小变化
     original_size = os.path.getsize(input_file) / (1024 * 1024)
-    new_size = os.path.getsize(output_file) / (1024 * 1024)
-    print(f"原始文件大小: {original_size:.2f} MB")
-    print(f"新文件大小: {new_size:.2f} MB")
+    new_size = best['size'] / (1024 * 1024)
+    print(f"原始文件大小: {original_size:.2f} MB（{input_rows:,} 行）")
+    print(f"新文件大小: {new_size:.2f} MB（{best['rows']:,} 行，抽样比例 {best['fraction']:.4f}）")
     print(f"压缩率: {(1 - new_size / original_size) * 100:.2f}%")
+    return {'input_rows': input_rows, 'rows': best['rows'], 'fraction': best['fraction'],
+            'size_mb': new_size, 'passes': best['passes']}
+
+
+def parse_encoding(value):
+    """解析命令行中的 列名=编码"""
+    column, _, encoding = value.partition('=')
+    if not column or not encoding:
+        raise argparse.ArgumentTypeError(f"编码参数格式应为 列名=编码: {value}")
+    return column, encoding.upper()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分层抽样缩小 Parquet 文件，使文件不超过指定大小")
+    parser.add_argument('input_file', nargs='?', default='data.parquet', help="输入文件路径")
+    parser.add_argument('output_file', nargs='?', default='reduced_data.parquet', help="输出文件路径")
+    parser.add_argument('--max-size-mb', type=float, default=DEFAULT_MAX_SIZE_MB, help="最大文件大小（MB）")
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='gzip', help="压缩算法")
+    parser.add_argument('--compression-level', type=int, default=None, help="压缩级别")
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_ROWS, help="每个行组的行数")
+    parser.add_argument('--columns', nargs='+', default=None,
+                        help="保留的列；'analysis' 表示只保留仪表盘读取的列")
+    parser.add_argument('--encoding', type=parse_encoding, action='append', default=[],
+                        help="列的编码，如 pickup_datetime=DELTA_BINARY_PACKED（可重复）")
+    parser.add_argument('--tolerance', type=float, default=SIZE_TOLERANCE, help="允许比目标小的比例")
+    parser.add_argument('--seed', type=int, default=42, help="抽样的随机种子")
+    args = parser.parse_args()
 
-# 示例用法
-input_file = "data.parquet"  # 输入文件路径
-output_file = "reduced_data.parquet"  # 输出文件路径
-reduce_parquet_size(input_file, output_file, max_size_mb=100, compression="gzip")
+    reduce_parquet_size(args.input_file, args.output_file, max_size_mb=args.max_size_mb,
+                        compression=args.compression, compression_level=args.compression_level,
+                        row_group_size=args.row_group_size,
+                        columns='analysis' if args.columns == ['analysis'] else args.columns,
+                        column_encoding=dict(args.encoding) or None, tolerance=args.tolerance, seed=args.seed)
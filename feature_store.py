@@ -0,0 +1,202 @@
+import datetime
+import json
+import os
+import shutil
+import numpy as np
+import pyarrow as pa
+
+# 特征库格式版本，存储结构或特征计算方式变化时递增以便重建
+FEATURE_STORE_VERSION = 2
+
+# 特征库目录中的清单文件与空 schema 文件
+MANIFEST_FILE = '_manifest.json'
+SCHEMA_FILE = '_schema.arrow'
+
+
+def partition_name(day):
+    """日期分区的文件名"""
+    return f'pickup_date={day}.arrow'
+
+
+def source_dir_name(source):
+    """数据源子目录名"""
+    return f'source={source}'
+
+
+class FeatureStore:
+    """
+    清洗并补充特征后的行程数据，按数据源（源文件，例如一个月份）和上车日期两级分区保存为 Arrow IPC 文件
+    每个数据源单独写入、替换或删除，增加一个月份时只处理该月份的源文件
+    目录中的清单记录版本、清洗规则，以及每个数据源的指纹和各日期分区的行数
+    数据源目录中还可以保存该数据源的聚合结果（cube、近似查询结构），合并后即得到全部数据的聚合
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = None
+        manifest_file = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+
+    @classmethod
+    def create(cls, path, key):
+        """
+        创建空的特征库，已有的特征库（版本或清洗规则过期）整个删除
+        :param key: 清洗规则的哈希，加载时用于校验
+        """
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        store = cls(path)
+        store.manifest = {'version': FEATURE_STORE_VERSION, 'key': key, 'sources': {}}
+        store.save_manifest()
+        return store
+
+    def save_manifest(self):
+        """原子替换清单文件"""
+        manifest_file = os.path.join(self.path, MANIFEST_FILE)
+        tmp_file = f'{manifest_file}.tmp-{os.getpid()}'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, manifest_file)
+
+    def is_valid(self, key):
+        """特征库存在且版本、清洗规则都匹配"""
+        return (self.manifest is not None
+                and self.manifest.get('version') == FEATURE_STORE_VERSION
+                and self.manifest.get('key') == key)
+
+    def has_source(self, source, fingerprint):
+        """数据源已导入且源文件没有变化"""
+        return self.manifest['sources'].get(source, {}).get('fingerprint') == fingerprint
+
+    def source_path(self, source):
+        """数据源子目录的路径"""
+        return os.path.join(self.path, source_dir_name(source))
+
+    def sources(self, sources=None):
+        """特征库中的数据源名（按名称排序）；sources 不为 None 时只保留其中已导入的"""
+        names = sorted(self.manifest['sources'])
+        if sources is None:
+            return names
+        return [name for name in names if name in set(sources)]
+
+    def dates(self, date_range=None, sources=None):
+        """
+        特征库中的日期（'YYYY-MM-DD' 字符串，升序）
+        :param date_range: (start_date, end_date)，None 表示全部
+        :param sources: 数据源名列表，None 表示全部
+        """
+        dates = sorted({day for source in self.sources(sources)
+                        for day in self.manifest['sources'][source]['partitions']})
+        if date_range is None:
+            return dates
+        start, end = (str(day) for day in date_range)
+        return [day for day in dates if start <= day <= end]
+
+    def num_rows(self, date_range=None, sources=None):
+        """日期范围内的总行数（只读取清单）"""
+        dates = set(self.dates(date_range, sources))
+        return sum(rows for source in self.sources(sources)
+                   for day, rows in self.manifest['sources'][source]['partitions'].items() if day in dates)
+
+    def partition_file(self, source, day):
+        """数据源某个日期分区的文件路径"""
+        return os.path.join(self.source_path(source), partition_name(day))
+
+    def read_table(self, source, day):
+        """读取某个数据源的日期分区；day 为 None 时返回空表（只有 schema）"""
+        if day is None:
+            file_path = os.path.join(self.path, SCHEMA_FILE)
+        else:
+            file_path = self.partition_file(source, day)
+        with pa.memory_map(file_path) as source_file:
+            return pa.ipc.open_file(source_file).read_all()
+
+    def frames(self, date_range=None, sources=None):
+        """
+        按日期顺序逐个分区读取为 (数据源名, DataFrame)，只读取日期范围内的分区
+        同一天有多个数据源（跨月的行程）时按数据源名依次生成
+        范围内没有数据时生成一个空 DataFrame（数据源名为 None），保证列结构一致
+        """
+        sources = self.sources(sources)
+        dates = self.dates(date_range, sources)
+        if not dates:
+            yield None, self.read_table(None, None).to_pandas()
+        for day in dates:
+            for source in sources:
+                if day in self.manifest['sources'][source]['partitions']:
+                    yield source, self.read_table(source, day).to_pandas()
+
+    def write_source(self, source, fingerprint, frames):
+        """
+        将一个数据源逐批处理好的数据按上车日期写入特征库，已存在的同名数据源被替换
+        先写到临时目录，全部完成后再替换数据源目录并更新清单，构建中断时不会留下不完整的分区
+        :param fingerprint: 源文件指纹，加载时用于判断数据源是否变化
+        :param frames: 处理后 DataFrame 的可迭代对象（至少一个，可以为空）
+        """
+        path = self.source_path(source)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        schema = None
+        empty_schema = None
+        writers = {}
+        partitions = {}
+        try:
+            for frame in frames:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if len(frame) == 0:
+                    # 空批次的 object 列无法推断类型，只在没有任何数据时使用它的 schema
+                    empty_schema = table.schema
+                    continue
+                if schema is None:
+                    schema = table.schema
+
+                # 每批数据可能跨多个日期：按日期排序后切分
+                days = frame['pickup_datetime'].values.astype('datetime64[D]')
+                order = np.argsort(days, kind='stable')
+                days = days[order]
+                table = table.take(pa.array(order)).cast(schema)
+                bounds = np.flatnonzero(np.r_[True, days[1:] != days[:-1], True])
+                for start, end in zip(bounds[:-1], bounds[1:]):
+                    day = str(days[start])
+                    if day not in writers:
+                        writers[day] = pa.ipc.new_file(os.path.join(tmp_path, partition_name(day)), schema)
+                        partitions[day] = 0
+                    writers[day].write_table(table.slice(start, end - start))
+                    partitions[day] += int(end - start)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        # 特征库共用一个空 schema，用于范围内没有数据时生成空 DataFrame；优先使用有数据的批次推断的 schema
+        schema_file = os.path.join(self.path, SCHEMA_FILE)
+        if schema is not None or not os.path.exists(schema_file):
+            schema = schema if schema is not None else empty_schema
+            tmp_file = f'{schema_file}.tmp-{os.getpid()}'
+            with pa.ipc.new_file(tmp_file, schema) as writer:
+                writer.write_table(schema.empty_table())
+            os.replace(tmp_file, schema_file)
+
+        # 先从清单中移除旧版本再替换目录，中途失败时数据源只会缺失（下次重新导入），不会不一致
+        if source in self.manifest['sources']:
+            del self.manifest['sources'][source]
+            self.save_manifest()
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.manifest['sources'][source] = {
+            'fingerprint': fingerprint,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'partitions': partitions,
+        }
+        self.save_manifest()
+
+    def remove_source(self, source):
+        """删除一个数据源（先更新清单，再删除分区文件）"""
+        if source not in self.manifest['sources']:
+            return
+        del self.manifest['sources'][source]
+        self.save_manifest()
+        shutil.rmtree(self.source_path(source), ignore_errors=True)
@@ -0,0 +1,131 @@
+import math
+import numpy as np
+import pandas as pd
+
+# 地图缩放级别范围及默认级别
+MIN_ZOOM = 10
+MAX_ZOOM = 15
+DEFAULT_ZOOM = 11
+# 每个网格单元在屏幕上约占的像素数（与热力图半径相当）
+CELL_PIXELS = 8
+# 返回的非空网格单元数上限
+DEFAULT_MAX_CELLS = 5000
+
+
+def cell_size_for_zoom(zoom, latitude):
+    """
+    计算某个缩放级别下网格单元的经纬度边长，使单元在屏幕上约为 CELL_PIXELS 像素见方
+    :return: (纬度边长, 经度边长)
+    """
+    lon_size = 360 * CELL_PIXELS / (256 * 2 ** zoom)
+    # Web 墨卡托投影下，纬度方向按 cos(纬度) 缩放
+    return lon_size * math.cos(math.radians(latitude)), lon_size
+
+
+def top_cells(counts, max_cells):
+    """非空单元的下标，超过上限时保留计数最多的 max_cells 个"""
+    cells = np.flatnonzero(counts)
+    if max_cells is not None and len(cells) > max_cells:
+        top = np.argpartition(counts[cells], -max_cells)[-max_cells:]
+        cells = np.sort(cells[top])
+    return cells
+
+
+class HeatmapGrid:
+    """覆盖固定经纬度范围的方形网格，用于将上车点分箱计数"""
+
+    def __init__(self, lat_range, lon_range, zoom):
+        self.zoom = zoom
+        self.lat_min, self.lon_min = lat_range[0], lon_range[0]
+        self.lat_size, self.lon_size = cell_size_for_zoom(zoom, (lat_range[0] + lat_range[1]) / 2)
+        self.n_rows = math.ceil((lat_range[1] - lat_range[0]) / self.lat_size)
+        self.n_cols = math.ceil((lon_range[1] - lon_range[0]) / self.lon_size)
+        self.n_cells = self.n_rows * self.n_cols
+
+    def cell_ids(self, lat, lon):
+        """计算每个点所在的网格单元编号，范围外的点为 -1"""
+        row = np.floor((np.asarray(lat) - self.lat_min) / self.lat_size).astype(np.int64)
+        col = np.floor((np.asarray(lon) - self.lon_min) / self.lon_size).astype(np.int64)
+        inside = (row >= 0) & (row < self.n_rows) & (col >= 0) & (col < self.n_cols)
+        return np.where(inside, row * self.n_cols + col, -1)
+
+    def cell_centers(self, cells):
+        """网格单元的中心点经纬度"""
+        row, col = np.divmod(cells, self.n_cols)
+        return self.lat_min + (row + 0.5) * self.lat_size, self.lon_min + (col + 0.5) * self.lon_size
+
+    def bin(self, lat, lon, weights=None):
+        """将点分箱，返回每个网格单元的计数（长度为 n_cells）"""
+        cells = self.cell_ids(lat, lon)
+        inside = cells >= 0
+        if weights is not None:
+            weights = np.asarray(weights)[inside]
+        return np.bincount(cells[inside], weights=weights, minlength=self.n_cells)
+
+    def bin_hourly(self, lat, lon, hours):
+        """
+        一次分组计算 24 个小时的热力图层
+        :param hours: 每个点的上车小时（0-23）
+        :return: HourlyHeatmap
+        """
+        cells = self.cell_ids(lat, lon)
+        inside = cells >= 0
+        cells, hours = cells[inside], np.asarray(hours)[inside].astype(np.int64)
+
+        # 只保留至少有一个点的单元，压缩为 (24, 非空单元数)
+        used = np.flatnonzero(np.bincount(cells, minlength=self.n_cells))
+        lookup = np.full(self.n_cells, -1, dtype=np.int64)
+        lookup[used] = np.arange(len(used))
+        counts = np.bincount(hours * len(used) + lookup[cells], minlength=24 * len(used)).reshape(24, len(used))
+
+        lat_centers, lon_centers = self.cell_centers(used)
+        return HourlyHeatmap(lat_centers, lon_centers, counts)
+
+    def to_frame(self, counts, max_cells=DEFAULT_MAX_CELLS):
+        """
+        只保留非空网格单元，超过上限时保留计数最多的 max_cells 个
+        :return: 包含 pickup_latitude、pickup_longitude、weight 的 DataFrame
+        """
+        cells = top_cells(counts, max_cells)
+        lat, lon = self.cell_centers(cells)
+        return pd.DataFrame({'pickup_latitude': lat, 'pickup_longitude': lon, 'weight': counts[cells]})
+
+
+class HourlyHeatmap:
+    """24 个小时的热力图层：非空单元的中心点与 (24, 单元数) 的计数矩阵"""
+
+    def __init__(self, lat, lon, counts):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int32)
+
+    @property
+    def nbytes(self):
+        return self.lat.nbytes + self.lon.nbytes + self.counts.nbytes
+
+    def layer(self, hour, max_cells=DEFAULT_MAX_CELLS):
+        """
+        某个小时的热力图数据，hour 为 None 时返回全天合计
+        :return: 包含 pickup_latitude、pickup_longitude、weight 的 DataFrame
+        """
+        counts = self.counts.sum(axis=0) if hour is None else self.counts[hour]
+        cells = top_cells(counts, max_cells)
+        return pd.DataFrame({'pickup_latitude': self.lat[cells], 'pickup_longitude': self.lon[cells],
+                             'weight': counts[cells]})
+
+    def frames(self, max_cells=DEFAULT_MAX_CELLS):
+        """
+        全天 24 帧热力图数据，用于按时间播放
+        权重按全天最大值归一化，使各小时之间的强度可比较
+        """
+        peak = max(int(self.counts.max()), 1) if self.counts.size > 0 else 1
+        frames = []
+        for hour in range(24):
+            cells = top_cells(self.counts[hour], max_cells)
+            frames.append(np.column_stack([self.lat[cells], self.lon[cells], self.counts[hour, cells] / peak]).tolist())
+        return frames
+
+
+def build_grids(lat_range, lon_range):
+    """为每个缩放级别构建一个网格"""
+    return {zoom: HeatmapGrid(lat_range, lon_range, zoom) for zoom in range(MIN_ZOOM, MAX_ZOOM + 1)}
@@ -0,0 +1,298 @@
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# 环境变量：逗号分隔的记录模式，未设置时不记录
+#   spans       记录 DataProcessor 方法和应用各面板的耗时区间（含输入/输出行数）
+#   tracemalloc 同时记录每个区间的内存分配（Python 与 NumPy 分配，不含 Arrow 内存池）
+#   cprofile    同时对每次应用重跑做 cProfile 采样（只覆盖脚本线程）
+PROFILE_ENV = 'TRIP_PROFILE'
+PROFILE_MODES = ['spans', 'tracemalloc', 'cprofile']
+# 最多保留的区间数（更早的区间被丢弃）
+MAX_SPANS = 20_000
+# cProfile 结果中保留的函数数
+PROFILE_TOP_FUNCTIONS = 30
+
+# 当前线程（或被复制的上下文）中正在进行的区间，用于记录父子关系
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def parse_modes(value):
+    """解析 TRIP_PROFILE 的值；'1' 等价于 spans，其他模式都隐含 spans"""
+    modes = {mode.strip().lower() for mode in (value or '').split(',') if mode.strip()}
+    if modes & {'1', 'true', 'on'}:
+        modes = (modes - {'1', 'true', 'on'}) | {'spans'}
+    modes -= {'0', 'false', 'off'}
+    unknown = modes - set(PROFILE_MODES)
+    if unknown:
+        raise ValueError(f"{PROFILE_ENV} 中有未知的记录模式: {sorted(unknown)}，可选 {PROFILE_MODES}")
+    if modes:
+        modes.add('spans')
+    return modes
+
+
+def count_rows(value):
+    """DataFrame、数组或列表的行数，其他类型返回 None"""
+    shape = getattr(value, 'shape', None)
+    if shape:
+        return int(shape[0])
+    if isinstance(value, list):
+        return len(value)
+    return None
+
+
+def rows_of_arguments(args, kwargs):
+    """参数中第一个 DataFrame / 数组的行数"""
+    for value in itertools.chain(args, kwargs.values()):
+        rows = count_rows(value)
+        if rows is not None:
+            return rows
+    return None
+
+
+class NullSpan:
+    """记录关闭时使用的空区间，进入和退出都不做任何事"""
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def finish(self):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """一个耗时区间：进入时开始计时，退出时写入 Tracer"""
+
+    def __init__(self, tracer, name, category, rows_in=None, root=False, profile=False):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.root = root
+        self.profile = profile
+        self.profile_text = None
+        self.finished = False
+
+    def __enter__(self):
+        tracer = self.tracer
+        parent = None if self.root else current_span.get()
+        # 父区间已经结束（例如脚本中途被 st.rerun 打断）时不再作为父区间
+        self.parent = parent if parent is not None and not parent.finished else None
+        self.run_id = self.parent.run_id if self.parent is not None else None
+        self.id = next(tracer.ids)
+        if self.run_id is None:
+            self.run_id = self.id
+        self.token = current_span.set(self)
+
+        self.memory_start = None
+        if tracer.track_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # 父区间在子区间开始前的峰值先保存下来，再重置峰值
+            if self.parent is not None and self.parent.memory_start is not None:
+                self.parent.peak_seen = max(self.parent.peak_seen, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+            self.peak_seen = current
+
+        self.profiler = None
+        if self.profile and tracer.profile_runs:
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # 已有其他分析器在运行
+                self.profiler = None
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+            self.profile_text = output.getvalue()
+
+        alloc_mb = peak_mb = None
+        if self.memory_start is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(self.peak_seen, peak)
+            alloc_mb = (current - self.memory_start) / 2 ** 20
+            peak_mb = (peak - self.memory_start) / 2 ** 20
+            if self.parent is not None and self.parent.memory_start is not None:
+                self.parent.peak_seen = max(self.parent.peak_seen, peak)
+
+        try:
+            current_span.reset(self.token)
+        except ValueError:
+            # 在其他上下文中结束（不应发生），只影响父子关系
+            pass
+        self.finished = True
+        thread = threading.current_thread()
+        self.tracer.record({
+            'id': self.id,
+            'parent': self.parent.id if self.parent is not None else None,
+            'run': self.run_id,
+            'name': self.name,
+            'category': self.category,
+            'start': self.start - self.tracer.origin,
+            'seconds': end - self.start,
+            'thread': thread.native_id,
+            'thread_name': thread.name,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'alloc_mb': alloc_mb,
+            'peak_mb': peak_mb,
+            'error': exc[0].__name__ if exc and exc[0] is not None else None,
+        })
+        return False
+
+    def finish(self):
+        """结束用 Tracer.start 开始的区间"""
+        if not self.finished:
+            self.__exit__(None, None, None)
+
+
+class Tracer:
+    """
+    进程内的区间记录器：保存最近的区间，可按重跑筛选、导出为 JSON 或 Chrome trace 格式
+    关闭时 span() 返回空区间，traced 包装的方法只多一次属性检查
+    """
+
+    def __init__(self, modes=(), max_spans=MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self.ids = itertools.count(1)
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.configure(modes)
+
+    def configure(self, modes):
+        """设置记录模式（见 PROFILE_MODES），空集合表示关闭"""
+        self.modes = set(modes)
+        self.enabled = bool(self.modes)
+        self.track_memory = 'tracemalloc' in self.modes
+        self.profile_runs = 'cprofile' in self.modes
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def span(self, name, category='processor', rows_in=None):
+        """返回区间上下文；记录关闭时返回空区间"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, rows_in)
+
+    def start(self, name, category='app', profile=False):
+        """
+        开始一个根区间（例如一次应用重跑），之后在同一上下文中开始的区间都记录在它下面，用 finish() 结束
+        :param profile: cprofile 模式下是否对该区间做 cProfile 采样
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, root=True, profile=profile).__enter__()
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def run_spans(self, run):
+        """某个根区间（Span 或其编号）下的全部区间，按开始时间排序"""
+        run_id = getattr(run, 'id', run)
+        with self.lock:
+            spans = [span for span in self.spans if span['run'] == run_id]
+        return sorted(spans, key=lambda span: span['start'])
+
+    def recent_spans(self):
+        with self.lock:
+            return sorted(self.spans, key=lambda span: span['start'])
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+    def to_json(self, spans):
+        """区间列表导出为 JSON 文本"""
+        return json.dumps({'pid': os.getpid(), 'modes': sorted(self.modes), 'spans': spans},
+                          ensure_ascii=False, indent=2)
+
+    def to_chrome_trace(self, spans):
+        """
+        区间列表导出为 Chrome trace 格式（chrome://tracing 或 Perfetto 中打开）
+        每个区间是一个完整事件（ph=X），时间单位为微秒
+        """
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in spans:
+            threads.setdefault(span['thread'], span['thread_name'])
+            args = {key: span[key] for key in ['rows_in', 'rows_out', 'alloc_mb', 'peak_mb', 'error']
+                    if span[key] is not None}
+            events.append({
+                'name': span['name'],
+                'cat': span['category'],
+                'ph': 'X',
+                'ts': span['start'] * 1e6,
+                'dur': span['seconds'] * 1e6,
+                'pid': pid,
+                'tid': span['thread'],
+                'args': args,
+            })
+        for thread, thread_name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread,
+                           'args': {'name': thread_name}})
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, ensure_ascii=False)
+
+
+# 进程内共享的记录器，由环境变量 TRIP_PROFILE 打开
+TRACER = Tracer(parse_modes(os.environ.get(PROFILE_ENV)))
+
+
+def traced(func=None, *, name=None, category='processor'):
+    """
+    记录函数每次调用的耗时区间，输入行数取第一个 DataFrame / 数组参数，输出行数取返回值
+    可以直接作为装饰器，也可以指定区间名：@traced(name='view.heatmap', category='app')
+    """
+    if func is None:
+        return functools.partial(traced, name=name, category=category)
+    label = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TRACER.enabled:
+            return func(*args, **kwargs)
+        with Span(TRACER, label, category, rows_of_arguments(args, kwargs)) as span:
+            result = func(*args, **kwargs)
+            span.rows_out = count_rows(result)
+            return result
+
+    return wrapper
+
+
+def traced_methods(cls):
+    """
+    为类中定义的所有公开方法加上 traced（区间名为 类名.方法名）
+    生成器方法不包装（耗时发生在调用方消费时，记录在调用方的区间中）
+    """
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith('_') or not inspect.isfunction(value) or inspect.isgeneratorfunction(value):
+            continue
+        setattr(cls, attr, traced(value, name=f'{cls.__name__}.{attr}'))
+    return cls
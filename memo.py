@@ -0,0 +1,129 @@
+import datetime
+import functools
+import hashlib
+import inspect
+import json
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# 分析结果缓存的默认内存预算（字节）
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def canonical(value):
+    """将参数转换为可稳定序列化的形式（日期、时间、NumPy 标量等）"""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in value.items()}
+    return value
+
+
+def make_key(name, arguments):
+    """根据方法名和参数生成规范的哈希键"""
+    payload = json.dumps([name, canonical(arguments)], sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def estimate_size(value):
+    """估算缓存结果占用的内存（字节）"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class AnalysisCache:
+    """
+    分析结果的 LRU 缓存，总大小超过内存预算时淘汰最久未使用的结果
+    多个会话共享同一个 DataProcessor，因此读写都加锁
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """查找缓存，返回 (是否命中, 结果)"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        """写入缓存；单个结果超过预算时不缓存"""
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存（计数保留）"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """缓存的命中、未命中、淘汰次数及当前占用"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def memoized(method):
+    """
+    缓存 DataProcessor 方法的结果，键为方法名与全部参数（含默认值）的规范哈希
+    结果在调用方之间共享，调用方不应原地修改返回值
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop('self')
+        key = make_key(method.__name__, arguments)
+
+        found, value = self.analysis_cache.get(key)
+        if found:
+            return value
+        value = method(self, *args, **kwargs)
+        self.analysis_cache.put(key, value)
+        return value
+
+    return wrapper
@@ -0,0 +1,95 @@
+import numpy as np
+
+# 按小时统计时的小时数
+HOURS = 24
+
+
+class ODMatrix:
+    """
+    区域间起讫点（OD）矩阵：counts[小时, 上车区域, 下车区域] 的行程数
+    区域编号直接作为下标（0 为未知区域）；不按小时统计时小时维度长度为 1
+    263 个官方区域 × 24 小时约 170 万个单元，稠密 int32 数组约 6.7 MB
+    """
+
+    def __init__(self, counts):
+        self.counts = np.asarray(counts, dtype=np.int32)
+        self.by_hour = self.counts.shape[0] == HOURS
+        self.size = self.counts.shape[1]
+
+    @classmethod
+    def from_zones(cls, pickup_zones, dropoff_zones, size, hours=None):
+        """
+        一次 bincount 统计 OD 矩阵
+        :param pickup_zones: 上车区域编号数组
+        :param dropoff_zones: 下车区域编号数组
+        :param size: 区域编号上限（不含）
+        :param hours: 上车小时数组（0-23），None 表示不按小时统计
+        """
+        codes = np.asarray(pickup_zones, dtype=np.int64) * size + np.asarray(dropoff_zones, dtype=np.int64)
+        n_hours = 1
+        if hours is not None:
+            codes += np.asarray(hours, dtype=np.int64) * size * size
+            n_hours = HOURS
+        counts = np.bincount(codes, minlength=n_hours * size * size)
+        return cls(counts.reshape(n_hours, size, size))
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes
+
+    def __add__(self, other):
+        """合并两个 OD 矩阵（例如不同月份），计数相加"""
+        return ODMatrix(self.counts + other.counts)
+
+    def totals(self, hours=None):
+        """
+        区域×区域的行程数
+        :param hours: 小时切片或下标数组，None 表示全天（需要按小时统计的矩阵才能选择小时）
+        """
+        if hours is None:
+            return self.counts.sum(axis=0)
+        if not self.by_hour:
+            raise ValueError("OD 矩阵没有按小时统计，无法选择小时")
+        return self.counts[hours].sum(axis=0)
+
+    def pair_mask(self, include_diagonal=False, include_unknown=False):
+        """可参与查询的 (上车区域, 下车区域) 组合"""
+        mask = np.ones((self.size, self.size), dtype=bool)
+        if not include_diagonal:
+            np.fill_diagonal(mask, False)
+        if not include_unknown:
+            mask[0, :] = False
+            mask[:, 0] = False
+        return mask
+
+    def top_k(self, k, hours=None, include_diagonal=False, include_unknown=False):
+        """
+        流量最大的 k 个区域组合，按行程数降序
+        :return: (上车区域数组, 下车区域数组, 行程数数组)
+        """
+        matrix = np.where(self.pair_mask(include_diagonal, include_unknown), self.totals(hours), 0).ravel()
+        cells = np.flatnonzero(matrix)
+        if len(cells) > k:
+            cells = cells[np.argpartition(matrix[cells], -k)[-k:]]
+        cells = cells[np.argsort(-matrix[cells], kind='stable')]
+        origins, destinations = np.divmod(cells, self.size)
+        return origins, destinations, matrix[cells]
+
+    def threshold(self, min_count=None, quantile=None, hours=None, include_diagonal=False, include_unknown=False):
+        """
+        行程数不低于阈值的区域组合，按 (上车区域, 下车区域) 排序
+        :param min_count: 行程数下限
+        :param quantile: 以分位数作为下限，在全部非空组合（含同区域内流量）的行程数上计算
+        :return: (上车区域数组, 下车区域数组, 行程数数组)
+        """
+        matrix = self.totals(hours)
+        limit = 1 if min_count is None else max(min_count, 1)
+        if quantile is not None:
+            # 分位数与是否排除同区域内流量无关，只排除未知区域
+            values = matrix[self.pair_mask(True, include_unknown)]
+            values = values[values > 0]
+            if len(values) > 0:
+                limit = max(limit, np.quantile(values, quantile))
+        selected = (matrix >= limit) & self.pair_mask(include_diagonal, include_unknown)
+        origins, destinations = np.nonzero(selected)
+        return origins, destinations, matrix[origins, destinations]
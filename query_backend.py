@@ -0,0 +1,194 @@
+import numpy as np
+import pyarrow.dataset as ds
+from feature_store import FeatureStore
+from instrument import traced_methods
+from od_matrix import HOURS, ODMatrix
+
+# 可选的查询后端
+BACKENDS = ['pandas', 'duckdb']
+
+# 关键指标的度量列及结果中的键
+METRIC_COLUMNS = {'trip_duration': 'avg_trip_duration', 'trip_miles': 'avg_trip_miles', 'driver_pay': 'avg_driver_pay'}
+
+
+def create_backend(name, processor):
+    """按名称创建查询后端"""
+    if name == 'pandas':
+        return PandasBackend(processor)
+    if name == 'duckdb':
+        return DuckDBBackend(processor)
+    raise ValueError(f"未知的查询后端: {name}，可选 {BACKENDS}")
+
+
+@traced_methods
+class PandasBackend:
+    """
+    默认后端：在内存中按上车时间排序的行数据上，用日期索引和二分查找定位行，再用 pandas / NumPy 计算
+    结果作为其他后端的正确性基准；行数据经过采样时，行程数按采样比例换算到全部行程（与 cube 口径一致）
+    所有方法的过滤参数与 DataProcessor.filter_data 相同
+    """
+    name = 'pandas'
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def filter_data(self, *filters):
+        """满足过滤条件的行"""
+        # 连续范围返回切片（不复制数据），否则只按行位置取一次
+        return self.processor.data.iloc[self.processor.filter_index(*filters)]
+
+    def scale(self, counts):
+        """将采样的行数据上的行程数换算到全部行程（取整），未采样时原样返回"""
+        scale = self.processor.sample_scale()
+        if scale == 1:
+            return counts
+        return np.rint(np.asarray(counts) * scale).astype(np.int64)
+
+    def scale_frame(self, frame):
+        """换算结果表的 count 列"""
+        frame['count'] = self.scale(frame['count'].values)
+        return frame
+
+    def metrics(self, *filters):
+        """行程数与各度量的均值（均值由样本计算，不需要换算）"""
+        data = self.filter_data(*filters)
+        return {
+            'count': int(self.scale(len(data))),
+            'avg_trip_duration': self.processor.get_avg_trip_duration(data),
+            'avg_trip_miles': self.processor.get_avg_trip_miles(data),
+            'avg_driver_pay': self.processor.get_avg_fare(data)
+        }
+
+    def quantiles(self, measure, qs, *filters):
+        """度量的精确分位数（线性插值），没有数据时为 NaN"""
+        data = self.filter_data(*filters)
+        values = data[measure].values.astype(np.float64) if measure in data.columns else np.array([])
+        values = values[~np.isnan(values)]
+        return np.quantile(values, qs) if len(values) > 0 else np.full(len(qs), np.nan)
+
+    def hourly_distribution(self, *filters):
+        return self.scale_frame(self.processor.get_hourly_distribution(self.filter_data(*filters)))
+
+    def weekday_weekend_comparison(self, *filters):
+        return self.scale_frame(self.processor.get_weekday_weekend_comparison(self.filter_data(*filters)))
+
+    def zone_traffic(self, *filters):
+        return self.scale_frame(self.processor.get_zone_traffic(self.filter_data(*filters)))
+
+    def od_matrix(self, by_hour, *filters):
+        od = self.processor.get_od_matrix(self.filter_data(*filters), by_hour)
+        return ODMatrix(self.scale(od.counts)) if od is not None else None
+
+
+@traced_methods
+class DuckDBBackend:
+    """
+    DuckDB 后端：直接扫描特征库中的 Arrow 分区文件，由 DuckDB 多线程完成过滤和聚合，只把聚合结果转换为 pandas
+    日期级条件（日期范围、工作日/周末、天气都由日期决定）先在清单上裁剪分区文件，时间段条件下推到扫描
+    扫描的是特征库中的全部行程，不受 sample_size 影响；结果格式与 PandasBackend 相同
+    """
+    name = 'duckdb'
+
+    def __init__(self, processor, threads=None):
+        """
+        :param threads: DuckDB 线程数，None 表示使用全部 CPU 核心
+        """
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("DuckDB 查询后端需要安装 duckdb：pip install duckdb")
+        if not processor.feature_store:
+            raise ValueError("DuckDB 查询后端扫描特征库中的分区，需要 feature_store=True")
+        self.processor = processor
+        self.connection = duckdb.connect()
+        if threads is not None:
+            self.connection.execute(f"SET threads = {int(threads)}")
+
+    def columns(self):
+        return set(self.processor.data.columns)
+
+    def execute(self, select, start_date, end_date, start_time, end_time, day_type='所有', weather='所有',
+                group_by=None):
+        """
+        在满足过滤条件的分区上执行查询
+        :param select: SELECT 子句（表名为 trips）
+        :param group_by: 分组列（同时作为排序列），None 表示不分组
+        :return: pyarrow.Table
+        """
+        files = self.processor.partition_files(start_date, end_date, day_type, weather)
+        if files:
+            trips = ds.dataset(files, format='ipc')
+        else:
+            # 没有分区时扫描特征库的空 schema 表，保证列结构一致
+            trips = FeatureStore(self.processor.feature_store_path).read_table(None, None)
+
+        sql = f"SELECT {select} FROM trips"
+        # 时间过滤（按分钟比较，结束分钟包含在内），全天时省略
+        start_minutes = start_time.hour * 60 + start_time.minute
+        end_minutes = end_time.hour * 60 + end_time.minute
+        if start_minutes > 0 or end_minutes < 24 * 60 - 1:
+            sql += (f" WHERE hour(pickup_datetime) * 60 + minute(pickup_datetime)"
+                    f" BETWEEN {int(start_minutes)} AND {int(end_minutes)}")
+        if group_by:
+            sql += f" GROUP BY {group_by} ORDER BY {group_by}"
+
+        # 每次查询使用独立的游标，多个线程可以同时查询
+        cursor = self.connection.cursor()
+        try:
+            cursor.register('trips', trips)
+            return cursor.execute(sql).to_arrow_table()
+        finally:
+            cursor.close()
+
+    def filter_data(self, *filters):
+        """满足过滤条件的行（按上车时间排序），列类型与内存中的行数据一致"""
+        data = self.execute('*', *filters, group_by=None).to_pandas()
+        data = data.sort_values('pickup_datetime', kind='stable', ignore_index=True)
+        dtypes = self.processor.data.dtypes
+        return data.astype({column: dtypes[column] for column in data.columns if column in dtypes})
+
+    def metrics(self, *filters):
+        """行程数与各度量的均值；度量列不存在时均值为 0，没有数据时为 NaN（与 PandasBackend 一致）"""
+        measures = [column for column in METRIC_COLUMNS if column in self.columns()]
+        select = ', '.join(['count(*) AS count'] + [f'avg({column}) AS {column}' for column in measures])
+        row = self.execute(select, *filters).to_pylist()[0]
+        result = {'count': row['count']}
+        for column, key in METRIC_COLUMNS.items():
+            value = row[column] if column in measures else 0
+            result[key] = np.nan if value is None else value
+        return result
+
+    def quantiles(self, measure, qs, *filters):
+        """度量的精确分位数（quantile_cont 与 np.quantile 的线性插值一致），没有数据时为 NaN"""
+        if measure not in self.columns():
+            return np.full(len(qs), np.nan)
+        value = self.execute(f'quantile_cont({measure}, {list(map(float, qs))}) AS q', *filters).to_pylist()[0]['q']
+        return np.array(value, dtype=np.float64) if value is not None else np.full(len(qs), np.nan)
+
+    def hourly_distribution(self, *filters):
+        grouped = self.execute('pickup_hour, count(*) AS count', *filters, group_by='pickup_hour')
+        return grouped.to_pandas()
+
+    def weekday_weekend_comparison(self, *filters):
+        grouped = self.execute('pickup_hour, is_weekend, count(*) AS count', *filters,
+                               group_by='pickup_hour, is_weekend')
+        return self.processor.weekday_weekend_frame(grouped.to_pandas())
+
+    def zone_traffic(self, *filters):
+        counts = np.zeros(len(self.processor.zones.names), dtype=np.int64)
+        if 'pickup_zone' in self.columns():
+            grouped = self.execute('pickup_zone, count(*) AS count', *filters, group_by='pickup_zone')
+            counts[grouped['pickup_zone'].to_numpy()] = grouped['count'].to_numpy()
+        return self.processor.zone_traffic_frame(counts)
+
+    def od_matrix(self, by_hour, *filters):
+        """OD 矩阵；特征库中没有起点和终点区域时返回 None"""
+        if not {'pickup_zone', 'dropoff_zone'} <= self.columns():
+            return None
+        keys = 'pickup_hour, pickup_zone, dropoff_zone' if by_hour else 'pickup_zone, dropoff_zone'
+        grouped = self.execute(f'{keys}, count(*) AS count', *filters, group_by=keys)
+        size = len(self.processor.zones.names)
+        counts = np.zeros((HOURS if by_hour else 1, size, size), dtype=np.int32)
+        hours = grouped['pickup_hour'].to_numpy() if by_hour else 0
+        counts[hours, grouped['pickup_zone'].to_numpy(), grouped['dropoff_zone'].to_numpy()] = grouped['count'].to_numpy()
+        return ODMatrix(counts)
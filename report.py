@@ -0,0 +1,265 @@
+import argparse
+import datetime
+import gc
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from data_processor import DataProcessor, WEATHER_CONDITIONS, parse_date
+from memo import canonical
+
+# 报表包含的分析
+ANALYSES = ['kpis', 'hourly', 'zone_traffic', 'od_flows', 'route_clusters']
+# 过滤网格各维度的默认取值
+DAY_TYPES = ['所有', '工作日', '周末']
+WEATHER_OPTIONS = ['所有'] + WEATHER_CONDITIONS
+# 时间窗口：全天，或 24 个整小时
+HOUR_WINDOWS = ['day', 'hourly']
+FULL_DAY = (datetime.time(0, 0), datetime.time(23, 59))
+# 每个任务块包含的过滤条件组数（一个任务块由一个进程计算并写入一个文件）
+DEFAULT_CHUNK_SIZE = 50
+# 报表目录中的清单文件
+MANIFEST_FILE = '_manifest.json'
+
+# 子进程通过 fork 直接继承父进程加载好的 DataProcessor（写时复制，不重新加载、不序列化数据）
+PROCESSOR = None
+
+
+def build_grid(processor, dates='daily', hour_windows=HOUR_WINDOWS, day_types=DAY_TYPES, weather=WEATHER_OPTIONS,
+               start_date=None, end_date=None):
+    """
+    生成过滤条件网格：日期 × 时间窗口 × 日期类型 × 天气
+    :param dates: 'daily' 每天单独统计，'range' 整个日期范围一起统计
+    :param hour_windows: 'day'（全天）和/或 'hourly'（24 个整小时）
+    :param start_date: 起始日期，None 表示数据的第一天
+    :param end_date: 结束日期，None 表示数据的最后一天
+    :return: filter_data 参数字典的列表
+    """
+    first, last = processor.get_date_range()
+    first = max(first, parse_date(start_date)) if start_date is not None else first
+    last = min(last, parse_date(end_date)) if end_date is not None else last
+    if dates == 'daily':
+        ranges = [(day, day) for day in pd.date_range(first, last, freq='D').date]
+    elif dates == 'range':
+        ranges = [(first, last)] if first <= last else []
+    else:
+        raise ValueError(f"未知的日期粒度: {dates}，可选 daily / range")
+
+    windows = []
+    if 'day' in hour_windows:
+        windows.append(FULL_DAY)
+    if 'hourly' in hour_windows:
+        windows.extend((datetime.time(hour, 0), datetime.time(hour, 59)) for hour in range(24))
+    return [dict(start_date=start, end_date=end, start_time=start_time, end_time=end_time,
+                 day_type=day_type, weather=weather_condition)
+            for start, end in ranges
+            for start_time, end_time in windows
+            for day_type in day_types
+            for weather_condition in weather]
+
+
+def load_grid(file_path):
+    """
+    从 JSON 文件读取过滤条件网格
+    文件内容为对象列表，键与 filter_data 的参数相同，日期为 'YYYY-MM-DD'，时间为 'HH:MM'；
+    day_type 与 weather 可省略（默认为 '所有'）
+    """
+    with open(file_path, encoding='utf-8') as f:
+        items = json.load(f)
+    return [dict(start_date=parse_date(item['start_date']), end_date=parse_date(item['end_date']),
+                 start_time=datetime.time.fromisoformat(item.get('start_time', '00:00')),
+                 end_time=datetime.time.fromisoformat(item.get('end_time', '23:59')),
+                 day_type=item.get('day_type', '所有'), weather=item.get('weather', '所有'))
+            for item in items]
+
+
+def partition_name(params):
+    """输出文件按日期分区的目录名"""
+    if params['start_date'] == params['end_date']:
+        return f"date={params['start_date']}"
+    return f"date={params['start_date']}_{params['end_date']}"
+
+
+def filter_columns(params):
+    """写入结果的过滤条件列"""
+    return {
+        'start_date': str(params['start_date']),
+        'end_date': str(params['end_date']),
+        'start_time': params['start_time'].strftime('%H:%M'),
+        'end_time': params['end_time'].strftime('%H:%M'),
+        'day_type': params['day_type'],
+        'weather': params['weather'],
+    }
+
+
+def compute_analyses(processor, params, analyses=ANALYSES):
+    """
+    计算一组过滤条件的各项分析（与仪表盘使用相同的查询方法）
+    :return: {分析名: DataFrame}，路线聚类为 {过滤条件 + clusters} 字典
+    """
+    key = filter_columns(params)
+    results = {}
+    if 'kpis' in analyses:
+        metrics = processor.query_metrics(**params)
+        trip_stats = processor.query_trip_stats(**params)
+        results['kpis'] = pd.DataFrame([{**key, **metrics, **trip_stats}])
+    if 'hourly' in analyses:
+        results['hourly'] = processor.query_hourly_distribution(**params).assign(**key)
+    if 'zone_traffic' in analyses:
+        # 只保留有行程的区域
+        zone_traffic = processor.query_zone_traffic(**params)
+        results['zone_traffic'] = zone_traffic[zone_traffic['count'] > 0].assign(**key)
+    if 'od_flows' in analyses:
+        # 全部非空的 (上车区域, 下车区域) 组合（含同区域内流量），仪表盘中的流量图只是其中行程数较多的部分
+        od = processor.query_od_matrix(**params)
+        if od is not None:
+            start, end, counts = od.threshold(min_count=1, include_diagonal=True)
+        else:
+            start = end = counts = np.array([], dtype=np.int64)
+        names = processor.zones.names
+        results['od_flows'] = pd.DataFrame({
+            'pickup_zone': start.astype(np.int64),
+            'dropoff_zone': end.astype(np.int64),
+            'pickup_zone_name': names[start],
+            'dropoff_zone_name': names[end],
+            'count': counts.astype(np.int64),
+        }).assign(**key)
+    if 'route_clusters' in analyses:
+        results['route_clusters'] = {**key, 'clusters': processor.query_route_clusters(**params) or []}
+    return results
+
+
+def write_atomic(file_path, write):
+    """先写临时文件再重命名，中断时不会留下不完整的文件"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f'{file_path}.tmp-{os.getpid()}'
+    write(tmp_path)
+    os.replace(tmp_path, file_path)
+
+
+def write_text(file_path, text):
+    """原子写入文本文件"""
+    def write(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    write_atomic(file_path, write)
+
+
+def run_chunk(chunk_id, tasks, out_dir, analyses=ANALYSES):
+    """
+    计算一个任务块（同一日期分区的若干组过滤条件），每项分析写入分区目录中的一个文件
+    :return: 任务块的统计信息
+    """
+    start = time.perf_counter()
+    collected = {analysis: [] for analysis in analyses}
+    for params in tasks:
+        for analysis, result in compute_analyses(PROCESSOR, params, analyses).items():
+            collected[analysis].append(result)
+
+    partition = partition_name(tasks[0])
+    rows = {}
+    for analysis, results in collected.items():
+        base = os.path.join(out_dir, analysis, partition, f'part-{chunk_id:05d}')
+        if analysis == 'route_clusters':
+            write_text(f'{base}.json', json.dumps(canonical(results), ensure_ascii=False))
+            rows[analysis] = sum(len(result['clusters']) for result in results)
+        else:
+            frame = pd.concat(results, ignore_index=True)
+            write_atomic(f'{base}.parquet', lambda path: frame.to_parquet(path, index=False))
+            rows[analysis] = len(frame)
+    return {'chunk': chunk_id, 'partition': partition, 'sets': len(tasks), 'rows': rows,
+            'seconds': time.perf_counter() - start, 'pid': os.getpid()}
+
+
+def make_chunks(grid, chunk_size=DEFAULT_CHUNK_SIZE):
+    """按日期分区分组，每组再切分为不超过 chunk_size 组过滤条件的任务块"""
+    partitions = {}
+    for params in grid:
+        partitions.setdefault(partition_name(params), []).append(params)
+    chunks = []
+    for tasks in partitions.values():
+        for offset in range(0, len(tasks), chunk_size):
+            chunks.append(tasks[offset:offset + chunk_size])
+    return chunks
+
+
+def run_report(processor, grid, out_dir, analyses=ANALYSES, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    在进程池中计算整个过滤条件网格的报表，结果按分析和日期分区写入 out_dir
+    子进程通过 fork 共享父进程中已加载的数据（写时复制），每个任务块只传递过滤条件和统计信息；
+    fork 前冻结垃圾回收跟踪的对象，避免子进程的垃圾回收触碰共享页面导致复制
+    不支持 fork 的平台（Windows、macOS 默认）或 workers=1 时在当前进程中依次计算
+    :param workers: 进程数，None 表示 CPU 核心数
+    :return: 报表清单（也写入 out_dir/_manifest.json）
+    """
+    global PROCESSOR
+    workers = workers or os.cpu_count() or 1
+    use_fork = workers > 1 and 'fork' in multiprocessing.get_all_start_methods()
+    PROCESSOR = processor
+
+    chunks = make_chunks(grid, chunk_size)
+    start = time.perf_counter()
+    summaries = []
+    if use_fork:
+        gc.freeze()
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+                futures = [executor.submit(run_chunk, i, tasks, out_dir, analyses) for i, tasks in enumerate(chunks)]
+                for future in as_completed(futures):
+                    summaries.append(future.result())
+                    print(f"已完成 {len(summaries)}/{len(chunks)} 个任务块", flush=True)
+        finally:
+            gc.unfreeze()
+    else:
+        for i, tasks in enumerate(chunks):
+            summaries.append(run_chunk(i, tasks, out_dir, analyses))
+            print(f"已完成 {len(summaries)}/{len(chunks)} 个任务块", flush=True)
+    seconds = time.perf_counter() - start
+
+    manifest = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'data_files': processor.data_files,
+        'analyses': list(analyses),
+        'sets': len(grid),
+        'chunks': len(chunks),
+        'workers': workers if use_fork else 1,
+        'seconds': seconds,
+        'sets_per_second': len(grid) / seconds if seconds > 0 else None,
+        'rows': {analysis: sum(summary['rows'][analysis] for summary in summaries) for analysis in analyses},
+    }
+    write_text(os.path.join(out_dir, MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按过滤条件网格批量生成分析报表（不启动仪表盘）")
+    parser.add_argument('--data', default=os.environ.get('TRIP_DATA_FILES', 'data.parquet'),
+                        help="数据文件或通配符模式，默认同 app.py（TRIP_DATA_FILES）")
+    parser.add_argument('--out', default='reports', help="报表输出目录")
+    parser.add_argument('--grid', default=None, help="过滤条件网格的 JSON 文件，指定时忽略下面的网格参数")
+    parser.add_argument('--dates', choices=['daily', 'range'], default='daily', help="每天单独统计或整个范围一起统计")
+    parser.add_argument('--start-date', default=None, help="起始日期 YYYY-MM-DD")
+    parser.add_argument('--end-date', default=None, help="结束日期 YYYY-MM-DD")
+    parser.add_argument('--hour-windows', nargs='+', choices=HOUR_WINDOWS, default=HOUR_WINDOWS, help="时间窗口")
+    parser.add_argument('--day-types', nargs='+', choices=DAY_TYPES, default=DAY_TYPES, help="日期类型")
+    parser.add_argument('--weather', nargs='+', choices=WEATHER_OPTIONS, default=WEATHER_OPTIONS, help="天气条件")
+    parser.add_argument('--analyses', nargs='+', choices=ANALYSES, default=ANALYSES, help="要计算的分析")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认为 CPU 核心数")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="每个任务块的过滤条件组数")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.out) and os.listdir(args.out):
+        parser.error(f"输出目录不为空: {args.out}")
+    data_processor = DataProcessor(args.data)
+    if args.grid:
+        filter_grid = load_grid(args.grid)
+    else:
+        filter_grid = build_grid(data_processor, args.dates, args.hour_windows, args.day_types, args.weather,
+                                 args.start_date, args.end_date)
+    print(f"共 {len(filter_grid):,} 组过滤条件")
+    result = run_report(data_processor, filter_grid, args.out, args.analyses, args.workers, args.chunk_size)
+    print(f"报表已写入 {args.out}：{result['sets']:,} 组过滤条件，耗时 {result['seconds']:.1f} 秒，"
+          f"每秒 {result['sets_per_second']:.1f} 组")
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+import pyarrow as pa
+
+# 共享数据格式版本，结构变化时递增以便重新发布
+SHARED_VERSION = 1
+
+# 指向当前数据版本的指针文件
+CURRENT_FILE = 'CURRENT'
+# 挂载时遇到数据版本被替换（旧文件已删除）的重试次数
+ATTACH_RETRIES = 3
+
+
+def fsync_file(file_path):
+    """将文件内容刷到磁盘，保证重命名后其他进程读到的是完整文件"""
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SharedDataset:
+    """
+    以内存映射 Arrow IPC 文件发布的只读行程数据
+    多个进程（例如负载均衡后面的多个 Streamlit 服务进程）挂载同一个文件，
+    数值列直接引用操作系统页缓存，增加进程几乎不增加内存占用
+
+    目录结构：每次发布写入一个新的数据版本文件 trips-<时间戳>-<进程号>.arrow，
+    CURRENT 指针文件记录当前版本及其构建参数；发布时先写完数据文件再原子替换指针，
+    已挂载旧版本的进程继续使用旧映射，重新加载时才切换到新版本
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def current(self):
+        """读取指针文件，返回 {'version', 'key', 'file'}；尚未发布时返回 None"""
+        pointer = os.path.join(self.path, CURRENT_FILE)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, encoding='utf-8') as f:
+            return json.load(f)
+
+    def attach(self, key):
+        """
+        零拷贝挂载当前版本的数据
+        :param key: 数据的构建参数，与发布时不一致时不挂载
+        :return: 只读的 DataFrame；尚未发布、版本或参数不匹配时返回 None
+        """
+        for _ in range(ATTACH_RETRIES):
+            current = self.current()
+            if current is None or current.get('version') != SHARED_VERSION or current.get('key') != key:
+                return None
+            try:
+                source = pa.memory_map(os.path.join(self.path, current['file']), 'r')
+            except FileNotFoundError:
+                # 读取指针后数据版本恰好被替换并清理，重新读取指针
+                continue
+            table = pa.ipc.open_file(source).read_all()
+            # split_blocks 让每列单独成块，无空值的数值列直接引用映射的内存
+            return table.to_pandas(split_blocks=True)
+        return None
+
+    def publish(self, data, key):
+        """
+        发布新的数据版本：写入新文件并刷盘，再原子替换指针文件，最后清理不再使用的旧版本
+        :param data: 处理好的行程数据
+        :param key: 数据的构建参数，挂载时用于校验
+        :return: 新版本的文件名
+        """
+        os.makedirs(self.path, exist_ok=True)
+        name = f'trips-{time.time_ns()}-{os.getpid()}.arrow'
+        tmp_file = os.path.join(self.path, name + '.tmp')
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        # 不压缩，挂载时才能直接映射
+        with pa.OSFile(tmp_file, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        fsync_file(tmp_file)
+        os.replace(tmp_file, os.path.join(self.path, name))
+
+        pointer = os.path.join(self.path, CURRENT_FILE)
+        with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': SHARED_VERSION, 'key': key, 'file': name}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + '.tmp', pointer)
+
+        self.cleanup(keep=name)
+        return name
+
+    def cleanup(self, keep):
+        """
+        删除旧的数据版本文件
+        POSIX 系统上已映射该文件的进程不受影响（映射在解除前一直有效）；
+        Windows 上文件被映射时无法删除，留到下次发布时再清理
+        """
+        for name in os.listdir(self.path):
+            if name.startswith('trips-') and name != keep and not name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
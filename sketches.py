@@ -0,0 +1,346 @@
+import os
+import numpy as np
+
+# 近似查询结构的格式版本，结构变化时递增以便重建
+SKETCH_VERSION = 1
+
+# 每个 (日期, 小时) 分层保留的样本行数
+STRATUM_SAMPLE_SIZE = 64
+# KLL 分位数草图每层（同一权重）保留的最多元素数
+KLL_CAPACITY = 128
+# HyperLogLog 寄存器数为 2 ** HLL_PRECISION
+HLL_PRECISION = 12
+# 95% 置信水平对应的正态分位数
+Z_95 = 1.96
+
+# 分层样本中的度量列
+SAMPLE_MEASURES = ['trip_duration', 'trip_miles', 'driver_pay']
+# 维护分位数草图的度量列
+QUANTILE_MEASURES = ['trip_duration', 'driver_pay']
+
+
+def group_starts(sorted_keys):
+    """已排序键数组中每组的起始位置"""
+    if len(sorted_keys) == 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+
+
+def rank_in_group(sorted_keys):
+    """已排序键数组中每个元素在组内的序号，以及每个元素所属组的下标和各组大小"""
+    starts = group_starts(sorted_keys)
+    sizes = np.diff(np.r_[starts, len(sorted_keys)])
+    group = np.repeat(np.arange(len(starts)), sizes)
+    return np.arange(len(sorted_keys)) - starts[group], group, sizes
+
+
+def bottom_k(strata, keys, k):
+    """每个分层中随机键最小的 k 行的位置（bottom-k 抽样：各层均匀无放回抽样，且可合并）"""
+    order = np.lexsort((keys, strata))
+    rank, _, _ = rank_in_group(strata[order])
+    return order[rank < k]
+
+
+def hash64(values):
+    """splitmix64 哈希，将整数映射为均匀分布的 64 位哈希值"""
+    with np.errstate(over='ignore'):
+        x = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def weighted_quantiles(values, weights, qs):
+    """带权重的分位数（取累计权重首次达到 q × 总权重的元素）"""
+    order = np.argsort(values, kind='stable')
+    values, cumulative = values[order], np.cumsum(weights[order])
+    positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+    return values[np.minimum(positions, len(values) - 1)]
+
+
+class TripSketches:
+    """
+    导入时维护的近似查询结构，全部按 (日期, 小时) 分层，分层编号为 天数 × 24 + 小时
+    - 分层样本：每层按随机键保留 STRATUM_SAMPLE_SIZE 行，结合每层的准确行数估计均值及置信区间
+    - KLL 分位数草图：每层每个度量保留若干 (层级, 值)，层级 h 的元素代表 2 ** h 个原始值
+    - HyperLogLog：每层一组寄存器，估计不同路线（上车区域, 下车区域）数
+    所有结构都可以按分层合并，批次、文件或月份之间的合并结果与一次构建等价
+    """
+
+    def __init__(self, sample, quantiles, hll_strata, hll_registers):
+        """
+        :param sample: 分层样本，{'stratum', 'key', 'minute', 度量列...} 的数组字典
+        :param quantiles: {度量: (分层编号数组, 层级数组, 值数组)}
+        :param hll_strata: HyperLogLog 分层编号数组（升序）
+        :param hll_registers: (分层数, 2 ** HLL_PRECISION) 的 uint8 寄存器；没有区域数据时为 None
+        """
+        self.sample = sample
+        self.quantiles = quantiles
+        self.hll_strata = hll_strata
+        self.hll_registers = hll_registers
+
+    @property
+    def nbytes(self):
+        total = sum(values.nbytes for values in self.sample.values())
+        total += sum(array.nbytes for arrays in self.quantiles.values() for array in arrays)
+        if self.hll_registers is not None:
+            total += self.hll_strata.nbytes + self.hll_registers.nbytes
+        return total
+
+    @classmethod
+    def from_frame(cls, data, rng, zone_size=None):
+        """
+        从一批行程数据构建
+        :param data: 包含 pickup_datetime 及度量列的数据（可选 pickup_zone / dropoff_zone）
+        :param rng: 随机数生成器（抽样键和压缩偏移）
+        :param zone_size: 区域编号上限，用于将路线编码为整数
+        """
+        pickup = data['pickup_datetime'].values
+        days = pickup.astype('datetime64[D]').astype(np.int64)
+        minutes = ((pickup - pickup.astype('datetime64[D]')) // np.timedelta64(1, 'm')).astype(np.int16)
+        strata = days * 24 + minutes // 60
+
+        # 分层样本
+        keys = rng.random(len(data))
+        rows = bottom_k(strata, keys, STRATUM_SAMPLE_SIZE)
+        sample = {'stratum': strata[rows], 'key': keys[rows], 'minute': minutes[rows]}
+        for measure in SAMPLE_MEASURES:
+            values = data[measure].values if measure in data.columns else np.full(len(data), np.nan)
+            sample[measure] = values[rows].astype(np.float32)
+
+        # 分位数草图：每层按值排序后，按该层行数一次性等间隔抽取，得到不超过容量的元素
+        quantiles = {}
+        for measure in QUANTILE_MEASURES:
+            if measure not in data.columns:
+                continue
+            values = data[measure].values.astype(np.float64)
+            valid = ~np.isnan(values)
+            quantiles[measure] = cls.initial_compaction(strata[valid], values[valid], rng)
+
+        # HyperLogLog
+        hll_strata, hll_registers = np.array([], dtype=np.int64), None
+        if zone_size is not None and 'pickup_zone' in data.columns and 'dropoff_zone' in data.columns:
+            routes = data['pickup_zone'].values.astype(np.int64) * zone_size + data['dropoff_zone'].values
+            hll_strata, hll_registers = cls.build_registers(strata, hash64(routes))
+
+        return cls(sample, quantiles, hll_strata, hll_registers)
+
+    @staticmethod
+    def initial_compaction(strata, values, rng):
+        """将每层的原始值压缩到层级 L（每 2 ** L 个取一个，随机起点），使每层元素不超过 KLL_CAPACITY"""
+        order = np.lexsort((values, strata))
+        strata, values = strata[order], values[order]
+        rank, group, sizes = rank_in_group(strata)
+        levels = np.maximum(np.ceil(np.log2(np.maximum(sizes / KLL_CAPACITY, 1))), 0).astype(np.int8)
+        steps = 2 ** levels.astype(np.int64)
+        offsets = (rng.random(len(sizes)) * steps).astype(np.int64)
+        keep = (rank % steps[group]) == offsets[group]
+        return strata[keep], levels[group][keep], values[keep]
+
+    @staticmethod
+    def compact(strata, levels, values, rng):
+        """KLL 压缩：同一分层同一层级的元素超过容量时，排序后隔一个取一个并升一级，直到都不超过容量"""
+        while True:
+            order = np.lexsort((values, levels, strata))
+            strata, levels, values = strata[order], levels[order], values[order]
+            rank, group, sizes = rank_in_group(strata * 64 + levels)
+            over = sizes > KLL_CAPACITY
+            if not over.any():
+                return strata, levels, values
+            # 超出容量的组压缩偶数个元素，奇数时最后一个保留在原层级
+            paired = rank < (sizes // 2 * 2)[group]
+            offsets = rng.integers(0, 2, len(sizes))
+            compacting = over[group] & paired
+            promoted = compacting & (rank % 2 == offsets[group])
+            keep = ~compacting | promoted
+            levels = np.where(promoted, levels + 1, levels).astype(np.int8)
+            strata, levels, values = strata[keep], levels[keep], values[keep]
+
+    @staticmethod
+    def build_registers(strata, hashes):
+        """按分层构建 HyperLogLog 寄存器"""
+        index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+        # 索引位之后的 43 位中前导零的个数 + 1（43 位以内可以用浮点数精确计算位长）
+        rest = ((hashes << np.uint64(HLL_PRECISION)) >> np.uint64(21)).astype(np.float64)
+        bit_length = np.where(rest > 0, np.frexp(rest)[1], 0)
+        rho = (43 - bit_length + 1).astype(np.uint8)
+
+        unique_strata, stratum_index = np.unique(strata, return_inverse=True)
+        registers = np.zeros((len(unique_strata), 2 ** HLL_PRECISION), dtype=np.uint8)
+        np.maximum.at(registers, (stratum_index, index), rho)
+        return unique_strata, registers
+
+    @classmethod
+    def merge(cls, sketches, rng=None):
+        """合并多个近似查询结构；没有可合并的结构（列表为空或全为 None）时返回 None"""
+        sketches = [sketch for sketch in sketches if sketch is not None]
+        if not sketches:
+            return None
+        if len(sketches) == 1:
+            return sketches[0]
+        rng = rng if rng is not None else np.random.default_rng(0)
+
+        # 分层样本：合并后每层重新取随机键最小的行
+        sample = {column: np.concatenate([sketch.sample[column] for sketch in sketches])
+                  for column in sketches[0].sample}
+        rows = bottom_k(sample['stratum'], sample['key'], STRATUM_SAMPLE_SIZE)
+        sample = {column: values[rows] for column, values in sample.items()}
+
+        quantiles = {}
+        for measure in QUANTILE_MEASURES:
+            parts = [sketch.quantiles[measure] for sketch in sketches if measure in sketch.quantiles]
+            if parts:
+                quantiles[measure] = cls.compact(*(np.concatenate(arrays) for arrays in zip(*parts)), rng)
+
+        hll_strata, hll_registers = np.array([], dtype=np.int64), None
+        parts = [sketch for sketch in sketches if sketch.hll_registers is not None]
+        if parts:
+            strata = np.concatenate([sketch.hll_strata for sketch in parts])
+            registers = np.concatenate([sketch.hll_registers for sketch in parts])
+            order = np.argsort(strata, kind='stable')
+            strata, registers = strata[order], registers[order]
+            starts = group_starts(strata)
+            hll_strata, hll_registers = strata[starts], np.maximum.reduceat(registers, starts, axis=0)
+
+        return cls(sample, quantiles, hll_strata, hll_registers)
+
+    def metrics(self, strata, stratum_counts, minutes):
+        """
+        由分层样本估计行程数及各度量的均值，并给出 95% 置信区间
+        :param strata: 选中的分层编号数组
+        :param stratum_counts: 各分层的准确行数（来自 cube）
+        :param minutes: (起始分钟, 结束分钟)，一天中的分钟数，闭区间；整小时范围时行程数是准确的
+        :return: (指标字典, {指标: (下限, 上限)})
+        """
+        lookup = dict(zip(strata.tolist(), stratum_counts.tolist()))
+        selected = np.isin(self.sample['stratum'], strata)
+        stratum = self.sample['stratum'][selected]
+        minute = self.sample['minute'][selected]
+        in_window = (minute >= minutes[0]) & (minute <= minutes[1])
+
+        # 每个样本行代表的行程数 N_h / n_h，以及各层的抽样比例修正
+        unique_strata, index, sample_sizes = np.unique(stratum, return_inverse=True, return_counts=True)
+        population = np.array([lookup[value] for value in unique_strata.tolist()], dtype=np.float64)
+        fpc = np.clip(1 - sample_sizes / np.maximum(population, 1), 0, 1)
+
+        def total_and_variance(y):
+            """分层估计的总量及其方差：Σ N_h ȳ_h，Σ N_h² (1 - f_h) s_h² / n_h"""
+            sums = np.bincount(index, weights=y, minlength=len(unique_strata))
+            sumsq = np.bincount(index, weights=y ** 2, minlength=len(unique_strata))
+            means = sums / sample_sizes
+            variances = np.where(sample_sizes > 1, (sumsq - sample_sizes * means ** 2) / np.maximum(sample_sizes - 1, 1), 0)
+            total = float(np.sum(population * means))
+            variance = float(np.sum(population ** 2 * fpc * np.maximum(variances, 0) / sample_sizes))
+            return total, variance
+
+        count, count_variance = total_and_variance(in_window.astype(np.float64))
+        result = {'count': int(round(count))}
+        bounds = {'count': (count - Z_95 * np.sqrt(count_variance), count + Z_95 * np.sqrt(count_variance))}
+        for measure in SAMPLE_MEASURES:
+            values = self.sample[measure][selected].astype(np.float64)
+            domain = in_window & ~np.isnan(values)
+            y = np.where(domain, values, 0.0)
+            total, _ = total_and_variance(y)
+            size, _ = total_and_variance(domain.astype(np.float64))
+            key = f'avg_{measure}'
+            if size <= 0:
+                result[key] = np.nan
+                bounds[key] = (np.nan, np.nan)
+                continue
+            # 比率估计 Ȳ = Y / X，方差用残差 y - Ȳ x 线性化
+            mean = total / size
+            _, residual_variance = total_and_variance(np.where(domain, values - mean, 0.0))
+            half_width = Z_95 * np.sqrt(residual_variance) / size
+            result[key] = mean
+            bounds[key] = (mean - half_width, mean + half_width)
+        return result, bounds
+
+    def rank_error(self, levels):
+        """分位数草图的相对秩误差估计：每层压缩引入的误差约为 1 / 容量，随机偏移使各层误差按平方根累积"""
+        if len(levels) == 0 or levels.max() == 0:
+            return 0.0
+        return 2 * np.sqrt(int(levels.max())) / KLL_CAPACITY
+
+    def quantiles_for(self, measure, qs, strata):
+        """
+        由分位数草图估计选中分层内某个度量的分位数
+        :return: (分位数数组, 下限数组, 上限数组)；没有数据时为 NaN
+        """
+        qs = np.asarray(qs, dtype=np.float64)
+        nan = np.full(len(qs), np.nan)
+        if measure not in self.quantiles:
+            return nan, nan, nan
+        item_strata, levels, values = self.quantiles[measure]
+        selected = np.isin(item_strata, strata)
+        if not selected.any():
+            return nan, nan, nan
+        levels, values = levels[selected], values[selected]
+        weights = 2.0 ** levels
+        error = self.rank_error(levels)
+        estimate = weighted_quantiles(values, weights, qs)
+        low = weighted_quantiles(values, weights, np.clip(qs - error, 0, 1))
+        high = weighted_quantiles(values, weights, np.clip(qs + error, 0, 1))
+        return estimate, low, high
+
+    def hll_estimate(self, strata):
+        """合并选中分层的寄存器并估计基数"""
+        selected = np.isin(self.hll_strata, strata)
+        if not selected.any():
+            return 0.0
+        m = 2 ** HLL_PRECISION
+        registers = self.hll_registers[selected].max(axis=0).astype(np.float64)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -registers)
+        zeros = np.count_nonzero(registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # 小基数时使用线性计数
+            estimate = m * np.log(m / zeros)
+        return estimate
+
+    def distinct_routes(self, strata, whole=None):
+        """
+        由 HyperLogLog 估计选中分层内的不同路线数
+        :param whole: 完整落在时间段内的分层掩码；分钟精度的时间段两端的小时只覆盖一部分，
+                      估计值按整小时计算（偏大），下限只用完整的小时计算
+        :return: (估计值, 下限, 上限)；没有区域数据时为 None
+        """
+        if self.hll_registers is None:
+            return None
+        error = Z_95 * 1.04 / np.sqrt(2 ** HLL_PRECISION)
+        estimate = self.hll_estimate(strata)
+        lower = estimate if whole is None or whole.all() else self.hll_estimate(strata[whole])
+        return int(round(estimate)), lower * (1 - error), estimate * (1 + error)
+
+    def save(self, file_path, key):
+        """
+        保存到 npz 文件
+        :param key: 构建时的数据指纹与参数，加载时用于校验
+        """
+        arrays = {'version': np.array(SKETCH_VERSION), 'key': np.array(key),
+                  'hll_strata': self.hll_strata}
+        if self.hll_registers is not None:
+            arrays['hll_registers'] = self.hll_registers
+        for column, values in self.sample.items():
+            arrays[f'sample__{column}'] = values
+        for measure, (strata, levels, values) in self.quantiles.items():
+            arrays[f'quantile__{measure}__strata'] = strata
+            arrays[f'quantile__{measure}__levels'] = levels
+            arrays[f'quantile__{measure}__values'] = values
+        with open(file_path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, file_path, key):
+        """从 npz 文件加载；文件不存在、版本或指纹不匹配时返回 None"""
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as arrays:
+            if int(arrays['version']) != SKETCH_VERSION or str(arrays['key']) != key:
+                return None
+            sample = {name[len('sample__'):]: arrays[name] for name in arrays.files if name.startswith('sample__')}
+            quantiles = {
+                measure: tuple(arrays[f'quantile__{measure}__{part}'] for part in ['strata', 'levels', 'values'])
+                for measure in QUANTILE_MEASURES if f'quantile__{measure}__values' in arrays.files
+            }
+            registers = arrays['hll_registers'] if 'hll_registers' in arrays.files else None
+            return cls(sample, quantiles, arrays['hll_strata'], registers)
@@ -0,0 +1,170 @@
+import http.server
+import io
+import os
+import re
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import requests
+import data_fetch
+
+
+def parquet_bytes(rows=1000):
+    """一个小的 parquet 文件内容"""
+    buffer = io.BytesIO()
+    pq.write_table(pa.table({'trip_miles': [float(i) for i in range(rows)]}), buffer)
+    return buffer.getvalue()
+
+
+class FileServer(http.server.ThreadingHTTPServer):
+    """本地 HTTP 文件服务器：files 为 {路径: 内容}，support_range 为 False 时忽略 Range 请求头"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RangeHandler)
+        self.files = {}
+        self.support_range = True
+        self.requests = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        range_header = self.headers.get('Range')
+        server.requests.append((self.path, range_header))
+        content = server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+
+        match = re.fullmatch(r'bytes=(\d+)-', range_header or '')
+        if match is None or not server.support_range:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        start = int(match.group(1))
+        if start >= len(content):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(content)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """重试时不等待"""
+    monkeypatch.setattr(data_fetch.time, 'sleep', lambda seconds: None)
+
+
+def test_download_complete_file(server, tmp_path):
+    content = parquet_bytes()
+    server.files['/a.parquet'] = content
+    save_path = str(tmp_path / 'a.parquet')
+
+    assert data_fetch.download_file(f'{server.url}/a.parquet', save_path) == save_path
+    with open(save_path, 'rb') as f:
+        assert f.read() == content
+    assert not os.path.exists(save_path + '.part')
+
+
+def test_resume_partial_file(server, tmp_path):
+    content = parquet_bytes()
+    server.files['/a.parquet'] = content
+    save_path = str(tmp_path / 'a.parquet')
+    half = len(content) // 2
+    with open(save_path + '.part', 'wb') as f:
+        f.write(content[:half])
+
+    data_fetch.download_file(f'{server.url}/a.parquet', save_path)
+    with open(save_path, 'rb') as f:
+        assert f.read() == content
+    # 只请求了剩余的部分
+    assert server.requests == [('/a.parquet', f'bytes={half}-')]
+
+
+def test_416_on_complete_part_file(server, tmp_path):
+    content = parquet_bytes()
+    server.files['/a.parquet'] = content
+    save_path = str(tmp_path / 'a.parquet')
+    with open(save_path + '.part', 'wb') as f:
+        f.write(content)
+
+    data_fetch.download_file(f'{server.url}/a.parquet', save_path)
+    with open(save_path, 'rb') as f:
+        assert f.read() == content
+    assert server.requests == [('/a.parquet', f'bytes={len(content)}-')]
+
+
+def test_server_ignoring_range_restarts(server, tmp_path):
+    content = parquet_bytes()
+    server.files['/a.parquet'] = content
+    server.support_range = False
+    save_path = str(tmp_path / 'a.parquet')
+    with open(save_path + '.part', 'wb') as f:
+        f.write(content[:len(content) // 2])
+
+    data_fetch.download_file(f'{server.url}/a.parquet', save_path)
+    # 返回 200 时从头写入，不会追加到已下载的部分之后
+    with open(save_path, 'rb') as f:
+        assert f.read() == content
+    assert len(server.requests) == 1
+
+
+def test_404_raises_without_retry(server, tmp_path):
+    save_path = str(tmp_path / 'missing.parquet')
+    with pytest.raises(requests.exceptions.HTTPError) as error:
+        data_fetch.download_file(f'{server.url}/missing.parquet', save_path)
+    assert error.value.response.status_code == 404
+    assert len(server.requests) == 1
+    assert not os.path.exists(save_path)
+
+
+def test_corrupt_part_file_is_discarded(server, tmp_path):
+    content = parquet_bytes()
+    server.files['/a.parquet'] = content
+    save_path = str(tmp_path / 'a.parquet')
+    half = len(content) // 2
+    # 已下载的部分与服务器上的文件不一致：续传后大小正确，但文件头的魔数不对
+    with open(save_path + '.part', 'wb') as f:
+        f.write(b'\0' * half)
+
+    data_fetch.download_file(f'{server.url}/a.parquet', save_path)
+    with open(save_path, 'rb') as f:
+        assert f.read() == content
+    # 第一次续传后校验失败，删除 .part 后从头下载
+    assert server.requests == [('/a.parquet', f'bytes={half}-'), ('/a.parquet', None)]
+
+
+def test_corrupt_download_fails_after_retries(server, tmp_path):
+    server.files['/bad.parquet'] = b'not a parquet file'
+    save_path = str(tmp_path / 'bad.parquet')
+    with pytest.raises(IOError):
+        data_fetch.download_file(f'{server.url}/bad.parquet', save_path, retries=2)
+    assert len(server.requests) == 3
+    assert not os.path.exists(save_path)
+    assert not os.path.exists(save_path + '.part')
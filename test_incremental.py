@@ -0,0 +1,94 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import make_synthetic_trips
+from cube import TripCube
+from data_processor import DataProcessor
+
+# 三个月份的数据文件：(文件名, 起始日期, 行程数, 随机种子)
+MONTHS = [('trips_a.parquet', '2024-01-01', 6_000, 1),
+          ('trips_b.parquet', '2024-02-01', 5_000, 2),
+          ('trips_c.parquet', '2024-03-01', 4_000, 3)]
+# 比较关键指标的时间段：整小时由 cube 回答，分钟精度回退到行扫描
+TIME_WINDOWS = [(datetime.time(0, 0), datetime.time(23, 59)), (datetime.time(7, 0), datetime.time(9, 59)),
+                (datetime.time(6, 15), datetime.time(18, 40))]
+
+
+@pytest.fixture
+def files(tmp_path):
+    """各月份的数据文件路径"""
+    paths = []
+    for name, start, n, seed in MONTHS:
+        make_synthetic_trips(n, seed=seed, start=start, days=10).to_parquet(tmp_path / name, index=False)
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def fresh(paths):
+    """直接读取全部数据文件重新构建（不使用特征库），作为增量结果的基准"""
+    return DataProcessor(list(paths), feature_store=False)
+
+
+def assert_same_cube(expected, actual):
+    """cube 的单元格统计量、日期与天气一致（统计量允许浮点累加顺序带来的误差）"""
+    assert list(expected.days) == list(actual.days)
+    assert list(expected.weather) == list(actual.weather)
+    pd.testing.assert_frame_equal(expected.cells.reset_index(drop=True), actual.cells.reset_index(drop=True),
+                                  check_dtype=False, rtol=1e-9)
+    np.testing.assert_allclose(expected.daily_hourly, actual.daily_hourly, rtol=1e-9)
+
+
+def assert_same_processor(expected, actual):
+    """cube、行数和各时间段的关键指标一致"""
+    assert_same_cube(expected.cube, actual.cube)
+    assert len(expected.data) == len(actual.data)
+    assert expected.get_date_range() == actual.get_date_range()
+    start_date, end_date = expected.get_date_range()
+    for start_time, end_time in TIME_WINDOWS:
+        for day_type in ['所有', '工作日', '周末']:
+            filters = (start_date, end_date, start_time, end_time, day_type)
+            left, right = expected.query_metrics(*filters), actual.query_metrics(*filters)
+            assert left.keys() == right.keys()
+            for key in left:
+                np.testing.assert_allclose(left[key], right[key], rtol=1e-9, err_msg=f'{key} {filters}')
+
+
+def test_add_source(files):
+    processor = DataProcessor(files[:2])
+    processor.add_source(files[2])
+    assert_same_processor(fresh(files), processor)
+
+
+def test_remove_source(files):
+    processor = DataProcessor(files)
+    processor.remove_source(files[1])
+    assert_same_processor(fresh([files[0], files[2]]), processor)
+
+
+def test_replace_source(files):
+    processor = DataProcessor(files)
+    # 重新发布同名的月份：内容和行数都不同
+    make_synthetic_trips(3_000, seed=9, start='2024-02-01', days=10).to_parquet(files[1], index=False)
+    processor.add_source(files[1])
+    assert_same_processor(fresh(files), processor)
+
+
+def test_add_then_remove_restores(files):
+    processor = DataProcessor(files[:2])
+    before = processor.cube
+    processor.add_source(files[2])
+    processor.remove_source(files[2])
+    assert_same_cube(before, processor.cube)
+    assert_same_processor(fresh(files[:2]), processor)
+
+
+def test_cube_merge_and_subtract_algebra(files):
+    cubes = [fresh([path]).cube for path in files]
+    left = TripCube.merge([TripCube.merge(cubes[:2]), cubes[2]])
+    right = TripCube.merge([cubes[0], TripCube.merge(cubes[1:])])
+    assert_same_cube(left, right)
+    assert_same_cube(TripCube.merge(cubes[::-1]), left)
+    assert_same_cube(fresh(files).cube, left)
+    assert_same_cube(TripCube.merge([cubes[0], cubes[2]]), left.subtract(cubes[1]))
+    assert_same_cube(cubes[0], left.subtract(TripCube.merge(cubes[1:])))
@@ -0,0 +1,94 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import make_synthetic_trips
+from data_processor import DataProcessor, WEATHER_CONDITIONS
+from heatmap import HourlyHeatmap
+from od_matrix import ODMatrix
+
+pytest.importorskip('duckdb')
+
+# 通过 DataProcessor 比较的全部查询方法
+QUERIES = ['query_metrics', 'query_trip_stats', 'query_hourly_distribution', 'query_weekday_weekend_comparison',
+           'query_zone_traffic', 'query_heatmap_data', 'query_hourly_heatmap_layers', 'query_route_clusters',
+           'query_zone_flow', 'query_od_matrix']
+# 随机过滤条件的组数
+N_FILTERS = 12
+
+
+@pytest.fixture(scope='module')
+def processors(tmp_path_factory):
+    """同一个小特征库上的 pandas（基准）与 DuckDB 两个后端；部分行程沿热门路线生成，路线聚类结果不为空"""
+    data_file = tmp_path_factory.mktemp('backend') / 'trips.parquet'
+    make_synthetic_trips(20_000, seed=7, days=10, route_share=0.3).to_parquet(data_file, index=False)
+    oracle = DataProcessor(str(data_file), backend='pandas')
+    duckdb = DataProcessor(str(data_file), backend='duckdb')
+    return oracle, duckdb
+
+
+def random_filters(processor, n, seed=0):
+    """随机的过滤条件：分钟精度的时间段（cube 无法回答，走查询后端），也包括超出数据范围的日期"""
+    rng = np.random.default_rng(seed)
+    first, last = processor.get_date_range()
+    span = (last - first).days
+    filters = []
+    for _ in range(n):
+        start = first + datetime.timedelta(days=int(rng.integers(-2, span + 1)))
+        end = start + datetime.timedelta(days=int(rng.integers(0, span + 1)))
+        start_minutes, end_minutes = np.sort(rng.integers(0, 24 * 60, 2))
+        filters.append(dict(
+            start_date=start, end_date=end,
+            start_time=datetime.time(*divmod(int(start_minutes), 60)),
+            end_time=datetime.time(*divmod(int(end_minutes), 60)),
+            # 一半的条件不按日期类型或天气过滤，避免结果大多为空
+            day_type=str(rng.choice(['所有', '所有', '工作日', '周末'])),
+            weather=str(rng.choice(['所有'] * len(WEATHER_CONDITIONS) + WEATHER_CONDITIONS)),
+        ))
+    return filters
+
+
+def assert_same(expected, actual, path='result'):
+    """递归比较两个后端的查询结果，浮点数允许累加顺序和 float32 存储带来的误差"""
+    if isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True),
+                                      check_dtype=False, rtol=1e-6, obj=path)
+    elif isinstance(expected, (ODMatrix, HourlyHeatmap)):
+        assert_same(vars(expected), vars(actual), path)
+    elif isinstance(expected, dict):
+        assert expected.keys() == actual.keys(), path
+        for key in expected:
+            assert_same(expected[key], actual[key], f'{path}[{key!r}]')
+    elif isinstance(expected, (list, tuple)):
+        assert len(expected) == len(actual), path
+        for i, (left, right) in enumerate(zip(expected, actual)):
+            assert_same(left, right, f'{path}[{i}]')
+    elif isinstance(expected, (float, np.floating, np.ndarray)):
+        np.testing.assert_allclose(expected, actual, rtol=1e-6, equal_nan=True, err_msg=path)
+    else:
+        assert expected == actual, path
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_queries_match_pandas_oracle(processors, query):
+    oracle, duckdb = processors
+    for filters in random_filters(oracle, N_FILTERS):
+        expected = getattr(oracle, query)(**filters)
+        actual = getattr(duckdb, query)(**filters)
+        assert_same(expected, actual, f'{query}({filters})')
+
+
+def test_od_matrix_by_hour_matches(processors):
+    oracle, duckdb = processors
+    for filters in random_filters(oracle, N_FILTERS, seed=1):
+        assert_same(oracle.query_od_matrix(**filters, by_hour=True), duckdb.query_od_matrix(**filters, by_hour=True))
+
+
+def test_filter_data_matches(processors):
+    oracle, duckdb = processors
+    keys = ['pickup_datetime', 'dropoff_datetime', 'trip_miles', 'driver_pay']
+    for filters in random_filters(oracle, N_FILTERS, seed=2):
+        expected = oracle.filter_data(*filters.values()).drop(columns=['source_id'])
+        actual = duckdb.filter_data(*filters.values())
+        # 上车时间相同的行在两个后端中的顺序可能不同
+        assert_same(expected.sort_values(keys).reset_index(drop=True), actual.sort_values(keys).reset_index(drop=True))
@@ -0,0 +1,65 @@
+import datetime
+import numpy as np
+import pytest
+from benchmark import make_synthetic_trips
+from data_processor import DataProcessor
+
+# 采样保留的行数（约为全部行程的四分之一）
+SAMPLE_SIZE = 5000
+# 采样换算后的行程数与 cube 结果允许的相对误差
+COUNT_RTOL = 0.05
+
+
+@pytest.fixture(scope='module')
+def processor(tmp_path_factory):
+    """采样加载的 DataProcessor：cube 覆盖全部行程，行数据只保留 SAMPLE_SIZE 行"""
+    data_file = tmp_path_factory.mktemp('sampling') / 'trips.parquet'
+    make_synthetic_trips(20_000, seed=3, days=10).to_parquet(data_file, index=False)
+    return DataProcessor(str(data_file), sample_size=SAMPLE_SIZE)
+
+
+def windows(processor):
+    """全部日期上的两个几乎相同的时间段：整小时的由 cube 回答，差一分钟的回退到行扫描"""
+    start_date, end_date = processor.get_date_range()
+    whole = (start_date, end_date, datetime.time(0, 0), datetime.time(23, 59))
+    minute = (start_date, end_date, datetime.time(0, 0), datetime.time(23, 58))
+    return whole, minute
+
+
+def test_sample_scale(processor):
+    assert len(processor.data) == SAMPLE_SIZE
+    assert processor.sample_scale() == pytest.approx(processor.cube.daily_hourly[..., 0].sum() / SAMPLE_SIZE)
+
+
+def test_metrics_count_same_scale(processor):
+    whole, minute = windows(processor)
+    cube_count = processor.query_metrics(*whole)['count']
+    scan_count = processor.query_metrics(*minute)['count']
+    assert cube_count > 3 * SAMPLE_SIZE
+    assert scan_count == pytest.approx(cube_count, rel=COUNT_RTOL)
+
+
+@pytest.mark.parametrize('query', ['query_hourly_distribution', 'query_weekday_weekend_comparison',
+                                   'query_zone_traffic'])
+def test_grouped_counts_same_scale(processor, query):
+    whole, minute = windows(processor)
+    cube_total = getattr(processor, query)(*whole)['count'].sum()
+    scan_total = getattr(processor, query)(*minute)['count'].sum()
+    assert scan_total == pytest.approx(cube_total, rel=COUNT_RTOL)
+
+
+def test_od_matrix_same_scale(processor):
+    whole, minute = windows(processor)
+    total = processor.query_metrics(*whole)['count']
+    assert processor.query_od_matrix(*minute).counts.sum() == pytest.approx(total, rel=COUNT_RTOL)
+
+
+def test_no_sampling_keeps_exact_counts(tmp_path):
+    data_file = tmp_path / 'trips.parquet'
+    make_synthetic_trips(2_000, seed=4, days=3).to_parquet(data_file, index=False)
+    processor = DataProcessor(str(data_file))
+    whole, minute = windows(processor)
+    assert processor.sample_scale() == 1.0
+    assert processor.query_metrics(*minute)['count'] == len(processor.filter_data(*minute))
+    assert np.array_equal(processor.query_hourly_distribution(*minute)['count'],
+                          processor.get_hourly_distribution(processor.filter_data(*minute))['count'])
@@ -0,0 +1,392 @@
+import hashlib
+import json
+import os
+import numpy as np
+from matplotlib.path import Path
+from scipy.spatial import cKDTree
+
+# 默认查找的官方出租车区域文件（NYC TLC Taxi Zones，WGS84 经纬度）
+DEFAULT_ZONE_FILES = ['taxi_zones.geojson', 'taxi_zones.json', 'taxi_zones.zip', 'taxi_zones.shp']
+
+# 多边形简化容差（度，约 50 米）
+SIMPLIFY_TOLERANCE = 0.0005
+# 点在多边形内判断时空间索引网格的划分数
+GRID_SIZE = 128
+
+# 区域数不超过该值时用 NumPy 广播求最近中心，否则使用 KD 树
+BROADCAST_MAX_ZONES = 32
+# 广播计算时每批处理的点数，限制临时数组大小
+ZONE_ASSIGN_CHUNK = 200_000
+
+# 简化的五大区划分（没有官方区域文件时使用）
+DEFAULT_ZONES = {
+    1: {"name": "曼哈顿", "center": [40.7831, -73.9712]},
+    2: {"name": "布鲁克林", "center": [40.6782, -73.9442]},
+    3: {"name": "皇后区", "center": [40.7282, -73.7949]},
+    4: {"name": "布朗克斯", "center": [40.8448, -73.8648]},
+    5: {"name": "斯塔顿岛", "center": [40.5795, -74.1502]}
+}
+
+
+def simplify_ring(points, tolerance=SIMPLIFY_TOLERANCE):
+    """
+    使用 Douglas-Peucker 算法简化多边形的一个环
+    :param points: (n, 2) 坐标数组，首尾相同
+    :param tolerance: 简化容差
+    :return: 简化后的坐标数组
+    """
+    n = len(points)
+    if n <= 4:
+        return points
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        segment = points[start + 1:end]
+        a, b = points[start], points[end]
+        dx, dy = b - a
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            dist = np.hypot(segment[:, 0] - a[0], segment[:, 1] - a[1])
+        else:
+            dist = np.abs(dx * (segment[:, 1] - a[1]) - dy * (segment[:, 0] - a[0])) / norm
+        i = dist.argmax()
+        if dist[i] > tolerance:
+            k = start + 1 + i
+            keep[k] = True
+            stack.append((start, k))
+            stack.append((k, end))
+
+    simplified = points[keep]
+    return simplified if len(simplified) >= 4 else points
+
+
+def signed_area(ring):
+    """多边形环的有向面积：逆时针为正，顺时针为负"""
+    x, y = ring[:, 0], ring[:, 1]
+    return (x[:-1] * y[1:] - x[1:] * y[:-1]).sum() / 2
+
+
+def ring_centroid(ring):
+    """计算多边形环的面积与质心，返回 (面积, 经度, 纬度)"""
+    x, y = ring[:, 0], ring[:, 1]
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    area = cross.sum() / 2
+    if area == 0:
+        return 0.0, x.mean(), y.mean()
+    cx = ((x[:-1] + x[1:]) * cross).sum() / (6 * area)
+    cy = ((y[:-1] + y[1:]) * cross).sum() / (6 * area)
+    return abs(area), cx, cy
+
+
+def polygon_centroid(polygon):
+    """计算带洞多边形的面积与质心（外环面积减去洞的面积），返回 (面积, 经度, 纬度)"""
+    stats = np.array([ring_centroid(ring) for ring in polygon])
+    areas = stats[:, 0].copy()
+    areas[1:] *= -1
+    area = areas.sum()
+    if area <= 0:
+        return ring_centroid(polygon[0])
+    return area, (areas * stats[:, 1]).sum() / area, (areas * stats[:, 2]).sum() / area
+
+
+def assemble_polygons(rings):
+    """
+    按 shapefile 的约定将环组装为多边形：顺时针的环为外环，逆时针的环为洞，归入包含它的最小外环
+    不属于任何外环的逆时针环（不遵守约定的文件）按外环处理
+    :param rings: 环的列表，每个环为 (n, 2) 的 [经度, 纬度] 数组
+    :return: 多边形列表，每个多边形为 [外环, 洞...]
+    """
+    outers = [ring for ring in rings if signed_area(ring) < 0]
+    holes = [ring for ring in rings if signed_area(ring) >= 0]
+    polygons = [[ring] for ring in outers]
+    paths = [Path(ring) for ring in outers]
+    areas = [abs(signed_area(ring)) for ring in outers]
+    for hole in holes:
+        # 以包含洞的顶点最多的外环为准（洞可能与外环共用顶点），相同时取面积最小的外环
+        shares = [path.contains_points(hole).mean() for path in paths]
+        if shares and max(shares) > 0:
+            polygons[min(range(len(paths)), key=lambda i: (-shares[i], areas[i]))].append(hole)
+        else:
+            polygons.append([hole])
+    return polygons
+
+
+class TaxiZones:
+    """以区域编号（官方数据中即 LocationID）为下标的区域查找表"""
+
+    def __init__(self, zone_ids, names, boroughs, polygons, official=True):
+        """
+        :param zone_ids: 区域编号列表
+        :param names: 区域名称列表
+        :param boroughs: 所属行政区列表
+        :param polygons: 每个区域的多边形列表，每个多边形为 [外环, 洞...]，每个环为 (n, 2) 的 [经度, 纬度] 数组
+        :param official: 是否为官方出租车区域（编号与 PULocationID/DOLocationID 对应）
+        """
+        self.official = official
+        self.location_ids = np.asarray(zone_ids, dtype=np.int16)
+        size = int(self.location_ids.max()) + 1
+
+        # 以编号为下标的查找数组，缺失的编号为 NaN / 空字符串 / -1
+        self.names = np.full(size, '', dtype=object)
+        self.borough_names = sorted(set(boroughs))
+        self.borough_codes = np.full(size, -1, dtype=np.int8)
+        self.centroid_lat = np.full(size, np.nan)
+        self.centroid_lon = np.full(size, np.nan)
+        self.polygons = [[] for _ in range(size)]
+
+        for zone_id, name, borough, zone_polygons in zip(self.location_ids, names, boroughs, polygons):
+            zone_polygons = [[simplify_ring(np.asarray(ring, dtype=np.float64)) for ring in polygon]
+                             for polygon in zone_polygons]
+            self.names[zone_id] = name
+            self.borough_codes[zone_id] = self.borough_names.index(borough)
+            self.polygons[zone_id] = zone_polygons
+
+            # 面积加权的质心（扣除洞）
+            stats = np.array([polygon_centroid(polygon) for polygon in zone_polygons])
+            weights = stats[:, 0] if stats[:, 0].sum() > 0 else None
+            self.centroid_lon[zone_id] = np.average(stats[:, 1], weights=weights)
+            self.centroid_lat[zone_id] = np.average(stats[:, 2], weights=weights)
+
+        # 简化后的区域几何的指纹，区域文件变化时特征库中的区域分配随之失效
+        digest = hashlib.sha1()
+        for zone_id in self.location_ids:
+            for polygon in self.polygons[zone_id]:
+                digest.update(np.int64([zone_id, len(polygon)]).tobytes())
+                for ring in polygon:
+                    digest.update(ring.tobytes())
+        self.fingerprint = digest.hexdigest()
+
+        self.centers = np.column_stack([self.centroid_lat[self.location_ids], self.centroid_lon[self.location_ids]])
+        self.center_tree = cKDTree(self.centers)
+        self.geojson = self.build_geojson()
+        if self.official:
+            self.build_spatial_index()
+
+    def __len__(self):
+        return len(self.location_ids)
+
+    def normalize_ids(self, ids):
+        """将 LocationID 转换为区域编号，不在区域表中的编号（如 264/265 未知区域）记为 0"""
+        ids = np.asarray(ids)
+        known = np.zeros(len(self.names), dtype=bool)
+        known[self.location_ids] = True
+        valid = (ids >= 0) & (ids < len(known))
+        valid[valid] = known[ids[valid]]
+        return np.where(valid, ids, 0).astype(np.int16)
+
+    def build_geojson(self):
+        """生成简化后的 GeoJSON，feature 的 id 即区域编号"""
+        features = []
+        for zone_id in self.location_ids:
+            features.append({
+                "type": "Feature",
+                "id": int(zone_id),
+                "properties": {
+                    "zone_id": int(zone_id),
+                    "name": self.names[zone_id],
+                    "borough": self.borough_names[self.borough_codes[zone_id]]
+                },
+                "geometry": {
+                    "type": "MultiPolygon",
+                    "coordinates": [[ring.tolist() for ring in polygon] for polygon in self.polygons[zone_id]]
+                }
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+    def build_spatial_index(self):
+        """构建网格空间索引：记录每个区域包围盒覆盖的网格单元"""
+        all_points = np.concatenate([polygon[0] for zone_id in self.location_ids for polygon in self.polygons[zone_id]])
+        self.grid_min = all_points.min(axis=0)
+        self.grid_step = (all_points.max(axis=0) - self.grid_min) / GRID_SIZE
+
+        self.zone_cells = []
+        for zone_id in self.location_ids:
+            polygons = self.polygons[zone_id]
+            points = np.concatenate([polygon[0] for polygon in polygons])
+            low = np.clip(((points.min(axis=0) - self.grid_min) / self.grid_step).astype(int), 0, GRID_SIZE - 1)
+            high = np.clip(((points.max(axis=0) - self.grid_min) / self.grid_step).astype(int), 0, GRID_SIZE - 1)
+            cols, rows = np.meshgrid(np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1))
+            cells = np.unique(rows.ravel() * GRID_SIZE + cols.ravel())
+            paths = [(Path(polygon[0]), [Path(hole) for hole in polygon[1:]]) for polygon in polygons]
+            self.zone_cells.append((zone_id, paths, cells))
+
+    def nearest(self, lat, lon):
+        """将经纬度分配到最近的区域中心"""
+        if len(self) > BROADCAST_MAX_ZONES:
+            _, nearest = self.center_tree.query(np.column_stack([lat, lon]), workers=-1)
+            return self.location_ids[nearest]
+
+        # 区域较少时直接广播计算到所有中心的距离，分批避免临时数组过大
+        nearest = np.empty(len(lat), dtype=np.intp)
+        for start in range(0, len(lat), ZONE_ASSIGN_CHUNK):
+            end = start + ZONE_ASSIGN_CHUNK
+            dist = ((lat[start:end, None] - self.centers[:, 0]) ** 2
+                    + (lon[start:end, None] - self.centers[:, 1]) ** 2)
+            nearest[start:end] = dist.argmin(axis=1)
+        return self.location_ids[nearest]
+
+    def assign(self, lat, lon):
+        """
+        向量化地将经纬度分配到区域
+        官方区域使用点在多边形内判断（网格索引预筛选，落在洞内的点不属于该多边形），落在所有区域之外的点归入最近的区域中心；
+        简化区域直接使用最近中心
+        :return: 区域编号数组（int16）
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if not self.official:
+            return self.nearest(lat, lon)
+
+        result = np.zeros(len(lat), dtype=np.int16)
+
+        # 按网格单元排序，每个区域只检查其包围盒覆盖的单元内的点
+        col = np.floor((lon - self.grid_min[0]) / self.grid_step[0]).astype(np.int64)
+        row = np.floor((lat - self.grid_min[1]) / self.grid_step[1]).astype(np.int64)
+        inside_grid = (col >= 0) & (col < GRID_SIZE) & (row >= 0) & (row < GRID_SIZE)
+        cell = np.where(inside_grid, row * GRID_SIZE + col, -1)
+        order = np.argsort(cell, kind='stable')
+        sorted_cells = cell[order]
+
+        for zone_id, paths, cells in self.zone_cells:
+            starts = np.searchsorted(sorted_cells, cells, side='left')
+            ends = np.searchsorted(sorted_cells, cells, side='right')
+            chunks = [order[s:e] for s, e in zip(starts, ends) if e > s]
+            if not chunks:
+                continue
+            candidates = np.concatenate(chunks)
+            candidates = candidates[result[candidates] == 0]
+            if len(candidates) == 0:
+                continue
+            points = np.column_stack([lon[candidates], lat[candidates]])
+            inside = np.zeros(len(candidates), dtype=bool)
+            for outer, holes in paths:
+                in_polygon = outer.contains_points(points)
+                for hole in holes:
+                    in_polygon[in_polygon] &= ~hole.contains_points(points[in_polygon])
+                inside |= in_polygon
+            result[candidates[inside]] = zone_id
+
+        missing = result == 0
+        if missing.any():
+            result[missing] = self.nearest(lat[missing], lon[missing])
+        return result
+
+
+def default_zones():
+    """简化的五大区划分：以中心点为基础的 0.1° 矩形"""
+    polygons = []
+    for zone_info in DEFAULT_ZONES.values():
+        lat, lon = zone_info["center"]
+        polygons.append([[np.array([
+            [lon - 0.05, lat - 0.05],
+            [lon + 0.05, lat - 0.05],
+            [lon + 0.05, lat + 0.05],
+            [lon - 0.05, lat + 0.05],
+            [lon - 0.05, lat - 0.05]
+        ])]])
+    names = [zone_info["name"] for zone_info in DEFAULT_ZONES.values()]
+    return TaxiZones(list(DEFAULT_ZONES.keys()), names, names, polygons, official=False)
+
+
+def get_property(properties, *keys):
+    """不区分大小写地读取属性值"""
+    lowered = {key.lower(): value for key, value in properties.items()}
+    for key in keys:
+        if key.lower() in lowered:
+            return lowered[key.lower()]
+    return None
+
+
+def group_zone_records(records):
+    """
+    按 LocationID 合并区域记录（官方数据中个别 LocationID 对应多个多边形）
+    :param records: (LocationID, 区域名, 行政区, 多边形列表) 的列表，每个多边形为 [外环, 洞...]
+    """
+    grouped = {}
+    for zone_id, name, borough, polygons in records:
+        if zone_id not in grouped:
+            grouped[zone_id] = [name, borough, []]
+        grouped[zone_id][2].extend(polygons)
+    zone_ids = sorted(grouped)
+    return (zone_ids,
+            [grouped[zone_id][0] for zone_id in zone_ids],
+            [grouped[zone_id][1] for zone_id in zone_ids],
+            [grouped[zone_id][2] for zone_id in zone_ids])
+
+
+def load_geojson_zones(file_path):
+    """从 GeoJSON 文件加载官方出租车区域（坐标须为 WGS84 经纬度）"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        collection = json.load(f)
+
+    records = []
+    for feature in collection['features']:
+        properties = feature.get('properties') or {}
+        zone_id = get_property(properties, 'LocationID', 'location_id')
+        geometry = feature['geometry']
+        if zone_id is None or geometry is None:
+            continue
+        # GeoJSON 的多边形第一个环为外环，其余为洞
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        polygons = [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon] for polygon in polygons]
+        records.append((int(zone_id), get_property(properties, 'zone') or str(zone_id),
+                        get_property(properties, 'borough') or '', polygons))
+    return TaxiZones(*group_zone_records(records))
+
+
+def load_shapefile_zones(file_path):
+    """
+    从 shapefile（或其 zip 包）加载官方出租车区域
+    需要安装 pyshp；坐标为 NY State Plane (EPSG:2263) 时还需要 pyproj 转换为经纬度
+    """
+    try:
+        import shapefile
+    except ImportError:
+        raise ImportError("读取 shapefile 需要安装 pyshp：pip install pyshp")
+
+    reader = shapefile.Reader(file_path)
+    projected = abs(reader.bbox[0]) > 180
+    transformer = None
+    if projected:
+        try:
+            from pyproj import Transformer
+        except ImportError:
+            raise ImportError("shapefile 使用投影坐标，需要安装 pyproj 转换为经纬度：pip install pyproj")
+        transformer = Transformer.from_crs("EPSG:2263", "EPSG:4326", always_xy=True)
+
+    records = []
+    for shape_record in reader.iterShapeRecords():
+        properties = shape_record.record.as_dict()
+        shape = shape_record.shape
+        points = np.asarray(shape.points, dtype=np.float64)
+        if transformer is not None:
+            points = np.column_stack(transformer.transform(points[:, 0], points[:, 1]))
+        # 按 parts 拆分为各个环，再按环的方向组装为带洞的多边形（投影变换不改变环的方向）
+        bounds = list(shape.parts) + [len(points)]
+        rings = [points[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+        records.append((int(get_property(properties, 'LocationID', 'location_id')),
+                        get_property(properties, 'zone') or '',
+                        get_property(properties, 'borough') or '', assemble_polygons(rings)))
+    reader.close()
+    return TaxiZones(*group_zone_records(records))
+
+
+def load_taxi_zones(zone_file=None):
+    """
+    加载出租车区域：优先使用指定文件，其次查找默认文件，都不存在时使用简化的五大区划分
+    :param zone_file: GeoJSON 或 shapefile 路径
+    """
+    candidates = [zone_file] if zone_file else DEFAULT_ZONE_FILES
+    for file_path in candidates:
+        if file_path and os.path.exists(file_path):
+            if file_path.lower().endswith(('.geojson', '.json')):
+                return load_geojson_zones(file_path)
+            return load_shapefile_zones(file_path)
+    if zone_file:
+        raise FileNotFoundError(f"区域文件不存在: {zone_file}")
+    return default_zones()